@@ -65,7 +65,9 @@ from fastapi.responses import JSONResponse
 import uvicorn
 import random
 from kg_utils import get_kg_context       # ✅ Enhanced KG with NetworkX
-from llm_utils import reason_with_llm, reason_without_llm
+from llm_utils import (
+    reason_with_llm_async, reason_without_llm, get_async_client, close_async_client, get_llm_cache, PROMPT_VERSION
+)
 from dummy_inputs import generate_dummy_input
 
 app = FastAPI(
@@ -103,9 +105,12 @@ def health_check():
     except Exception as e:
         kg_status = f"❌ Error: {str(e)}"
     
+    llm_client = get_async_client()
     return {
         "status": "healthy",
         "knowledge_graph": kg_status,
+        "llm_client": llm_client.stats() if llm_client else "thread fallback (httpx not installed)",
+        "llm_cache": get_llm_cache().stats() if get_llm_cache() else "disabled",
         "endpoints": {
             "/": "Root endpoint",
             "/health": "Health check",
@@ -150,6 +155,8 @@ async def reason_endpoint(request: Request):
         "reasoning_text": "Detailed reasoning",
         "primary_concern": "Disease name if malignant",
         "recommended_action": "Next steps",
+        "cached": true if the LLM answer came from the reasoning cache,
+        "coalesced": true if it was shared with an identical request already waiting on the LLM,
         "kg_context_used": {...},
         "input_used": {...}
     }
@@ -175,9 +182,15 @@ async def reason_endpoint(request: Request):
         
         print(f"📊 KG found {len(kg_context.get('differential_diagnoses', []))} differential diagnoses")
 
-        # ✅ 3. Call the Reasoning LLM with real KG context
+        # ✅ 3. Call the Reasoning LLM with real KG context (non-blocking: other requests keep running)
         print(f"🧠 Calling LLM for reasoning...")
-        reasoning_output = reason_with_llm(imaging_result, clinical_text, kg_context)
+        reasoning_output = await reason_with_llm_async(imaging_result, clinical_text, kg_context)
+        from_cache = reasoning_output.pop("cached", False)
+        coalesced = reasoning_output.pop("coalesced", False)
+        if from_cache:
+            print("⚡ Served from the LLM reasoning cache")
+        elif coalesced:
+            print("⚡ Shared the answer of an identical in-flight request")
 
         # ✅ 4. Add confidence if not provided
         if "confidence" not in reasoning_output or reasoning_output["confidence"] == 0.0:
@@ -195,6 +208,8 @@ async def reason_endpoint(request: Request):
             "reasoning_text": reasoning_output.get("reasoning_text", "Reasoning not available"),
             "primary_concern": reasoning_output.get("primary_concern", "None"),
             "recommended_action": reasoning_output.get("recommended_action", "Consult radiologist"),
+            "cached": from_cache,
+            "coalesced": coalesced,
             "kg_context_used": kg_context,
             "input_used": {
                 "imaging_result": imaging_result,
@@ -292,11 +307,32 @@ async def startup_event():
     except Exception as e:
         print(f"⚠️  Warning: KG initialization issue: {e}")
     
+    llm_client = get_async_client()
+    if llm_client:
+        protocol = "HTTP/2" if llm_client.http2 else "HTTP/1.1"
+        print(f"✅ Async LLM client: {protocol}, up to {llm_client.max_in_flight} calls in flight "
+              f"over {llm_client.max_connections} connections")
+    else:
+        print("⚠️  httpx not installed: LLM calls run in a thread pool")
+
+    llm_cache = get_llm_cache()
+    if llm_cache:
+        print(f"✅ LLM reasoning cache: {llm_cache.path} ({llm_cache.stats()['entries']} entries, "
+              f"prompt version {PROMPT_VERSION})")
+    else:
+        print("⚠️  LLM reasoning cache disabled")
+
     print("\n📡 Server ready on http://localhost:5007")
     print("📚 API Documentation: http://localhost:5007/docs")
     print("=" * 70)
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close the pooled LLM connections"""
+    await close_async_client()
+
+
 # ===== MAIN =====
 
 if __name__ == "__main__":
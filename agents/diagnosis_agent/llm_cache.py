@@ -0,0 +1,204 @@
+# llm_cache.py - Persistent LLM reasoning cache shared by all uvicorn workers
+#
+# /reason inputs come from a small, discrete space (categorical imaging
+# fields, a deterministic KG context, recurring clinical notes), so identical
+# requests are common. Results are stored in one SQLite database in WAL mode:
+# readers never block, and every worker process on the host shares the cache.
+#
+# Keys hash the canonicalized (imaging_result, clinical_text, kg_context,
+# model, prompt version). Entries expire after a TTL, the least recently used
+# ones are evicted above a size cap, and entries written by another prompt
+# version are deleted when the agent starts (see llm_utils.PROMPT_VERSION).
+#
+# Usage:
+#   python llm_cache.py stats
+#   python llm_cache.py clear --path llm_cache.sqlite3
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Next to the agent, so every worker opens the same file whatever its working directory
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.sqlite3")
+
+
+def _canonical(value):
+    """Normalize a value so equivalent requests hash the same"""
+    if isinstance(value, dict):
+        return {str(k).strip().lower(): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+def normalize_notes(clinical_text):
+    """Whitespace-insensitive clinical notes (wording and case are kept)"""
+    return re.sub(r"\s+", " ", str(clinical_text or "")).strip()
+
+
+def cache_key(imaging_result, clinical_text, kg_context, model, prompt_version):
+    """
+    SHA-256 of the canonicalized request.
+    Imaging fields are categorical, so their case and spacing are ignored;
+    the KG context is hashed as-is (sorted keys) since it is part of the prompt.
+    """
+    payload = {
+        "imaging_result": _canonical(imaging_result),
+        "clinical_text": normalize_notes(clinical_text),
+        "kg_context": kg_context,
+        "model": model,
+        "prompt_version": prompt_version
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite-backed reasoning cache with TTL and LRU eviction.
+    Safe to use from several threads and processes: each thread gets its own
+    connection, and SQLite's file locks serialize writers across processes.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=10000, touch_interval=60):
+        """
+        :param path: database file (shared by all workers on the host)
+        :param ttl: seconds an entry stays valid (0 = never expires)
+        :param max_entries: entries kept; the least recently used are evicted beyond this
+        :param touch_interval: a hit rewrites the entry's access time (and hit count) only if it is
+            older than this many seconds, so hot entries do not cost a write per lookup
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    prompt_version TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL: commits survive crashes of the process (not of the OS), without an fsync per write
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # ---------- lookups ----------
+
+    def get(self, key):
+        """Cached result dict, or None when missing or expired"""
+        db = self._connect()
+        row = db.execute("SELECT result, created, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            self.misses += 1
+            return None
+        if self.ttl and now - row[1] > self.ttl:
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+        if now - row[2] >= self.touch_interval:
+            # LRU order only needs access times to touch_interval precision
+            db.execute("UPDATE entries SET accessed = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, result, model, prompt_version):
+        """Store a result; evicts the least recently used entries above the size cap"""
+        db = self._connect()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, prompt_version, model, result, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, prompt_version, model, json.dumps(result), now, now)
+            )
+            if self.max_entries:
+                db.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed "
+                    "LIMIT MAX((SELECT COUNT(*) FROM entries) - ?, 0))",
+                    (self.max_entries,)
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    # ---------- maintenance ----------
+
+    def purge(self, prompt_version=None):
+        """
+        Delete expired entries and, given the current prompt version, every entry
+        written by another one. Returns the number of entries deleted.
+        """
+        db = self._connect()
+        deleted = 0
+        if prompt_version is not None:
+            deleted += db.execute("DELETE FROM entries WHERE prompt_version != ?", (prompt_version,)).rowcount
+        if self.ttl:
+            deleted += db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        return deleted
+
+    def clear(self):
+        return self._connect().execute("DELETE FROM entries").rowcount
+
+    def stats(self):
+        db = self._connect()
+        entries, stored_hits = db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM entries").fetchone()
+        versions = dict(db.execute("SELECT prompt_version, COUNT(*) FROM entries GROUP BY prompt_version").fetchall())
+        return {
+            "path": self.path,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "prompt_versions": versions,
+            # Hits that refreshed an entry's access time (at most one per touch_interval)
+            "stored_hits": stored_hits,
+            "worker_hits": self.hits,
+            "worker_misses": self.misses
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear the LLM reasoning cache")
+    parser.add_argument("command", choices=["stats", "purge", "clear"])
+    parser.add_argument("--path", default=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH))
+    args = parser.parse_args()
+
+    cache = LLMCache(args.path, ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))))
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "purge":
+        # Stale prompt versions need llm_utils (and its API key) to know the current one
+        from llm_utils import PROMPT_VERSION
+        print(f"🧹 Deleted {cache.purge(PROMPT_VERSION)} stale entries")
+    else:
+        print(f"🧹 Deleted {cache.clear()} entries")
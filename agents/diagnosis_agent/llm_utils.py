@@ -120,9 +120,21 @@
 import os
 import re
 import json
+import asyncio
+import hashlib
+import importlib.util
+import inspect
+import sqlite3
 import requests
 from dotenv import load_dotenv
 
+from llm_cache import LLMCache, cache_key, DEFAULT_CACHE_PATH
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 # Load environment variables
 load_dotenv()
 
@@ -133,7 +145,23 @@ if not OPENROUTER_API_KEY:
     raise ValueError("❌ OPENROUTER_API_KEY not found in environment variables (.env file)")
 
 # OpenRouter endpoint
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+LLM_MODEL = "openai/gpt-4o-mini"  # Updated model string for OpenRouter
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+
+# Async client limits (per worker process)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "256"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+H2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Persistent reasoning cache shared by all workers (see llm_cache.py)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH)
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
 
 
 def format_kg_context_for_llm(kg_context: dict) -> str:
@@ -174,22 +202,17 @@ def format_kg_context_for_llm(kg_context: dict) -> str:
     return formatted
 
 
-def reason_with_llm(imaging_result, clinical_text, kg_context):
-    """
-    Uses OpenRouter API to reason over patient data using structured KG evidence
-    """
-    try:
-        # 🧠 Step 1: Format KG context nicely
-        kg_formatted = format_kg_context_for_llm(kg_context)
-        
-        # 🧠 Step 2: Construct enhanced prompt
-        prompt = f"""
+# ===== PROMPT =====
+
+SYSTEM_PROMPT = "You are a precise medical reasoning assistant specializing in breast cancer diagnosis. Always respond in valid JSON only. Use the Knowledge Graph evidence to support your reasoning."
+
+PROMPT_TEMPLATE = """
 You are an expert breast cancer diagnostic reasoning agent. Analyze the following patient data and provide a diagnostic assessment.
 
 {kg_formatted}
 
 📋 RAW IMAGING DATA:
-{json.dumps(imaging_result, indent=2)}
+{imaging_json}
 
 📋 CLINICAL NOTES:
 {clinical_text}
@@ -210,100 +233,344 @@ Respond **only** in JSON format:
 }}
 """
 
-        # 🧩 Step 3: Set headers and payload
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "http://localhost",
-            "X-Title": "ReasoningAgent"
-        }
+LLM_TEMPERATURE = 0.2  # Lower temperature for more deterministic medical reasoning
+LLM_MAX_TOKENS = 800
 
-        data = {
-            "model": "openai/gpt-4o-mini",  # Updated model string for OpenRouter
-            "messages": [
-                {
-                    "role": "system", 
-                    "content": "You are a precise medical reasoning assistant specializing in breast cancer diagnosis. Always respond in valid JSON only. Use the Knowledge Graph evidence to support your reasoning."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.2,  # Lower temperature for more deterministic medical reasoning
-            "max_tokens": 800
-        }
 
-        # 🧩 Step 4: Call API
-        response = requests.post(OPENROUTER_URL, headers=headers, json=data, timeout=30)
-
-        # Handle API errors
-        if response.status_code != 200:
-            return {
-                "diagnosis": "Unknown",
-                "confidence": 0.0,
-                "reasoning_text": f"API Error: {response.status_code} - {response.text}",
-                "primary_concern": "Error",
-                "recommended_action": "System error - retry request"
-            }
+def _prompt_version():
+    """
+    Hash of everything that shapes the LLM's answer besides the inputs: editing
+    the template, the system prompt, the sampling settings or the KG formatting
+    changes it, and cached answers of older versions are dropped
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for part in (SYSTEM_PROMPT, PROMPT_TEMPLATE, LLM_TEMPERATURE, LLM_MAX_TOKENS):
+        digest.update(repr(part).encode("utf-8"))
+    try:
+        digest.update(inspect.getsource(format_kg_context_for_llm).encode("utf-8"))
+    except (OSError, TypeError):
+        pass
+    return digest.hexdigest()
+
+
+PROMPT_VERSION = _prompt_version()
+
+
+def build_llm_request(imaging_result, clinical_text, kg_context):
+    """
+    Build the OpenRouter headers and payload for one reasoning call
+    """
+    # 🧠 Step 1: Format KG context nicely
+    kg_formatted = format_kg_context_for_llm(kg_context)
+
+    # 🧠 Step 2: Construct enhanced prompt
+    prompt = PROMPT_TEMPLATE.format(
+        kg_formatted=kg_formatted,
+        imaging_json=json.dumps(imaging_result, indent=2),
+        clinical_text=clinical_text
+    )
+
+    # 🧩 Step 3: Set headers and payload
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost",
+        "X-Title": "ReasoningAgent"
+    }
+
+    data = {
+        "model": LLM_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": LLM_TEMPERATURE,
+        "max_tokens": LLM_MAX_TOKENS
+    }
+    return headers, data
+
+
+# primary_concern values of error_result() answers (never cached)
+ERROR_CONCERNS = {"Error", "Timeout Error", "System Error", "Parsing Error"}
+
+
+def error_result(reasoning_text, primary_concern, recommended_action):
+    """Diagnosis-shaped result for a failed LLM call"""
+    return {
+        "diagnosis": "Unknown",
+        "confidence": 0.0,
+        "reasoning_text": reasoning_text,
+        "primary_concern": primary_concern,
+        "recommended_action": recommended_action
+    }
+
 
-        # 🧩 Step 5: Extract model reply
-        content = response.json()["choices"][0]["message"]["content"].strip()
+def parse_llm_response(status_code, text, body):
+    """
+    Turn an OpenRouter response (status, raw text, decoded JSON body) into the diagnosis dict
+    """
+    # Handle API errors
+    if status_code != 200:
+        return error_result(f"API Error: {status_code} - {text}", "Error", "System error - retry request")
+
+    # 🧩 Step 5: Extract model reply
+    content = body["choices"][0]["message"]["content"].strip()
 
-        # 🧩 Step 6: Clean markdown-wrapped JSON (```json ... ```)
-        content = re.sub(r"^```json\s*|\s*```$", "", content.strip())
+    # 🧩 Step 6: Clean markdown-wrapped JSON (```json ... ```)
+    content = re.sub(r"^```json\s*|\s*```$", "", content.strip())
 
-        # 🧩 Step 7: Parse JSON safely
+    # 🧩 Step 7: Parse JSON safely
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        # Fallback: try to extract JSON substring
+        match = re.search(r"\{.*\}", content, re.DOTALL)
         try:
-            parsed = json.loads(content)
+            parsed = json.loads(match.group(0)) if match else None
         except json.JSONDecodeError:
-            # Fallback: try to extract JSON substring
-            match = re.search(r"\{.*\}", content, re.DOTALL)
-            if match:
-                try:
-                    parsed = json.loads(match.group(0))
-                except json.JSONDecodeError:
-                    parsed = {
-                        "diagnosis": "Unknown",
-                        "confidence": 0.0,
-                        "reasoning_text": content,
-                        "primary_concern": "Parsing Error",
-                        "recommended_action": "Manual review required"
-                    }
-            else:
-                parsed = {
-                    "diagnosis": "Unknown",
-                    "confidence": 0.0,
-                    "reasoning_text": content,
-                    "primary_concern": "Parsing Error",
-                    "recommended_action": "Manual review required"
-                }
-
-        # 🧩 Step 8: Ensure all required fields exist
-        parsed.setdefault("diagnosis", "Unknown")
-        parsed.setdefault("confidence", 0.0)
-        parsed.setdefault("reasoning_text", "No reasoning provided")
-        parsed.setdefault("primary_concern", "None")
-        parsed.setdefault("recommended_action", "Consult with radiologist")
-
-        return parsed
+            parsed = None
+        if parsed is None:
+            parsed = error_result(content, "Parsing Error", "Manual review required")
+
+    # 🧩 Step 8: Ensure all required fields exist
+    parsed.setdefault("diagnosis", "Unknown")
+    parsed.setdefault("confidence", 0.0)
+    parsed.setdefault("reasoning_text", "No reasoning provided")
+    parsed.setdefault("primary_concern", "None")
+    parsed.setdefault("recommended_action", "Consult with radiologist")
+
+    return parsed
+
+
+def _call_llm(imaging_result, clinical_text, kg_context):
+    try:
+        headers, data = build_llm_request(imaging_result, clinical_text, kg_context)
+
+        # 🧩 Step 4: Call API
+        response = requests.post(OPENROUTER_URL, headers=headers, json=data, timeout=LLM_TIMEOUT)
+        body = response.json() if response.status_code == 200 else None
+        return parse_llm_response(response.status_code, response.text, body)
 
     except requests.exceptions.Timeout:
-        return {
-            "diagnosis": "Unknown",
-            "confidence": 0.0,
-            "reasoning_text": "Request timeout - API took too long to respond",
-            "primary_concern": "Timeout Error",
-            "recommended_action": "Retry request"
-        }
+        return error_result("Request timeout - API took too long to respond", "Timeout Error", "Retry request")
     except Exception as e:
         # Catch all runtime errors
+        return error_result(f"Exception occurred: {str(e)}", "System Error", "Check logs and retry")
+
+
+# ===== REASONING CACHE =====
+
+_llm_cache = None
+
+
+def get_llm_cache():
+    """
+    The worker's LLMCache (None when disabled). Opening it drops entries of
+    other prompt versions, so a changed prompt never serves stale answers.
+    """
+    global _llm_cache
+    if _llm_cache is None and LLM_CACHE_ENABLED:
+        try:
+            _llm_cache = LLMCache(LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+            stale = _llm_cache.purge(PROMPT_VERSION)
+            if stale:
+                print(f"🧹 LLM cache: dropped {stale} stale entries (prompt version {PROMPT_VERSION})")
+        except sqlite3.Error as e:
+            print(f"⚠️  LLM cache unavailable ({e}); every call goes to the API")
+            _llm_cache = None
+    return _llm_cache
+
+
+def request_key(imaging_result, clinical_text, kg_context):
+    return cache_key(imaging_result, clinical_text, kg_context, LLM_MODEL, PROMPT_VERSION)
+
+
+def cache_lookup(key):
+    cache = get_llm_cache()
+    try:
+        return cache.get(key) if cache else None
+    except sqlite3.Error as e:
+        # A cache problem must never fail a diagnosis
+        print(f"⚠️  LLM cache read failed: {e}")
+        return None
+
+
+def cache_store(key, result):
+    cache = get_llm_cache()
+    if cache is None or result.get("primary_concern") in ERROR_CONCERNS:
+        return
+    try:
+        cache.put(key, result, LLM_MODEL, PROMPT_VERSION)
+    except sqlite3.Error as e:
+        print(f"⚠️  LLM cache write failed: {e}")
+
+
+def reason_with_llm(imaging_result, clinical_text, kg_context):
+    """
+    Uses OpenRouter API to reason over patient data using structured KG evidence
+    (blocking; async endpoints use reason_with_llm_async). Answers are cached;
+    a cached answer carries "cached": True
+    """
+    key = request_key(imaging_result, clinical_text, kg_context)
+    cached = cache_lookup(key)
+    if cached is not None:
+        return dict(cached, cached=True)
+    result = _call_llm(imaging_result, clinical_text, kg_context)
+    cache_store(key, result)
+    return result
+
+
+# ===== ASYNC CLIENT: pooled, non-blocking LLM calls =====
+
+class AsyncLLMClient:
+    """
+    Shared keep-alive connection pool for OpenRouter calls from async endpoints.
+
+    A slow LLM call only suspends its own request, so one worker can have
+    hundreds of calls in flight. With HTTP/2 (needs the ``h2`` package) they
+    are multiplexed over a few connections; over HTTP/1.1 calls beyond
+    ``max_connections`` wait for a free pooled connection.
+    """
+
+    def __init__(self, max_in_flight=LLM_MAX_IN_FLIGHT, max_connections=LLM_MAX_CONNECTIONS,
+                 max_keepalive=LLM_MAX_KEEPALIVE, timeout=LLM_TIMEOUT, http2=LLM_HTTP2):
+        """
+        :param max_in_flight: concurrent LLM calls per worker; further calls queue
+        :param max_connections: open connections to the API
+        :param max_keepalive: idle connections kept open for reuse
+        :param timeout: seconds for connecting / each read / waiting for a pooled connection
+        :param http2: use HTTP/2 when the h2 package is installed
+        """
+        self.max_in_flight = max_in_flight
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.timeout = timeout
+        self.http2 = http2 and H2_AVAILABLE
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._client = None
+        self._semaphore = None
+
+    def _get_client(self):
+        # Created on first use, inside the server's event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._client
+
+    async def reason(self, imaging_result, clinical_text, kg_context):
+        """Async reason_with_llm: same prompt, same result dict"""
+        try:
+            headers, data = build_llm_request(imaging_result, clinical_text, kg_context)
+            client = self._get_client()
+            async with self._semaphore:
+                self.in_flight += 1
+                try:
+                    response = await client.post(OPENROUTER_URL, headers=headers, json=data)
+                finally:
+                    self.in_flight -= 1
+            body = response.json() if response.status_code == 200 else None
+            result = parse_llm_response(response.status_code, response.text, body)
+            if response.status_code == 200:
+                self.completed += 1
+            else:
+                self.failed += 1
+            return result
+
+        except httpx.TimeoutException:
+            self.failed += 1
+            return error_result("Request timeout - API took too long to respond", "Timeout Error", "Retry request")
+        except Exception as e:
+            self.failed += 1
+            return error_result(f"Exception occurred: {str(e)}", "System Error", "Check logs and retry")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
         return {
-            "diagnosis": "Unknown",
-            "confidence": 0.0,
-            "reasoning_text": f"Exception occurred: {str(e)}",
-            "primary_concern": "System Error",
-            "recommended_action": "Check logs and retry"
+            "http2": self.http2,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_connections": self.max_connections,
+            "completed": self.completed,
+            "failed": self.failed
         }
 
 
+_async_client = None
+
+
+def get_async_client():
+    """The worker's shared AsyncLLMClient (None without httpx)"""
+    global _async_client
+    if _async_client is None and httpx is not None:
+        _async_client = AsyncLLMClient()
+    return _async_client
+
+
+async def _call_llm_async(imaging_result, clinical_text, kg_context):
+    client = get_async_client()
+    if client is None:
+        # Without httpx, keep the event loop free by running the blocking call in a thread
+        return await asyncio.to_thread(_call_llm, imaging_result, clinical_text, kg_context)
+    return await client.reason(imaging_result, clinical_text, kg_context)
+
+
+# Cache misses currently waiting on the API, by request key
+_pending = {}
+
+
+async def reason_with_llm_async(imaging_result, clinical_text, kg_context):
+    """
+    Non-blocking reason_with_llm for async endpoints. Identical requests
+    arriving while the first one is still waiting on the API share its answer;
+    those carry "coalesced": True ("cached" is only set for cache hits).
+    """
+    key = request_key(imaging_result, clinical_text, kg_context)
+    # SQLite may wait on another worker's write lock; keep that off the event loop
+    cached = await asyncio.to_thread(cache_lookup, key)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    pending = _pending.get(key)
+    if pending is not None:
+        await asyncio.wait([pending])
+        if not pending.cancelled():
+            return dict(pending.result(), coalesced=True)
+
+    future = asyncio.get_running_loop().create_future()
+    _pending[key] = future
+    try:
+        result = await _call_llm_async(imaging_result, clinical_text, kg_context)
+        await asyncio.to_thread(cache_store, key, result)
+        future.set_result(result)
+        return result
+    finally:
+        if _pending.get(key) is future:
+            del _pending[key]
+        if not future.done():
+            future.cancel()
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
 # ===== OPTIONAL: Fallback reasoning without LLM =====
 def reason_without_llm(imaging_result, clinical_text, kg_context):
     """
@@ -0,0 +1,161 @@
+# admission.py - Admission control and request deadlines for the imaging agent
+
+import asyncio
+import math
+import time
+
+
+class DeadlineExceeded(Exception):
+    """The client's deadline passed before the image was processed"""
+
+
+def check_deadline(deadline):
+    """Raise DeadlineExceeded if a time.monotonic() deadline has passed"""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded("Request deadline exceeded before inference")
+
+
+def parse_deadline(timeout_ms=None, deadline_epoch=None, default_timeout_ms=0):
+    """
+    Convert header values into a time.monotonic() deadline (or None).
+
+    :param timeout_ms: relative budget in milliseconds (e.g. X-Request-Timeout-Ms)
+    :param deadline_epoch: absolute Unix time in seconds (e.g. X-Request-Deadline)
+    :param default_timeout_ms: budget used when the client sends neither (0 = no deadline)
+    """
+    now = time.monotonic()
+    deadlines = []
+    if timeout_ms not in (None, ""):
+        deadlines.append(now + float(timeout_ms) / 1000.0)
+    if deadline_epoch not in (None, ""):
+        deadlines.append(now + float(deadline_epoch) - time.time())
+    if not deadlines and default_timeout_ms:
+        deadlines.append(now + default_timeout_ms / 1000.0)
+    return min(deadlines) if deadlines else None
+
+
+def call_before_deadline(deadline, fn, *args):
+    """Run fn(*args) on a worker unless the deadline passed while the job was queued"""
+    check_deadline(deadline)
+    return fn(*args)
+
+
+class Overloaded(Exception):
+    """Admission was refused; retry_after is the suggested back-off in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the number of images admitted for analysis at any time.
+
+    Requests beyond ``max_pending`` images are refused immediately instead of
+    queueing without limit, and so are requests whose deadline cannot be met
+    given the current backlog and the measured throughput. Only touched from
+    the event loop thread, so plain counters are enough.
+    """
+
+    def __init__(self, max_pending=64, min_retry_after=1, max_retry_after=30, smoothing=0.2):
+        """
+        :param max_pending: images admitted (queued or running) before new requests are refused
+        :param min_retry_after: lower bound of the Retry-After hint in seconds
+        :param max_retry_after: upper bound of the Retry-After hint in seconds
+        :param smoothing: weight of the newest sample in the throughput moving average
+        """
+        self.max_pending = max_pending
+        self.min_retry_after = min_retry_after
+        self.max_retry_after = max_retry_after
+        self.smoothing = smoothing
+        self.pending = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self._rate = None
+        self._released = asyncio.Event()
+
+    @property
+    def throughput(self):
+        """Estimated images served per second while busy (None until measured)"""
+        return self._rate
+
+    def estimated_wait(self, extra=0):
+        """Seconds until ``extra`` more images would be served at the measured rate"""
+        if not self._rate:
+            return None
+        return (self.pending + extra) / self._rate
+
+    def retry_after(self, extra=1):
+        wait = self.estimated_wait(extra)
+        if wait is None:
+            return self.min_retry_after
+        return int(min(self.max_retry_after, max(self.min_retry_after, math.ceil(wait))))
+
+    def check(self, count=1, deadline=None):
+        """Raise Overloaded / DeadlineExceeded if ``count`` more images would be refused right now"""
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.expired += count
+                raise DeadlineExceeded("Request deadline already passed on arrival")
+            wait = self.estimated_wait(count)
+            if wait is not None and self.pending and wait > remaining:
+                self.rejected += count
+                raise Overloaded("Request cannot finish before its deadline", self.retry_after(count))
+        if self.pending and self.pending + count > self.max_pending:
+            self.rejected += count
+            raise Overloaded(f"Inference queue is full ({self.pending} images pending)", self.retry_after(count))
+
+    def try_acquire(self, count=1, deadline=None):
+        """
+        Admit ``count`` images or raise Overloaded / DeadlineExceeded without waiting.
+        Returns the admission time to pass back to release().
+        """
+        self.check(count, deadline)
+        self.pending += count
+        self.admitted += count
+        return time.monotonic()
+
+    async def acquire(self, count=1, deadline=None):
+        """
+        Wait for room for ``count`` images (used mid-stream, where refusing is not possible).
+        Returns (admitted count, admission time).
+        """
+        count = min(count, self.max_pending)
+        while self.pending and self.pending + count > self.max_pending:
+            check_deadline(deadline)
+            self._released.clear()
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(self._released.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        check_deadline(deadline)
+        self.pending += count
+        self.admitted += count
+        return count, time.monotonic()
+
+    def release(self, count, admitted_at, completed=True):
+        """Free admitted slots; completed images feed the throughput estimate"""
+        if completed:
+            # Little's law: images in the system divided by the time this request spent in it
+            latency = time.monotonic() - admitted_at
+            if latency > 0:
+                sample = self.pending / latency
+                self._rate = sample if self._rate is None else (
+                    self.smoothing * sample + (1 - self.smoothing) * self._rate
+                )
+        self.pending -= count
+        self._released.set()
+
+    def stats(self):
+        return {
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "throughput_images_per_sec": round(self._rate, 2) if self._rate else None,
+        }
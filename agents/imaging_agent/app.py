@@ -1,62 +1,272 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
 import uvicorn
 import os
-import shutil
+import asyncio
+import threading
 from pathlib import Path
 import traceback
+import time
+import json
+import hmac
+from typing import List, Optional
 import numpy as np
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
-from PIL import Image
+from backends import load_backend, detect_backend
+from replicas import load_replicas, replicas_tunable
+from autotune import autotune, candidate_configs
+from model_registry import ModelRegistry, ModelHandle, DEFAULT_CLASS_NAMES, DEFAULT_INPUT_SIZE
+from cascade import ModelCascade, check_compatible
+from tta import tta_average
+from admission import (
+    AdmissionController, Overloaded, DeadlineExceeded, check_deadline, call_before_deadline, parse_deadline
+)
+from inference_executor import InferenceExecutor
+from prediction_cache import PredictionCache
+from upload_index import UploadIndex
+from retention import RetentionManager
+from embedding_store import EmbeddingStore, store_dir_name
+from embedding_indexer import EmbeddingIndexer
+from preprocess import (
+    load_image_array, read_image_bytes, decode_image, decode_into,
+    allocate_batch, normalize_batch, is_archive, iter_archive_images, ArchiveLimitError
+)
 
 # ==================== ImagingAgent Class ====================
 class ImagingAgent:
     """AI-powered imaging agent for breast cancer diagnosis"""
     
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, cache_size=1024, cache_ttl=3600.0, backend="auto", num_threads=None,
+                 tta_views=6, tta_threshold=0.0, replicas=1, pin_cpus=False, shared_weights=False):
         """Initialize the imaging agent"""
-        self.img_height = 256
-        self.img_width = 256
-        self.class_names = ['benign', 'malignant', 'normal']
-        self.num_classes = len(self.class_names)
-        self.model = None
+        self.backend = backend
+        # Map ONNX/TFLite weights from a shared-memory copy (pre-forked workers share the pages)
+        self.shared_weights = shared_weights
+        # Replica layout: model copies, runtime threads per copy, and whether each copy is pinned to its cores
+        self.replicas = replicas
+        self.num_threads = num_threads
+        self.pin_cpus = pin_cpus
+        # The served model; replaced atomically on hot reload
+        self.handle = None
+        # missing -> loading -> warming -> ready (or failed)
+        self.status = "missing"
+        self.reload = None
+        # Optional expensive second-stage model for low-confidence images
+        self.cascade = None
+        # Test-time augmentation: views per image, and the confidence below which it runs automatically (0 = only on request)
+        self.tta_views = tta_views
+        self.tta_threshold = tta_threshold
+        self.tta_images = 0
+        self._tta_lock = threading.Lock()
+        self.batching_config = None
+        self.executor = None
+        self.cache = PredictionCache(max_entries=cache_size, ttl_seconds=cache_ttl)
         
         if model_path and os.path.exists(model_path):
             self.load_model(model_path)
     
-    def load_model(self, model_path):
-        """Load trained model from file"""
+    # ---------- attributes of the currently served model ----------
+    
+    @property
+    def model(self):
+        return self.handle.backend if self.handle else None
+    
+    @property
+    def model_version(self):
+        """Identifies the weights (and cascade setup) that produced a result"""
+        if self.handle is None:
+            return None
+        version = self.handle.version
+        if self.cascade is not None:
+            version += f"+{self.cascade.version_tag}"
+        if self.tta_threshold:
+            version += f"+tta{self.tta_views}@{self.tta_threshold:g}"
+        return version
+    
+    @property
+    def img_height(self):
+        return self.handle.img_height if self.handle else DEFAULT_INPUT_SIZE[0]
+    
+    @property
+    def img_width(self):
+        return self.handle.img_width if self.handle else DEFAULT_INPUT_SIZE[1]
+    
+    @property
+    def class_names(self):
+        return self.handle.class_names if self.handle else list(DEFAULT_CLASS_NAMES)
+    
+    @property
+    def num_classes(self):
+        return len(self.class_names)
+    
+    @property
+    def batcher(self):
+        return self.handle.batcher if self.handle else None
+    
+    # ---------- model lifecycle ----------
+    
+    def load_model(self, model_path, warmup_batch_sizes=None, metadata=None, version=None, mark_ready=True):
+        """
+        Load trained model from file (.h5/.keras, .onnx or .tflite), warm it and
+        swap it in atomically. The previous model keeps serving its in-flight
+        requests and is released once they have drained.
+        With ``mark_ready=False`` (autotune candidates) the status is left as is.
+        """
+        metadata = metadata or {}
+        version = version or f"{os.path.abspath(model_path)}@{os.path.getmtime(model_path):.0f}"
+        first_load = self.handle is None
         try:
-            self.model = load_model(model_path)
-            print(f"✓ Model loaded from {model_path}")
+            if first_load:
+                self.status = "loading"
+            self.reload = {"version": version, "state": "loading", "error": None}
+            backend = load_replicas(
+                model_path,
+                backend=metadata.get("backend", self.backend),
+                replicas=self.replicas,
+                threads_per_replica=self.num_threads,
+                pin_cpus=self.pin_cpus,
+                shared_weights=self.shared_weights
+            )
+            handle = ModelHandle(backend, version, metadata)
+            if self.cascade is not None:
+                # A hot-swapped primary must still match the cascade fallback
+                check_compatible(handle, self.cascade.handle)
+            print(f"✓ Model loaded from {model_path} ({backend.name} backend, input {handle.img_height}x{handle.img_width}, "
+                  f"{backend.concurrency} replica(s))")
+            if warmup_batch_sizes:
+                if first_load:
+                    self.status = "warming"
+                self.reload["state"] = "warming"
+                self.warmup(warmup_batch_sizes, handle=handle)
+            if self.batching_config:
+                handle.start_batching(**self.batching_config)
         except Exception as e:
+            if first_load:
+                self.status = "failed"
+            self.reload = {"version": version, "state": "failed", "error": str(e)}
             print(f"Error loading model: {e}")
             raise
+        
+        old_handle, self.handle = self.handle, handle
+        # Cached results belong to the old weights
+        self.cache.clear()
+        if mark_ready:
+            self.status = "ready"
+        self.reload = {"version": version, "state": "ready", "error": None}
+        if old_handle is not None:
+            threading.Thread(target=old_handle.drain, name="imaging-model-drain", daemon=True).start()
+            print(f"✓ Swapped model {old_handle.version} -> {version}")
+    
+    def load_version(self, registry, version, warmup_batch_sizes=None, mark_ready=True):
+        """Load a version from the model registry using its metadata"""
+        metadata = registry.metadata(version)
+        self.load_model(
+            registry.artifact_path(version),
+            warmup_batch_sizes=warmup_batch_sizes,
+            metadata=metadata,
+            version=version,
+            mark_ready=mark_ready
+        )
+    
+    def load_cascade(self, model_path, threshold=0.85, warmup_batch_sizes=None, metadata=None, version=None):
+        """Load the fallback model that answers images the primary model is unsure about"""
+        metadata = metadata or {}
+        version = version or f"{os.path.abspath(model_path)}@{os.path.getmtime(model_path):.0f}"
+        backend = load_backend(model_path, backend=metadata.get("backend", self.backend), num_threads=self.num_threads)
+        handle = ModelHandle(backend, version, metadata)
+        if self.handle is None:
+            raise ValueError("Load the primary model before the cascade fallback")
+        # Checked once here, so predictions never combine mismatched outputs
+        check_compatible(self.handle, handle)
+        print(f"✓ Cascade fallback loaded from {model_path} ({backend.name} backend, threshold {threshold:g})")
+        if warmup_batch_sizes:
+            self.warmup(warmup_batch_sizes, handle=handle)
+        if self.batching_config:
+            handle.start_batching(**self.batching_config)
+        old_cascade, self.cascade = self.cascade, ModelCascade(handle, threshold=threshold)
+        self.cache.clear()
+        if old_cascade is not None:
+            threading.Thread(target=old_cascade.handle.drain, name="imaging-model-drain", daemon=True).start()
     
-    def preprocess_image(self, img_path):
-        """Preprocess image for model input"""
-        img = Image.open(img_path).convert('RGB')
-        img = img.resize((self.img_width, self.img_height))
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = img_array / 255.0
-        return img_array
-    
-    def predict(self, img_path):
-        """Make prediction on image"""
-        if self.model is None:
+    def warmup(self, batch_sizes=(1,), handle=None):
+        """Run dummy batches through the model so the first real request does not pay init/tracing cost"""
+        handle = handle or self.handle
+        if handle is None:
             raise ValueError("Model not loaded. Please train or load a model first.")
-        
-        img_array = self.preprocess_image(img_path)
-        predictions = self.model.predict(img_array, verbose=0)
-        predicted_class_idx = np.argmax(predictions[0])
-        predicted_class = self.class_names[predicted_class_idx]
-        confidence = float(predictions[0][predicted_class_idx])
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            handle.predict_batch(allocate_batch(batch_size, handle.img_width, handle.img_height))
+            print(f"✓ Warmup batch of {batch_size}: {(time.perf_counter() - start) * 1000:.1f} ms")
+    
+    @property
+    def is_ready(self):
+        """True once a model is loaded and warmed up"""
+        return self.handle is not None and self.status == "ready"
+    
+    def _acquire(self):
+        """Pin the current model for the duration of one request"""
+        handle = self.handle
+        if handle is None:
+            raise ValueError("Model not loaded. Please train or load a model first.")
+        return handle.acquire()
+    
+    def preprocess_image(self, source):
+        """Preprocess image for model input (source: file path, raw bytes or file-like object)"""
+        return load_image_array(source, self.img_width, self.img_height)
+    
+    def predict_batch(self, img_batch):
+        """Run one forward pass over a (N, H, W, 3) batch (uint8 batches are normalized here, once)"""
+        handle = self._acquire()
+        try:
+            return handle.predict_batch(img_batch)
+        finally:
+            handle.release()
+    
+    def start_batching(self, max_batch_size=16, max_wait_ms=10.0):
+        """Enable the background micro-batcher that coalesces concurrent predictions"""
+        self.batching_config = {"max_batch_size": max_batch_size, "max_wait_ms": max_wait_ms}
+        for handle in self._handles():
+            handle.stop_batching()
+            handle.start_batching(**self.batching_config)
+    
+    def stop_batching(self):
+        """Stop the micro-batcher; predictions fall back to direct model calls"""
+        self.batching_config = None
+        for handle in self._handles():
+            handle.stop_batching()
+    
+    def _handles(self):
+        """Every loaded model handle (primary and cascade fallback)"""
+        handles = [self.handle] if self.handle is not None else []
+        if self.cascade is not None:
+            handles.append(self.cascade.handle)
+        return handles
+    
+    def start_executor(self, inference_workers=1, decode_workers=4, decode_processes=0):
+        """Create the worker pools used by the async prediction path"""
+        self.stop_executor()
+        self.executor = InferenceExecutor(
+            inference_workers=inference_workers,
+            decode_workers=decode_workers,
+            decode_processes=decode_processes
+        )
+    
+    def stop_executor(self):
+        """Shut down the worker pools"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+    
+    def format_prediction(self, probabilities, class_names=None):
+        """Turn a probability vector into the prediction dict"""
+        class_names = class_names or self.class_names
+        predicted_class_idx = int(np.argmax(probabilities))
+        predicted_class = class_names[predicted_class_idx]
+        confidence = float(probabilities[predicted_class_idx])
         
         class_probabilities = {
-            self.class_names[i]: float(predictions[0][i])
-            for i in range(len(self.class_names))
+            class_names[i]: float(probabilities[i])
+            for i in range(len(class_names))
         }
         
         return {
@@ -65,9 +275,325 @@ class ImagingAgent:
             'class_probabilities': class_probabilities
         }
     
-    def analyze_image(self, img_path):
-        """Analyze image and provide detailed diagnosis"""
-        prediction = self.predict(img_path)
+    def _tta_mask(self, probabilities, tta):
+        """Rows that get test-time augmentation: all if requested, none if refused, else the low-confidence ones"""
+        probabilities = np.atleast_2d(probabilities)
+        if tta is None:
+            mask = probabilities.max(axis=1) < self.tta_threshold
+        else:
+            mask = np.full(len(probabilities), bool(tta) and self.tta_views > 1)
+        if mask.any():
+            with self._tta_lock:
+                self.tta_images += int(mask.sum())
+        return mask
+    
+    def _run_handle(self, handle, source, tta=None, deadline=None):
+        """
+        Decode an image at the handle's input size; returns (probability vector, TTA used).
+        Raises DeadlineExceeded instead of running the model once the deadline has passed.
+        """
+        check_deadline(deadline)
+        img_array = decode_image(source, handle.img_width, handle.img_height)
+        check_deadline(deadline)
+        if tta and self._tta_mask([1.0], tta)[0]:
+            # All views, original included, in one forward pass
+            return tta_average(handle.predict_batch, img_array[np.newaxis], num_views=self.tta_views)[0], True
+        if handle.batcher is not None:
+            probabilities = handle.batcher.predict(img_array, deadline=deadline)
+        else:
+            probabilities = handle.predict_batch(img_array[np.newaxis])[0]
+        if tta is None and self._tta_mask(probabilities, tta)[0]:
+            check_deadline(deadline)
+            return tta_average(handle.predict_batch, img_array[np.newaxis], probabilities[np.newaxis],
+                               num_views=self.tta_views)[0], True
+        return probabilities, False
+    
+    async def _run_handle_async(self, handle, source, tta=None, deadline=None):
+        """Async _run_handle with decoding and inference on the worker pools"""
+        img_array = await self.executor.run_decode(
+            call_before_deadline, deadline, decode_image, source, handle.img_width, handle.img_height
+        )
+        if tta and self._tta_mask([1.0], tta)[0]:
+            probabilities = await self.executor.run_inference(
+                call_before_deadline, deadline,
+                tta_average, handle.predict_batch, img_array[np.newaxis], None, self.tta_views
+            )
+            return probabilities[0], True
+        if handle.batcher is not None:
+            probabilities = await asyncio.wrap_future(handle.batcher.submit(img_array, deadline))
+        else:
+            probabilities = (await self.executor.run_inference(
+                call_before_deadline, deadline, handle.predict_batch, img_array[np.newaxis]
+            ))[0]
+        if tta is None and self._tta_mask(probabilities, tta)[0]:
+            probabilities = await self.executor.run_inference(
+                call_before_deadline, deadline,
+                tta_average, handle.predict_batch, img_array[np.newaxis], probabilities[np.newaxis], self.tta_views
+            )
+            return probabilities[0], True
+        return probabilities, False
+    
+    def _staged_prediction(self, probabilities, class_names, stage, tta_used):
+        prediction = self.format_prediction(probabilities, class_names)
+        if self.cascade is not None:
+            prediction['model_stage'] = stage
+        if tta_used:
+            prediction['tta_views'] = self.tta_views
+        return prediction
+    
+    def predict(self, source, tta=None, deadline=None):
+        """
+        Make prediction on image (file path, raw bytes or file-like object).
+        tta: True/False forces test-time augmentation on/off; None applies it below tta_threshold.
+        deadline: optional time.monotonic() value after which the request is dropped (DeadlineExceeded).
+        """
+        handle = self._acquire()
+        try:
+            probabilities, tta_used = self._run_handle(handle, source, tta, deadline)
+            class_names = handle.class_names
+        finally:
+            handle.release()
+        
+        cascade = self.cascade
+        if cascade is not None and cascade.escalation_mask(probabilities)[0]:
+            fallback = cascade.handle.acquire()
+            try:
+                probabilities, tta_used = self._run_handle(fallback, source, tta, deadline)
+                return self._staged_prediction(probabilities, fallback.class_names, "fallback", tta_used)
+            finally:
+                fallback.release()
+        return self._staged_prediction(probabilities, class_names, "primary", tta_used)
+    
+    async def predict_async(self, source, tta=None, deadline=None):
+        """Make prediction with decoding and inference running on worker pools"""
+        if self.executor is None:
+            return await asyncio.to_thread(self.predict, source, tta, deadline)
+        
+        handle = self._acquire()
+        try:
+            probabilities, tta_used = await self._run_handle_async(handle, source, tta, deadline)
+            class_names = handle.class_names
+        finally:
+            handle.release()
+        
+        cascade = self.cascade
+        if cascade is not None and cascade.escalation_mask(probabilities)[0]:
+            fallback = cascade.handle.acquire()
+            try:
+                probabilities, tta_used = await self._run_handle_async(fallback, source, tta, deadline)
+                return self._staged_prediction(probabilities, fallback.class_names, "fallback", tta_used)
+            finally:
+                fallback.release()
+        return self._staged_prediction(probabilities, class_names, "primary", tta_used)
+    
+    async def _decode_batch_async(self, images, width, height):
+        """
+        Decode images in parallel into one preallocated uint8 batch.
+        Returns (batch, errors) where errors maps row index to the decode exception;
+        failed rows are dropped from the returned batch.
+        """
+        img_batch = allocate_batch(len(images), width, height)
+        if self.executor is None or self.executor.decode_mode == "thread":
+            # Thread workers write straight into the shared buffer
+            jobs = [
+                self.executor.run_decode(decode_into, img_batch, i, data, width, height)
+                if self.executor is not None else
+                asyncio.to_thread(decode_into, img_batch, i, data, width, height)
+                for i, data in enumerate(images)
+            ]
+            outcomes = await asyncio.gather(*jobs, return_exceptions=True)
+        else:
+            # Process workers cannot share the buffer; copy their rows in
+            outcomes = await asyncio.gather(
+                *(self.executor.run_decode(decode_image, data, width, height) for data in images),
+                return_exceptions=True
+            )
+            for i, outcome in enumerate(outcomes):
+                if not isinstance(outcome, Exception):
+                    img_batch[i] = outcome
+        errors = {i: outcome for i, outcome in enumerate(outcomes) if isinstance(outcome, Exception)}
+        if errors:
+            img_batch = img_batch[[i for i in range(len(images)) if i not in errors]]
+        return img_batch, errors
+    
+    async def _predict_batch_async(self, handle, img_batch, deadline=None):
+        """Run one forward pass on the inference pool (skipped if the deadline passes while queued)"""
+        if self.executor is None:
+            return await asyncio.to_thread(call_before_deadline, deadline, handle.predict_batch, img_batch)
+        return await self.executor.run_inference(call_before_deadline, deadline, handle.predict_batch, img_batch)
+    
+    async def _tta_batch_async(self, handle, img_batch, predictions, tta, deadline=None):
+        """Replace the rows selected for TTA with their view-averaged predictions (one extra forward pass)"""
+        rows = np.flatnonzero(self._tta_mask(predictions, tta))
+        if not len(rows):
+            return predictions, rows
+        run = asyncio.to_thread if self.executor is None else self.executor.run_inference
+        averaged = await run(call_before_deadline, deadline,
+                             tta_average, handle.predict_batch, img_batch[rows], predictions[rows], self.tta_views)
+        predictions = np.array(predictions, copy=True)
+        predictions[rows] = averaged
+        return predictions, rows
+    
+    async def analyze_batch_async(self, images, tta=None, deadline=None):
+        """
+        Analyze a list of raw image bytes: cache lookups first, then parallel
+        decoding and a single forward pass over everything that missed.
+        Returns one diagnosis dict or Exception per input, in order.
+        """
+        handle = self._acquire()
+        cascade = self.cascade
+        version = self._cache_version(tta)
+        try:
+            results = [None] * len(images)
+            pending = []
+            for i, data in enumerate(images):
+                key = PredictionCache.content_key(data)
+                cached = self.cache.get(key, version)
+                if cached is not None:
+                    results[i] = cached
+                else:
+                    pending.append((i, key, data))
+            
+            if not pending:
+                return results
+            
+            check_deadline(deadline)
+            img_batch, errors = await self._decode_batch_async(
+                [data for _, _, data in pending], handle.img_width, handle.img_height
+            )
+            ready = []
+            for row, (i, key, data) in enumerate(pending):
+                if row in errors:
+                    results[i] = errors[row]
+                else:
+                    ready.append((i, key, data))
+            
+            if not ready:
+                return results
+            
+            predictions = await self._predict_batch_async(handle, img_batch, deadline)
+            predictions, tta_rows = await self._tta_batch_async(handle, img_batch, predictions, tta, deadline)
+            class_names = [handle.class_names] * len(ready)
+            stages = ["primary"] * len(ready)
+            tta_used = np.zeros(len(ready), dtype=bool)
+            tta_used[tta_rows] = True
+            
+            if cascade is not None:
+                # Only the uncertain rows are decoded again and sent to the fallback model
+                rows = np.flatnonzero(cascade.escalation_mask(predictions))
+                if len(rows):
+                    predictions = np.array(predictions, copy=True)
+                    fallback = cascade.handle.acquire()
+                    try:
+                        fb_batch, fb_errors = await self._decode_batch_async(
+                            [ready[row][2] for row in rows], fallback.img_width, fallback.img_height
+                        )
+                        fb_rows = [row for j, row in enumerate(rows) if j not in fb_errors]
+                        if fb_rows:
+                            fb_predictions = await self._predict_batch_async(fallback, fb_batch, deadline)
+                            fb_predictions, fb_tta_rows = await self._tta_batch_async(
+                                fallback, fb_batch, fb_predictions, tta, deadline
+                            )
+                            fb_tta_used = np.zeros(len(fb_rows), dtype=bool)
+                            fb_tta_used[fb_tta_rows] = True
+                            for j, row in enumerate(fb_rows):
+                                predictions[row] = fb_predictions[j]
+                                class_names[row] = fallback.class_names
+                                stages[row] = "fallback"
+                                tta_used[row] = fb_tta_used[j]
+                    finally:
+                        fallback.release()
+            
+            for row, (i, key, _) in enumerate(ready):
+                prediction = self._staged_prediction(predictions[row], class_names[row], stages[row], tta_used[row])
+                result = self.build_diagnosis(prediction)
+                self.cache.put(key, version, result)
+                results[i] = result
+            return results
+        finally:
+            handle.release()
+    
+    def _cache_version(self, tta=None):
+        """Cache namespace: results forced with or without TTA differ from the default policy"""
+        if tta is None:
+            return self.model_version
+        return f"{self.model_version}+tta={'on' if tta else 'off'}"
+    
+    def cache_versions(self):
+        """Every cache namespace the current model can serve from"""
+        return tuple(self._cache_version(tta) for tta in (None, True, False))
+    
+    def analyze_image(self, source, tta=None, deadline=None):
+        """Analyze image and provide detailed diagnosis (served from cache for repeated images)"""
+        data = read_image_bytes(source)
+        key = PredictionCache.content_key(data)
+        version = self._cache_version(tta)
+        result = self.cache.get(key, version)
+        if result is None:
+            result = self.build_diagnosis(self.predict(data, tta, deadline))
+            self.cache.put(key, version, result)
+        return result
+    
+    async def analyze_image_async(self, source, tta=None, deadline=None):
+        """Async variant of analyze_image used by the API handlers"""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = bytes(source)
+        else:
+            data = await asyncio.to_thread(read_image_bytes, source)
+        key = PredictionCache.content_key(data)
+        version = self._cache_version(tta)
+        result = self.cache.get(key, version)
+        if result is None:
+            result = self.build_diagnosis(await self.predict_async(data, tta, deadline))
+            self.cache.put(key, version, result)
+        return result
+    
+    def embed_images(self, images):
+        """
+        Backbone embeddings for raw image bytes (used by the background indexer).
+        Returns (model version, (M, D) vectors, indices of the images that decoded).
+        """
+        handle = self._acquire()
+        try:
+            img_batch = allocate_batch(len(images), handle.img_width, handle.img_height)
+            rows = []
+            for i, data in enumerate(images):
+                try:
+                    decode_into(img_batch, len(rows), data, handle.img_width, handle.img_height)
+                    rows.append(i)
+                except Exception:
+                    continue
+            if not rows:
+                return handle.version, np.empty((0, 0), dtype=np.float32), rows
+            if self.executor is not None:
+                # Share the inference pool so indexing never adds model concurrency
+                vectors = self.executor.inference_pool.submit(handle.embed_batch, img_batch[:len(rows)]).result()
+            else:
+                vectors = handle.embed_batch(img_batch[:len(rows)])
+            return handle.version, vectors, rows
+        finally:
+            handle.release()
+    
+    async def embed_image_async(self, data, deadline=None):
+        """Backbone embedding of one image; returns (model version, (D,) vector)"""
+        handle = self._acquire()
+        try:
+            if self.executor is None:
+                img_array = await asyncio.to_thread(decode_image, data, handle.img_width, handle.img_height)
+                vectors = await asyncio.to_thread(call_before_deadline, deadline, handle.embed_batch, img_array[np.newaxis])
+            else:
+                img_array = await self.executor.run_decode(
+                    call_before_deadline, deadline, decode_image, data, handle.img_width, handle.img_height
+                )
+                vectors = await self.executor.run_inference(
+                    call_before_deadline, deadline, handle.embed_batch, img_array[np.newaxis]
+                )
+            return handle.version, vectors[0]
+        finally:
+            handle.release()
+    
+    def build_diagnosis(self, prediction):
+        """Attach clinical findings to a prediction"""
         predicted_class = prediction['predicted_class']
         probability = prediction['confidence']
         
@@ -123,6 +649,9 @@ class ImagingAgent:
                 }
             }
         
+        for key in ('model_stage', 'tta_views'):
+            if key in prediction:
+                result[key] = prediction[key]
         return result
 
 # ==================== FastAPI App ====================
@@ -140,68 +669,382 @@ app.add_middleware(
 # Configuration
 UPLOAD_FOLDER = Path("uploads")
 UPLOAD_FOLDER.mkdir(exist_ok=True)
-MODEL_PATH = "best_model.h5"
+ALLOWED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff'}
+MODEL_PATH = os.getenv("IMAGING_MODEL_PATH", "best_model.h5")
+MODEL_REGISTRY = ModelRegistry(os.getenv("IMAGING_MODEL_REGISTRY", "models"))
+# /admin/* needs "Authorization: Bearer <token>"; without a token only local clients are allowed
+ADMIN_TOKEN = os.getenv("IMAGING_ADMIN_TOKEN", "")
+INFERENCE_BACKEND = os.getenv("IMAGING_BACKEND", "auto")
+BACKEND_THREADS = int(os.getenv("IMAGING_BACKEND_THREADS", "0")) or None
+BATCH_MAX_SIZE = int(os.getenv("IMAGING_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("IMAGING_BATCH_MAX_WAIT_MS", "10"))
+INFERENCE_WORKERS = int(os.getenv("IMAGING_INFERENCE_WORKERS", "1"))
+# Model replicas ("auto" benchmarks layouts at startup); BACKEND_THREADS is then per replica
+REPLICAS = os.getenv("IMAGING_REPLICAS", "1")
+PIN_CPUS = os.getenv("IMAGING_PIN_CPUS", "0") == "1"
+AUTOTUNE_SECONDS = float(os.getenv("IMAGING_AUTOTUNE_SECONDS", "3"))
+AUTOTUNE_CONCURRENCY = int(os.getenv("IMAGING_AUTOTUNE_CONCURRENCY", "32"))
+AUTOTUNE_MAX_P95_MS = float(os.getenv("IMAGING_AUTOTUNE_MAX_P95_MS", "0"))
+# Load ONNX/TFLite weights from /dev/shm so worker processes share them (set by prefork.py)
+SHARED_WEIGHTS = os.getenv("IMAGING_SHARED_WEIGHTS", "0") == "1"
+DECODE_WORKERS = int(os.getenv("IMAGING_DECODE_WORKERS", "4"))
+DECODE_PROCESSES = int(os.getenv("IMAGING_DECODE_PROCESSES", "0"))
+PERSIST_UPLOADS = os.getenv("IMAGING_PERSIST_UPLOADS", "1") == "1"
+CACHE_MAX_ENTRIES = int(os.getenv("IMAGING_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("IMAGING_CACHE_TTL_SECONDS", "3600"))
+UPLOAD_BATCH_SIZE = int(os.getenv("IMAGING_UPLOAD_BATCH_SIZE", "32"))
+# Decompression limits per uploaded archive
+ARCHIVE_MAX_MEMBER_BYTES = int(float(os.getenv("IMAGING_ARCHIVE_MAX_MEMBER_MB", "64")) * 1024 ** 2)
+ARCHIVE_MAX_MEMBERS = int(os.getenv("IMAGING_ARCHIVE_MAX_MEMBERS", "10000"))
+ARCHIVE_MAX_TOTAL_BYTES = int(float(os.getenv("IMAGING_ARCHIVE_MAX_TOTAL_MB", "1024")) * 1024 ** 2)
+UPLOADS_MAX_BYTES = int(float(os.getenv("IMAGING_UPLOADS_MAX_GB", "5")) * 1024 ** 3)
+UPLOADS_MAX_AGE_SECONDS = float(os.getenv("IMAGING_UPLOADS_MAX_AGE_HOURS", "168")) * 3600
+UPLOADS_MAX_COUNT = int(os.getenv("IMAGING_UPLOADS_MAX_COUNT", "10000"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("IMAGING_RETENTION_INTERVAL_SECONDS", "60"))
+# Registry version or artifact path of the fallback model (e.g. DenseNet121); empty disables the cascade
+CASCADE_MODEL = os.getenv("IMAGING_CASCADE_MODEL", "")
+CASCADE_THRESHOLD = float(os.getenv("IMAGING_CASCADE_THRESHOLD", "0.85"))
+# Test-time augmentation runs automatically below this confidence (0 = only when requested with ?tta=true)
+TTA_VIEWS = int(os.getenv("IMAGING_TTA_VIEWS", "6"))
+TTA_THRESHOLD = float(os.getenv("IMAGING_TTA_THRESHOLD", "0.6"))
+# Admission control: images admitted (queued or running) before new requests get 429 + Retry-After
+MAX_PENDING_IMAGES = int(os.getenv("IMAGING_MAX_PENDING_IMAGES", "64"))
+MAX_RETRY_AFTER_SECONDS = int(os.getenv("IMAGING_MAX_RETRY_AFTER_SECONDS", "30"))
+# Deadline applied when a client sends no X-Request-Timeout-Ms / X-Request-Deadline header (0 = none)
+DEFAULT_REQUEST_TIMEOUT_MS = float(os.getenv("IMAGING_REQUEST_TIMEOUT_MS", "0"))
+# Similar-case search: backbone embeddings of analyzed images, one store per model version.
+# Opt-in: indexing decodes every analyzed image again and runs a second backbone pass on the
+# inference pool, roughly doubling the CPU cost per image.
+EMBEDDINGS_ENABLED = os.getenv("IMAGING_EMBEDDINGS", "0") == "1"
+EMBEDDINGS_DIR = Path(os.getenv("IMAGING_EMBEDDINGS_DIR", "embeddings"))
+EMBED_BATCH_SIZE = int(os.getenv("IMAGING_EMBED_BATCH_SIZE", "32"))
+ANN_MIN_VECTORS = int(os.getenv("IMAGING_ANN_MIN_VECTORS", "2000000"))
+ANN_NPROBE = int(os.getenv("IMAGING_ANN_NPROBE", "16"))
+WARMUP_BATCH_SIZES = sorted({
+    int(size) for size in
+    os.getenv("IMAGING_WARMUP_BATCH_SIZES", f"1,{BATCH_MAX_SIZE},{UPLOAD_BATCH_SIZE}").split(",")
+    if size.strip() and int(size) > 0
+})
 
 # Initialize imaging agent
 imaging_agent = None
+upload_index = None
+retention = None
+admission = None
+embedding_indexer = None
+embedding_stores = {}
+embedding_stores_lock = threading.Lock()
+
+def resolve_model_artifact():
+    """(artifact path, backend) that initialize_model will serve, or (None, backend)"""
+    active_version = MODEL_REGISTRY.active_version()
+    if active_version is not None:
+        metadata = MODEL_REGISTRY.metadata(active_version)
+        return MODEL_REGISTRY.artifact_path(active_version), metadata.get("backend", INFERENCE_BACKEND)
+    return (MODEL_PATH if os.path.exists(MODEL_PATH) else None), INFERENCE_BACKEND
+
+def initialize_model():
+    """Load and warm the model in the background so the server can bind immediately"""
+    active_version = MODEL_REGISTRY.active_version()
+    if active_version is None and not os.path.exists(MODEL_PATH):
+        print("⚠ Model file not found. Please train the model first.")
+        print(f"Expected model path: {os.path.abspath(MODEL_PATH)}")
+        return
+    if BATCH_MAX_SIZE > 1:
+        imaging_agent.start_batching(max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+        print(f"✓ Micro-batching enabled (max {BATCH_MAX_SIZE} images / {BATCH_MAX_WAIT_MS:g} ms)")
+    
+    def load(mark_ready=True):
+        if active_version is not None:
+            imaging_agent.load_version(MODEL_REGISTRY, active_version, warmup_batch_sizes=WARMUP_BATCH_SIZES,
+                                       mark_ready=mark_ready)
+        else:
+            imaging_agent.load_model(MODEL_PATH, warmup_batch_sizes=WARMUP_BATCH_SIZES, mark_ready=mark_ready)
+    
+    try:
+        start = time.perf_counter()
+        if REPLICAS == "auto":
+            if autotune_enabled():
+                autotune_replicas(load)
+            else:
+                print("⚠ IMAGING_REPLICAS=auto: Keras models cannot be re-tuned in-process (TensorFlow sizes "
+                      "its thread pools once); serving 1 replica. Export to ONNX/TFLite to auto-tune.")
+        load()
+        source = f"registry model {active_version}" if active_version is not None else f"existing model from {MODEL_PATH}"
+        print(f"✓ Loaded {source} in {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        print(f"Warning: Could not load model: {e}")
+        return
+    if CASCADE_MODEL:
+        initialize_cascade()
+
+def autotune_enabled():
+    """IMAGING_REPLICAS=auto with a backend whose layout can change between loads (not Keras)"""
+    if REPLICAS != "auto":
+        return False
+    model_path, backend = resolve_model_artifact()
+    if model_path is None:
+        return False
+    return replicas_tunable(backend if backend and backend != "auto" else detect_backend(model_path))
+
+def autotune_replicas(load):
+    """Benchmark replica layouts with ImagingAgent.predict and keep the best one"""
+    def load_for_tuning():
+        # Not ready for traffic until the final layout is loaded
+        load(mark_ready=False)
+    
+    print(f"⏱ Auto-tuning model replicas ({AUTOTUNE_SECONDS:g}s per layout, {AUTOTUNE_CONCURRENCY} clients)")
+    best, _ = autotune(
+        imaging_agent,
+        load_for_tuning,
+        concurrency=AUTOTUNE_CONCURRENCY,
+        duration=AUTOTUNE_SECONDS,
+        max_p95_ms=AUTOTUNE_MAX_P95_MS or None
+    )
+    imaging_agent.replicas = best["replicas"]
+    imaging_agent.num_threads = best["threads_per_replica"]
+    print(f"✓ Selected {best['replicas']} replica(s) x {best['threads_per_replica']} thread(s)")
+
+def get_embedding_store(version):
+    """Open (once) the embedding store of a model version"""
+    with embedding_stores_lock:
+        store = embedding_stores.get(version)
+        if store is None:
+            store = EmbeddingStore(EMBEDDINGS_DIR / store_dir_name(version), version=version,
+                                   ann_min_vectors=ANN_MIN_VECTORS, nprobe=ANN_NPROBE)
+            embedding_stores[version] = store
+        return store
+
+def existing_embedding_store(version):
+    """The embedding store of a model version if it already exists on disk (never creates one)"""
+    with embedding_stores_lock:
+        store = embedding_stores.get(version)
+    if store is None and (EMBEDDINGS_DIR / store_dir_name(version) / EmbeddingStore.HEADER_FILE).exists():
+        store = get_embedding_store(version)
+    return store
+
+def queue_embedding(filename, contents, result):
+    """Hand an analyzed image to the background embedding indexer"""
+    if embedding_indexer is None:
+        return
+    embedding_indexer.submit(contents, {
+        "filename": filename,
+        "predicted_class": result["predicted_class"],
+        "confidence": result["confidence"],
+        "analyzed_at": time.time(),
+    })
+
+def initialize_cascade():
+    """Load the fallback model of the confidence-gated cascade"""
+    try:
+        if CASCADE_MODEL in {m["version"] for m in MODEL_REGISTRY.versions()}:
+            imaging_agent.load_cascade(
+                MODEL_REGISTRY.artifact_path(CASCADE_MODEL),
+                threshold=CASCADE_THRESHOLD,
+                warmup_batch_sizes=WARMUP_BATCH_SIZES,
+                metadata=MODEL_REGISTRY.metadata(CASCADE_MODEL),
+                version=CASCADE_MODEL
+            )
+        else:
+            imaging_agent.load_cascade(CASCADE_MODEL, threshold=CASCADE_THRESHOLD, warmup_batch_sizes=WARMUP_BATCH_SIZES)
+    except Exception as e:
+        print(f"⚠ Cascade disabled, could not load fallback model: {e}")
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the imaging agent on startup"""
-    global imaging_agent
+    global imaging_agent, upload_index, retention, admission, embedding_indexer
+    # Pre-forked workers (prefork.py) share one upload journal; worker 0 compacts it and enforces the quotas
+    worker_id = os.getenv("IMAGING_WORKER_ID")
+    maintains_uploads = worker_id in (None, "0")
+    upload_index = UploadIndex(UPLOAD_FOLDER, ALLOWED_EXTENSIONS, compact_every=1000 if maintains_uploads else 0)
+    print(f"✓ Upload index ready ({len(upload_index)} upload(s))" + (f" [worker {worker_id}]" if worker_id else ""))
+    imaging_agent = ImagingAgent(
+        cache_size=CACHE_MAX_ENTRIES,
+        cache_ttl=CACHE_TTL_SECONDS,
+        backend=INFERENCE_BACKEND,
+        num_threads=BACKEND_THREADS,
+        tta_views=TTA_VIEWS,
+        tta_threshold=TTA_THRESHOLD,
+        replicas=1 if REPLICAS == "auto" else int(REPLICAS),
+        pin_cpus=PIN_CPUS,
+        shared_weights=SHARED_WEIGHTS
+    )
+    if REPLICAS == "auto":
+        max_replicas = max(c["replicas"] for c in candidate_configs()) if autotune_enabled() else 1
+    else:
+        max_replicas = int(REPLICAS)
+    # Enough inference threads to keep every replica busy
+    inference_workers = max(INFERENCE_WORKERS, max_replicas)
+    imaging_agent.start_executor(
+        inference_workers=inference_workers,
+        decode_workers=DECODE_WORKERS,
+        decode_processes=DECODE_PROCESSES
+    )
+    print(f"✓ Inference executor ready ({inference_workers} inference / "
+          f"{DECODE_PROCESSES or DECODE_WORKERS} decode {'processes' if DECODE_PROCESSES else 'threads'})")
+    
+    retention = RetentionManager(
+        UPLOAD_FOLDER,
+        upload_index,
+        max_bytes=UPLOADS_MAX_BYTES,
+        max_age_seconds=UPLOADS_MAX_AGE_SECONDS,
+        max_count=UPLOADS_MAX_COUNT,
+        interval_seconds=RETENTION_INTERVAL_SECONDS,
+        # Keep images whose prediction is still cached unless the disk quota forces it
+        is_protected=lambda entry: imaging_agent.cache.contains(
+            entry.get("content_hash"), imaging_agent.cache_versions()
+        ),
+        enforce_limits=maintains_uploads
+    )
+    retention.start()
+    retention.notify()
+    
+    admission = AdmissionController(max_pending=MAX_PENDING_IMAGES, max_retry_after=MAX_RETRY_AFTER_SECONDS)
+    
+    if EMBEDDINGS_ENABLED:
+        embedding_indexer = EmbeddingIndexer(
+            imaging_agent.embed_images,
+            get_embedding_store,
+            lambda: imaging_agent.handle.version,
+            batch_size=EMBED_BATCH_SIZE
+        )
+        embedding_indexer.start()
+        print("✓ Similar-case indexing enabled (adds one decode + backbone pass per analyzed image)")
+    
+    if MODEL_REGISTRY.active_version() or os.path.exists(MODEL_PATH):
+        imaging_agent.status = "loading"
+    threading.Thread(target=initialize_model, name="imaging-model-loader", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers"""
+    if embedding_indexer is not None:
+        embedding_indexer.stop()
+    if imaging_agent is not None:
+        imaging_agent.stop_batching()
+        imaging_agent.stop_executor()
+    if retention is not None:
+        retention.stop()
+
+def ensure_model_ready():
+    """Raise the right HTTP error when the model cannot serve requests yet"""
+    if not imaging_agent:
+        raise HTTPException(status_code=500, detail="Imaging agent not initialized")
+    
+    if imaging_agent.status in ("loading", "warming"):
+        raise HTTPException(
+            status_code=503,
+            detail="Model is still loading. Please retry shortly.",
+            headers={"Retry-After": "5"}
+        )
+    
+    if not imaging_agent.is_ready:
+        raise HTTPException(
+            status_code=500, 
+            detail="Model not loaded. Please train the model first using train_imaging_agent.py"
+        )
+
+def request_deadline(request):
+    """Deadline (time.monotonic()) from X-Request-Timeout-Ms / X-Request-Deadline headers"""
     try:
-        if os.path.exists(MODEL_PATH):
-            imaging_agent = ImagingAgent(model_path=MODEL_PATH)
-            print(f"✓ Loaded existing model from {MODEL_PATH}")
-        else:
-            imaging_agent = ImagingAgent()
-            print("⚠ Model file not found. Please train the model first.")
-            print(f"Expected model path: {os.path.abspath(MODEL_PATH)}")
-    except Exception as e:
-        print(f"Warning: Could not load model: {e}")
-        imaging_agent = ImagingAgent()
-        print("✓ Created new model instance (needs training)")
+        return parse_deadline(
+            timeout_ms=request.headers.get("x-request-timeout-ms"),
+            deadline_epoch=request.headers.get("x-request-deadline"),
+            default_timeout_ms=DEFAULT_REQUEST_TIMEOUT_MS
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid X-Request-Timeout-Ms or X-Request-Deadline header")
+
+def admit(count, deadline, reserve=True):
+    """Reserve room for count images or fail fast with 429 (queue full) / 504 (deadline passed)"""
+    try:
+        if not reserve:
+            return admission.check(count, deadline)
+        return admission.try_acquire(count, deadline)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+def get_queue_depth():
+    """Total images waiting for a decode worker, inference worker or batch slot"""
+    if imaging_agent is None:
+        return 0
+    depth = 0
+    if imaging_agent.executor is not None:
+        depth += imaging_agent.executor.queue_depth
+    if imaging_agent.batcher is not None:
+        depth += imaging_agent.batcher.queue_depth
+    return depth
 
 @app.get("/")
 async def root():
     """Health check endpoint"""
-    model_loaded = imaging_agent is not None and imaging_agent.model is not None
+    model_loaded = imaging_agent is not None and imaging_agent.is_ready
     return {
         "status": "active",
         "service": "Imaging Agent API",
         "model_loaded": model_loaded,
+        "model_status": imaging_agent.status if imaging_agent else "missing",
         "classes": imaging_agent.class_names if imaging_agent else [],
         "model_path": MODEL_PATH,
-        "model_exists": os.path.exists(MODEL_PATH)
+        "model_exists": os.path.exists(MODEL_PATH),
+        "queue_depth": get_queue_depth(),
+        "pending_images": admission.pending if admission else 0
     }
 
+def save_upload(filename, contents, result, model_version):
+    """Write an upload to disk and index it with its diagnosis (runs after the response has been sent)"""
+    persisted = False
+    if PERSIST_UPLOADS:
+        try:
+            with open(UPLOAD_FOLDER / filename, "wb") as buffer:
+                buffer.write(contents)
+            persisted = True
+        except Exception as e:
+            print(f"⚠ Could not persist upload {filename}: {e}")
+    upload_index.record(
+        filename,
+        content_hash=PredictionCache.content_key(contents),
+        size=len(contents),
+        result=result,
+        model_version=model_version,
+        persisted=persisted
+    )
+    if persisted:
+        retention.notify()
+
 @app.post("/upload")
-async def upload_image(file: UploadFile = File(...)):
-    """Upload an ultrasound image for diagnosis"""
-    if not imaging_agent:
-        raise HTTPException(status_code=500, detail="Imaging agent not initialized")
+async def upload_image(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                       tta: Optional[bool] = None):
+    """
+    Upload an ultrasound image for diagnosis (?tta=true/false forces test-time augmentation on/off).
+    An X-Request-Timeout-Ms or X-Request-Deadline header makes the server drop the request once it expires.
+    """
+    ensure_model_ready()
     
-    if not imaging_agent.model:
-        raise HTTPException(
-            status_code=500, 
-            detail="Model not loaded. Please train the model first using train_imaging_agent.py"
-        )
-    
-    allowed_extensions = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff'}
     file_ext = Path(file.filename).suffix.lower()
     
-    if file_ext not in allowed_extensions:
+    if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
+    deadline = request_deadline(request)
+    admitted_at = admit(1, deadline)
+    completed = False
     try:
-        file_path = UPLOAD_FOLDER / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Decode straight from the upload buffer; the disk copy is a side-effect
+        contents = await file.read()
+        result = await imaging_agent.analyze_image_async(contents, tta, deadline)
+        completed = True
         
-        result = imaging_agent.analyze_image(str(file_path))
+        background_tasks.add_task(
+            save_upload, Path(file.filename).name, contents, result, imaging_agent.model_version
+        )
+        queue_embedding(Path(file.filename).name, contents, result)
         
         return {
             "success": True,
@@ -209,11 +1052,173 @@ async def upload_image(file: UploadFile = File(...)):
             "diagnosis": result
         }
     
+    except DeadlineExceeded as e:
+        admission.expired += 1
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error processing image: {str(e)}\n{traceback.format_exc()}"
         )
+    finally:
+        admission.release(1, admitted_at, completed)
+
+def _take(iterator, n):
+    """
+    Pull up to n items from a (blocking) archive iterator; an archive over
+    its limits ends with a (None, ArchiveLimitError) item
+    """
+    items = []
+    try:
+        for item in iterator:
+            items.append(item)
+            if len(items) >= n:
+                break
+    except ArchiveLimitError as e:
+        items.append((None, e))
+    return items
+
+async def _iter_upload_chunks(files, chunk_size):
+    """
+    Yield lists of (name, payload) from multipart files and zip/tar archives.
+    The payload is the image bytes, None for an unsupported file type, or the
+    ArchiveLimitError that stopped reading an archive.
+    """
+    chunk = []
+    for file in files:
+        if is_archive(file.filename):
+            members = iter_archive_images(
+                file.file, file.filename, ALLOWED_EXTENSIONS,
+                max_member_bytes=ARCHIVE_MAX_MEMBER_BYTES,
+                max_members=ARCHIVE_MAX_MEMBERS,
+                max_total_bytes=ARCHIVE_MAX_TOTAL_BYTES
+            )
+            while True:
+                # Archive reads/decompression happen off the event loop
+                items = await asyncio.to_thread(_take, members, chunk_size - len(chunk))
+                for name, payload in items:
+                    chunk.append((file.filename if name is None else f"{file.filename}/{name}", payload))
+                    if len(chunk) >= chunk_size:
+                        yield chunk
+                        chunk = []
+                if not items or isinstance(items[-1][1], ArchiveLimitError):
+                    break
+        else:
+            if Path(file.filename).suffix.lower() in ALLOWED_EXTENSIONS:
+                chunk.append((file.filename, await file.read()))
+            else:
+                # Signal unsupported files with a None payload so they get an error line
+                chunk.append((file.filename, None))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+async def _analyze_admitted_chunk(images, tta, deadline):
+    """Wait for admission, then analyze one chunk of a batch upload; returns one result or Exception per image"""
+    if not images:
+        return []
+    try:
+        admitted, admitted_at = await admission.acquire(len(images), deadline)
+    except DeadlineExceeded as e:
+        admission.expired += len(images)
+        return [e] * len(images)
+    completed = False
+    try:
+        results = await imaging_agent.analyze_batch_async(images, tta, deadline)
+        completed = True
+        return results
+    except DeadlineExceeded as e:
+        admission.expired += len(images)
+        return [e] * len(images)
+    except Exception as e:
+        return [e] * len(images)
+    finally:
+        admission.release(admitted, admitted_at, completed)
+
+@app.post("/upload-batch")
+async def upload_batch(request: Request, files: List[UploadFile] = File(...), tta: Optional[bool] = None):
+    """
+    Upload many images (multipart list and/or zip/tar archives) for diagnosis.
+    Results are streamed as NDJSON, one line per image, as each batch completes.
+    """
+    ensure_model_ready()
+    deadline = request_deadline(request)
+    # Refuse up front when overloaded; once streaming, later chunks wait for room instead
+    admit(1, deadline, reserve=False)
+    
+    async def stream_results():
+        processed = failed = 0
+        async for chunk in _iter_upload_chunks(files, UPLOAD_BATCH_SIZE):
+            valid = [(name, data) for name, data in chunk if isinstance(data, bytes)]
+            results = await _analyze_admitted_chunk([data for _, data in valid], tta, deadline)
+            remaining_results = iter(results)
+            for name, data in chunk:
+                if data is None:
+                    line = {"filename": name, "success": False,
+                            "error": f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"}
+                elif isinstance(data, ArchiveLimitError):
+                    line = {"filename": name, "success": False, "error": f"Archive rejected: {data}"}
+                else:
+                    result = next(remaining_results)
+                    if isinstance(result, Exception):
+                        line = {"filename": name, "success": False, "error": str(result)}
+                    else:
+                        line = {"filename": name, "success": True, "diagnosis": result}
+                        queue_embedding(name, data, result)
+                processed += 1
+                failed += 0 if line["success"] else 1
+                yield json.dumps(line) + "\n"
+        yield json.dumps({"summary": {"processed": processed, "failed": failed}}) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/similar")
+async def similar_cases(request: Request, file: UploadFile = File(...), k: int = 5):
+    """
+    Return the k most similar previously analyzed images (cosine similarity of backbone embeddings).
+    Analyzed images are only indexed with IMAGING_EMBEDDINGS=1.
+    """
+    ensure_model_ready()
+    
+    if Path(file.filename).suffix.lower() not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    if not 1 <= k <= 100:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 100")
+    
+    deadline = request_deadline(request)
+    admitted_at = admit(1, deadline)
+    completed = False
+    try:
+        contents = await file.read()
+        version, vector = await imaging_agent.embed_image_async(contents, deadline)
+        completed = True
+    except DeadlineExceeded as e:
+        admission.expired += 1
+        raise HTTPException(status_code=504, detail=str(e))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+    finally:
+        admission.release(1, admitted_at, completed)
+    
+    store = get_embedding_store(version)
+    results, method = await asyncio.to_thread(
+        store.search, vector, k, PredictionCache.content_key(contents)
+    )
+    return {
+        "success": True,
+        "filename": file.filename,
+        "model_version": version,
+        "search": method,
+        "indexed_cases": len(store),
+        "results": results
+    }
 
 @app.get("/diagnose")
 async def diagnose():
@@ -221,26 +1226,39 @@ async def diagnose():
     if not imaging_agent:
         return {"status": "error", "message": "Imaging agent not initialized"}
     
-    if not imaging_agent.model:
+    if imaging_agent.status in ("loading", "warming"):
+        return {"status": "loading", "message": "Model is still loading. Please retry shortly."}
+    
+    if not imaging_agent.is_ready:
         return {"status": "error", "message": "Model not loaded. Please train the model first."}
     
-    uploaded_files = list(UPLOAD_FOLDER.glob("*"))
-    image_files = [f for f in uploaded_files if f.suffix.lower() in {'.png', '.jpg', '.jpeg', '.bmp', '.tiff'}]
+    # The index reads the shared journal under a file lock; keep that off the event loop
+    latest = await asyncio.to_thread(upload_index.latest) if upload_index else None
     
-    if not image_files:
+    if latest is None:
         return {
             "status": "waiting",
             "message": "No image uploaded yet. Please upload an image first using POST /upload",
             "available_classes": imaging_agent.class_names
         }
     
-    latest_image = max(image_files, key=lambda x: x.stat().st_mtime)
-    
+    await asyncio.to_thread(upload_index.touch, latest["filename"])
     try:
-        result = imaging_agent.analyze_image(str(latest_image))
+        result = latest["result"]
+        # Only re-run inference if the stored diagnosis is missing or from another model
+        if result is None or latest["model_version"] != imaging_agent.model_version:
+            if not latest["persisted"]:
+                return {
+                    "status": "error",
+                    "message": f"Upload {latest['filename']} was not saved to disk and must be re-uploaded"
+                }
+            result = await imaging_agent.analyze_image_async(str(UPLOAD_FOLDER / latest["filename"]))
+            await asyncio.to_thread(
+                upload_index.update_result, latest["filename"], result, imaging_agent.model_version
+            )
         return {
             "status": "success",
-            "image_analyzed": latest_image.name,
+            "image_analyzed": latest["filename"],
             "diagnosis": result
         }
     except Exception as e:
@@ -250,32 +1268,115 @@ async def diagnose():
             "traceback": traceback.format_exc()
         }
 
+def embedding_store_stats():
+    """Stats of the current model's embedding store; a GET must not create it"""
+    if not imaging_agent.handle:
+        return None
+    store = existing_embedding_store(imaging_agent.handle.version)
+    return store.stats() if store else {"status": "not initialized"}
+
 @app.get("/model-info")
 async def model_info():
     """Get information about the model"""
     if not imaging_agent:
         raise HTTPException(status_code=500, detail="Imaging agent not initialized")
     
+    metadata = imaging_agent.handle.metadata if imaging_agent.handle else {}
+    # Reads the shared upload journal under its file lock
+    uploads = await asyncio.to_thread(retention.stats) if retention else None
     return {
-        "model_type": "MobileNetV2 Transfer Learning",
+        "model_type": metadata.get("model_type", "MobileNetV2 Transfer Learning"),
+        "model_version": imaging_agent.model_version,
         "classes": imaging_agent.class_names,
         "num_classes": imaging_agent.num_classes,
         "input_size": f"{imaging_agent.img_height}x{imaging_agent.img_width}",
         "model_path": MODEL_PATH,
-        "model_loaded": imaging_agent.model is not None,
-        "model_file_exists": os.path.exists(MODEL_PATH)
+        "model_loaded": imaging_agent.is_ready,
+        "model_status": imaging_agent.status,
+        "model_file_exists": os.path.exists(MODEL_PATH),
+        "backend": imaging_agent.handle.describe() if imaging_agent.handle else None,
+        "batching": imaging_agent.batcher.stats() if imaging_agent.batcher else {"enabled": False},
+        "executor": imaging_agent.executor.stats() if imaging_agent.executor else None,
+        "prediction_cache": imaging_agent.cache.stats(),
+        "admission": admission.stats() if admission else None,
+        "cascade": imaging_agent.cascade.stats() if imaging_agent.cascade else {"enabled": False},
+        "tta": {
+            "views": imaging_agent.tta_views,
+            "auto_threshold": imaging_agent.tta_threshold,
+            "images": imaging_agent.tta_images
+        },
+        "embeddings": dict(embedding_indexer.stats(), store=embedding_store_stats()) if embedding_indexer else {"enabled": False},
+        "uploads": uploads,
+        "worker_id": os.getenv("IMAGING_WORKER_ID"),
+        "queue_depth": get_queue_depth()
     }
 
+# ==================== Model registry admin ====================
+
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+def require_admin(request: Request):
+    """Admin endpoints: bearer token when IMAGING_ADMIN_TOKEN is set, localhost only otherwise"""
+    if ADMIN_TOKEN:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="Admin token required",
+                                headers={"WWW-Authenticate": "Bearer"})
+    elif request.client is None or request.client.host not in LOOPBACK_HOSTS:
+        raise HTTPException(status_code=403, detail="Admin endpoints are local-only; set IMAGING_ADMIN_TOKEN for remote access")
+
+def reload_model_version(version):
+    """Background job: load, warm and swap in a registry version"""
+    try:
+        imaging_agent.load_version(MODEL_REGISTRY, version, warmup_batch_sizes=WARMUP_BATCH_SIZES)
+        MODEL_REGISTRY.set_active(version)
+    except Exception as e:
+        print(f"⚠ Hot reload of {version} failed; still serving {imaging_agent.model_version}: {e}")
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+async def list_models():
+    """List registered model versions and the state of the latest reload"""
+    return {
+        "serving": imaging_agent.model_version if imaging_agent else None,
+        "active": MODEL_REGISTRY.active_version(),
+        "reload": imaging_agent.reload if imaging_agent else None,
+        "versions": MODEL_REGISTRY.versions()
+    }
+
+@app.post("/admin/models/{version}/load", dependencies=[Depends(require_admin)])
+async def load_model_version(version: str):
+    """Load a registered version in the background and swap it in once warm"""
+    if not imaging_agent:
+        raise HTTPException(status_code=500, detail="Imaging agent not initialized")
+    try:
+        MODEL_REGISTRY.artifact_path(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if imaging_agent.reload and imaging_agent.reload["state"] in ("loading", "warming"):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Model {imaging_agent.reload['version']} is already being loaded"
+        )
+    
+    imaging_agent.reload = {"version": version, "state": "loading", "error": None}
+    threading.Thread(target=reload_model_version, args=(version,), name="imaging-model-reload", daemon=True).start()
+    return JSONResponse(
+        status_code=202,
+        content={"success": True, "message": f"Loading model {version}; it will be swapped in once warm"}
+    )
+
 @app.delete("/clear-uploads")
 async def clear_uploads():
-    """Clear all uploaded images"""
+    """Clear all uploaded images (deletion runs in the background)"""
     try:
-        count = 0
-        for file in UPLOAD_FOLDER.glob("*"):
-            if file.is_file():
-                os.remove(file)
-                count += 1
-        return {"success": True, "message": f"Cleared {count} uploaded file(s)"}
+        pending = await asyncio.to_thread(len, upload_index)
+        retention.request_clear()
+        return JSONResponse(
+            status_code=202,
+            content={"success": True, "message": f"Clearing {pending} uploaded file(s) in the background"}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,96 @@
+# autotune.py - Startup benchmark that picks the replica / thread layout
+
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from replicas import cpu_cores
+
+
+def candidate_configs(max_replicas=None):
+    """Power-of-two replica counts, each splitting the physical cores evenly"""
+    cores = len(cpu_cores())
+    limit = min(cores, max_replicas or cores)
+    configs = []
+    replicas = 1
+    while replicas <= limit:
+        configs.append({"replicas": replicas, "threads_per_replica": max(1, cores // replicas)})
+        replicas *= 2
+    return configs
+
+
+def sample_image(size=(500, 500), seed=0):
+    """Synthetic PNG (speckle noise) so the benchmark also exercises decoding"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(size[1], size[0]), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).convert("RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def benchmark(agent, image_bytes, concurrency=32, duration=3.0):
+    """Drive ImagingAgent.predict from ``concurrency`` client threads for ``duration`` seconds"""
+    stop_at = time.monotonic() + duration
+
+    def client():
+        latencies = []
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            agent.predict(image_bytes, tta=False)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="imaging-autotune") as pool:
+        latencies = [t for f in [pool.submit(client) for _ in range(concurrency)] for t in f.result()]
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        "images_per_sec": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+    }
+
+
+def pick_best(results, max_p95_ms=None):
+    """Highest throughput within the p95 latency budget; lowest p95 if none meets it"""
+    within = [r for r in results if not max_p95_ms or r["p95_ms"] <= max_p95_ms]
+    if within:
+        return max(within, key=lambda r: (r["images_per_sec"], -r["p95_ms"]))
+    return min(results, key=lambda r: r["p95_ms"])
+
+
+def autotune(agent, load_fn, configs=None, concurrency=32, duration=3.0, max_p95_ms=None):
+    """
+    Benchmark replica layouts with ImagingAgent.predict and return (best config, all results).
+
+    :param agent: ImagingAgent whose replicas / num_threads are changed per candidate
+    :param load_fn: callable() that (re)loads and swaps in the model with the agent's current layout
+    :param configs: list of {"replicas", "threads_per_replica"} (default: candidate_configs())
+    :param concurrency: client threads calling predict at once
+    :param duration: seconds measured per candidate (after one warmup call)
+    :param max_p95_ms: latency budget; 0/None optimizes throughput only
+    """
+    configs = configs or candidate_configs()
+    image_bytes = sample_image()
+    results = []
+    for config in configs:
+        agent.replicas = config["replicas"]
+        agent.num_threads = config["threads_per_replica"]
+        try:
+            load_fn()
+            agent.predict(image_bytes, tta=False)
+            stats = benchmark(agent, image_bytes, concurrency=concurrency, duration=duration)
+        except Exception as e:
+            print(f"⚠ Autotune: {config} failed: {e}")
+            continue
+        results.append(dict(config, **stats))
+        print(f"  replicas={config['replicas']:<3} threads={config['threads_per_replica']:<3} "
+              f"{stats['images_per_sec']:>8.1f} img/s  p50 {stats['p50_ms']:>7.1f} ms  p95 {stats['p95_ms']:>7.1f} ms")
+    if not results:
+        raise RuntimeError("Autotune could not benchmark any configuration")
+    best = pick_best(results, max_p95_ms)
+    return {"replicas": best["replicas"], "threads_per_replica": best["threads_per_replica"]}, results
@@ -0,0 +1,268 @@
+# backends.py - Pluggable inference backends for the imaging agent
+#
+# Every backend takes a normalized float32 (N, H, W, 3) batch and returns
+# (N, num_classes) probabilities; backends that can also return the pooled
+# backbone features implement embed(). Runtimes are imported lazily so a node
+# only needs the one it actually serves with.
+
+import os
+import threading
+
+import numpy as np
+
+BACKENDS = ('keras', 'onnx', 'tflite')
+
+
+class InferenceBackend:
+    """Base class for model runtimes"""
+
+    name = "base"
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+
+    @property
+    def input_size(self):
+        """(height, width) expected by the model, or None if dynamic"""
+        return None
+
+    def predict(self, img_batch):
+        raise NotImplementedError
+
+    @property
+    def concurrency(self):
+        """Forward passes the backend can run at the same time"""
+        return 1
+
+    @property
+    def supports_embeddings(self):
+        return False
+
+    def embed(self, img_batch):
+        """(N, D) global-average-pooled backbone features"""
+        raise NotImplementedError(f"The {self.name} backend does not expose embeddings")
+
+    def describe(self):
+        """Summary for /model-info"""
+        return {
+            "backend": self.name,
+            "model_path": self.model_path,
+            "model_size_bytes": os.path.getsize(self.model_path) if os.path.exists(self.model_path) else None,
+            "shared_weights": str(self.shared_dir) if getattr(self, "shared_dir", None) else None,
+        }
+
+
+class KerasBackend(InferenceBackend):
+    """TensorFlow/Keras model loaded from .h5 / .keras"""
+
+    name = "keras"
+
+    def __init__(self, model_path, num_threads=None, inter_op_threads=None):
+        super().__init__(model_path)
+        import tensorflow as tf
+        try:
+            if num_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            if inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        except RuntimeError:
+            # TensorFlow sizes its thread pools once per process, at first use
+            print("⚠ TensorFlow thread pools are already initialized; keeping their current sizes")
+        # What this process actually runs with (0 = TensorFlow's default)
+        self.intra_op_threads = tf.config.threading.get_intra_op_parallelism_threads()
+        self.inter_op_threads = tf.config.threading.get_inter_op_parallelism_threads()
+        self.model = tf.keras.models.load_model(model_path, compile=False)
+        self._embedding_model = None
+        self._embedding_lock = threading.Lock()
+
+    @property
+    def input_size(self):
+        shape = self.model.input_shape
+        return (shape[1], shape[2]) if shape[1] and shape[2] else None
+
+    def predict(self, img_batch):
+        # Direct call avoids Model.predict's per-call dataset/callback setup,
+        # which dominates latency at serving batch sizes
+        return np.asarray(self.model(img_batch, training=False))
+
+    def _build_embedding_model(self):
+        """
+        Sub-model ending at the GlobalAveragePooling2D layer (MobileNetV2 head),
+        or at the last convolutional feature map pooled on the fly (Flatten heads
+        such as the DenseNet121 notebook model)
+        """
+        import tensorflow as tf
+        layers = self.model.layers
+        for layer in reversed(layers):
+            if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+                return tf.keras.Model(self.model.inputs, layer.output)
+        for layer in reversed(layers):
+            if len(layer.output.shape) == 4:
+                pooled = tf.keras.layers.GlobalAveragePooling2D()(layer.output)
+                return tf.keras.Model(self.model.inputs, pooled)
+        return None
+
+    @property
+    def supports_embeddings(self):
+        return self._get_embedding_model() is not None
+
+    def _get_embedding_model(self):
+        if self._embedding_model is None:
+            with self._embedding_lock:
+                if self._embedding_model is None:
+                    self._embedding_model = self._build_embedding_model() or False
+        return self._embedding_model or None
+
+    def describe(self):
+        info = super().describe()
+        info.update({"intra_op_threads": self.intra_op_threads, "inter_op_threads": self.inter_op_threads})
+        return info
+
+    def embed(self, img_batch):
+        model = self._get_embedding_model()
+        if model is None:
+            raise NotImplementedError("Model has no convolutional feature map to pool")
+        return np.asarray(model(img_batch, training=False))
+
+
+class OnnxBackend(InferenceBackend):
+    """ONNX Runtime CPU session"""
+
+    name = "onnx"
+
+    def __init__(self, model_path, num_threads=None, shared_weights=False):
+        super().__init__(model_path)
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime is required for .onnx models: pip install onnxruntime")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        session_path = model_path
+        self.shared_dir = None
+        if shared_weights:
+            from shared_weights import publish, onnx_external_initializers
+            self.shared_dir = publish(model_path, 'onnx')
+            # Keep the OrtValues alive: the session reads the weights from their (shared) buffers
+            self._shared_names, self._shared_values = onnx_external_initializers(self.shared_dir)
+            options.add_external_initializers(self._shared_names, self._shared_values)
+            # Pre-packed weight copies would be private to each process
+            options.add_session_config_entry("session.disable_prepacking", "1")
+            session_path = str(self.shared_dir / "model.onnx")
+        self.session = ort.InferenceSession(session_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+        # Models exported with an extra pooled-features output can serve embeddings
+        self.embedding_name = next(
+            (o.name for o in self.session.get_outputs()[1:] if "embedding" in o.name.lower()), None
+        )
+
+    @property
+    def input_size(self):
+        shape = self.session.get_inputs()[0].shape
+        return (shape[1], shape[2]) if isinstance(shape[1], int) and isinstance(shape[2], int) else None
+
+    def predict(self, img_batch):
+        img_batch = np.ascontiguousarray(img_batch, dtype=np.float32)
+        return self.session.run([self.output_name], {self.input_name: img_batch})[0]
+
+    @property
+    def supports_embeddings(self):
+        return self.embedding_name is not None
+
+    def embed(self, img_batch):
+        if self.embedding_name is None:
+            return super().embed(img_batch)
+        img_batch = np.ascontiguousarray(img_batch, dtype=np.float32)
+        return self.session.run([self.embedding_name], {self.input_name: img_batch})[0]
+
+
+class TFLiteBackend(InferenceBackend):
+    """TFLite interpreter (XNNPACK delegate on CPU), including int8-quantized models"""
+
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=None, shared_weights=False):
+        super().__init__(model_path)
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.shared_dir = None
+        if shared_weights:
+            # The interpreter mmaps model files, so a tmpfs copy is shared by every process
+            from shared_weights import publish
+            self.shared_dir = publish(model_path, 'tflite')
+            model_path = str(self.shared_dir / "model.tflite")
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads or None)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        # Interpreters are not thread-safe and are resized per batch size
+        self._lock = threading.Lock()
+        self._batch_size = int(self.input_detail['shape'][0])
+
+    @property
+    def input_size(self):
+        shape = self.input_detail['shape']
+        return (int(shape[1]), int(shape[2]))
+
+    def _quantize(self, img_batch):
+        dtype = self.input_detail['dtype']
+        if dtype == np.float32:
+            return img_batch.astype(np.float32, copy=False)
+        scale, zero_point = self.input_detail['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(img_batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output):
+        if self.output_detail['dtype'] == np.float32:
+            return output
+        scale, zero_point = self.output_detail['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def predict(self, img_batch):
+        with self._lock:
+            if len(img_batch) != self._batch_size:
+                shape = list(self.input_detail['shape'])
+                shape[0] = len(img_batch)
+                self.interpreter.resize_tensor_input(self.input_detail['index'], shape)
+                self.interpreter.allocate_tensors()
+                self.input_detail = self.interpreter.get_input_details()[0]
+                self.output_detail = self.interpreter.get_output_details()[0]
+                self._batch_size = len(img_batch)
+            self.interpreter.set_tensor(self.input_detail['index'], self._quantize(img_batch))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail['index'])
+        return self._dequantize(output)
+
+
+def detect_backend(model_path):
+    """Pick a backend from the artifact's file extension"""
+    suffix = os.path.splitext(model_path)[1].lower()
+    if suffix == '.onnx':
+        return 'onnx'
+    if suffix == '.tflite':
+        return 'tflite'
+    return 'keras'
+
+
+def load_backend(model_path, backend=None, num_threads=None, inter_op_threads=None, shared_weights=False):
+    """
+    Load a model artifact with the requested (or auto-detected) backend.
+    With ``shared_weights`` ONNX / TFLite weights are mapped from a shared-memory
+    copy (see shared_weights.py) so every worker process uses the same pages.
+    """
+    backend = backend if backend and backend != 'auto' else detect_backend(model_path)
+    if backend == 'keras':
+        if shared_weights:
+            print("⚠ Keras weights cannot be shared between processes; export to ONNX/TFLite to share them")
+        return KerasBackend(model_path, num_threads=num_threads, inter_op_threads=inter_op_threads)
+    if backend == 'onnx':
+        return OnnxBackend(model_path, num_threads=num_threads, shared_weights=shared_weights)
+    if backend == 'tflite':
+        return TFLiteBackend(model_path, num_threads=num_threads, shared_weights=shared_weights)
+    raise ValueError(f"Unknown inference backend '{backend}'. Choose from: {', '.join(BACKENDS)}")
@@ -0,0 +1,197 @@
+# batching.py - Dynamic micro-batching for imaging inference
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+import numpy as np
+
+from admission import DeadlineExceeded
+
+
+def _resolve(future, result=None, exception=None):
+    """Settle a claimed future; never lets a settling error take down the batching thread"""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-image requests and runs them through the
+    model as one forward pass.
+
+    A batch is flushed as soon as it holds ``max_batch_size`` images or the
+    oldest queued image has waited ``max_wait_ms`` milliseconds, whichever
+    comes first. Each caller gets back a Future resolving to its own row of
+    class probabilities.
+
+    Images are copied into a reusable batch buffer, so steady-state batching
+    does not allocate a new input array per forward pass. Requests whose
+    deadline passed while they were queued are failed with DeadlineExceeded
+    instead of being run.
+
+    With ``workers`` > 1 (one per model replica) several batching threads
+    pull from the same queue, so a new batch forms while others are running.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10.0, workers=1):
+        """
+        :param predict_fn: callable taking a (N, H, W, C) array and returning (N, num_classes)
+        :param max_batch_size: maximum number of images per forward pass
+        :param max_wait_ms: maximum time the first image of a batch waits for company
+        :param workers: batching threads (forward passes that may run concurrently)
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = max(1, workers)
+        self._queue = queue.Queue()
+        self._threads = []
+        self._running = False
+        self._lock = threading.Lock()
+        self.batches_run = 0
+        self.images_processed = 0
+        self.images_expired = 0
+
+    def start(self):
+        """Start the background batching thread"""
+        if self._running:
+            return
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._run, name=f"imaging-batcher-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the batching thread; requests still queued are failed"""
+        if not self._running:
+            return
+        self._running = False
+        # One shutdown sentinel per batching thread
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("Batcher stopped before request was processed"))
+
+    def submit(self, img_array, deadline=None):
+        """
+        Queue one preprocessed image of shape (H, W, C) or (1, H, W, C).
+        deadline is an optional time.monotonic() value after which the image is dropped.
+        Returns a concurrent.futures.Future with the probability vector.
+        """
+        if not self._running:
+            raise RuntimeError("Batcher is not running")
+        if img_array.ndim == 4:
+            img_array = img_array[0]
+        future = Future()
+        self._queue.put((img_array, future, deadline))
+        return future
+
+    def predict(self, img_array, timeout=None, deadline=None):
+        """Blocking helper: submit one image and wait for its probabilities"""
+        return self.submit(img_array, deadline).result(timeout=timeout)
+
+    @property
+    def queue_depth(self):
+        """Number of images waiting to be batched"""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Batching counters for monitoring"""
+        with self._lock:
+            batches, images = self.batches_run, self.images_processed
+        return {
+            "enabled": self._running,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "workers": self.workers,
+            "batches_run": batches,
+            "images_processed": images,
+            "avg_batch_size": round(images / batches, 2) if batches else 0.0,
+            "images_expired": self.images_expired,
+            "queue_depth": self.queue_depth,
+        }
+
+    def _collect(self):
+        """Block for the first request, then gather more until full or timed out"""
+        item = self._queue.get()
+        if item is None:
+            return []
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: finish this batch, then let this thread exit
+                self._running = False
+                break
+            batch.append(item)
+        return batch
+
+    def _fill_buffer(self, images, buffer):
+        """
+        Copy images into a batching thread's (lazily allocated) buffer.
+        Returns (filled view, buffer to reuse next time).
+        """
+        first = images[0]
+        if buffer is None or buffer.shape[1:] != first.shape or buffer.dtype != first.dtype:
+            buffer = np.empty((self.max_batch_size,) + first.shape, dtype=first.dtype)
+        inputs = buffer[:len(images)]
+        for i, img in enumerate(images):
+            inputs[i] = img
+        return inputs, buffer
+
+    def _run(self):
+        """Background loop: collect a batch, run one forward pass, fan results out"""
+        buffer = None
+        while self._running:
+            # Callers may cancel while queued (client gone); claiming a future makes it uncancellable
+            batch = [item for item in self._collect() if item[1].set_running_or_notify_cancel()]
+            now = time.monotonic()
+            expired = [item for item in batch if item[2] is not None and item[2] <= now]
+            if expired:
+                for _, future, _ in expired:
+                    _resolve(future, exception=DeadlineExceeded("Request deadline exceeded while queued for inference"))
+                batch = [item for item in batch if item[2] is None or item[2] > now]
+                with self._lock:
+                    self.images_expired += len(expired)
+            if not batch:
+                continue
+            futures = [future for _, future, _ in batch]
+            try:
+                inputs, buffer = self._fill_buffer([img for img, _, _ in batch], buffer)
+                predictions = self.predict_fn(inputs)
+            except Exception as e:
+                for future in futures:
+                    _resolve(future, exception=e)
+                continue
+            for i, future in enumerate(futures):
+                _resolve(future, result=predictions[i])
+            with self._lock:
+                self.batches_run += 1
+                self.images_processed += len(batch)
@@ -0,0 +1,60 @@
+# cascade.py - Confidence-gated two-stage model cascade
+
+import threading
+
+import numpy as np
+
+
+def check_compatible(primary_handle, fallback_handle):
+    """Both stages must predict the same classes, since either one may answer an image"""
+    if primary_handle.num_classes != fallback_handle.num_classes:
+        raise ValueError(
+            f"Cascade models must predict the same number of classes "
+            f"(primary {primary_handle.num_classes}, fallback {fallback_handle.num_classes})"
+        )
+
+
+class ModelCascade:
+    """
+    Routes images through a cheap primary model first and only escalates the
+    ones whose top-class probability is below ``threshold`` to an expensive
+    fallback model (e.g. MobileNetV2 -> DenseNet121).
+    """
+
+    def __init__(self, fallback_handle, threshold=0.85):
+        """
+        :param fallback_handle: ModelHandle of the expensive second-stage model
+        :param threshold: primary confidence at or above which its answer is accepted
+        """
+        self.handle = fallback_handle
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.primary_answered = 0
+        self.escalated = 0
+
+    @property
+    def version_tag(self):
+        """Identifies the cascade configuration in cache keys"""
+        return f"{self.handle.version}@{self.threshold:g}"
+
+    def escalation_mask(self, probabilities):
+        """Boolean mask of rows (N, num_classes) that need the fallback model; updates routing stats"""
+        probabilities = np.atleast_2d(probabilities)
+        mask = probabilities.max(axis=1) < self.threshold
+        escalated = int(mask.sum())
+        with self._lock:
+            self.escalated += escalated
+            self.primary_answered += len(mask) - escalated
+        return mask
+
+    def stats(self):
+        with self._lock:
+            total = self.primary_answered + self.escalated
+            return {
+                "enabled": True,
+                "fallback_version": self.handle.version,
+                "threshold": self.threshold,
+                "primary_answered": self.primary_answered,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,323 @@
+# dataset_shards.py - Compile the BUSI dataset into a manifest and pre-decoded uint8 shards
+#
+# Training and evaluation read resized images straight from memory-mapped
+# shards instead of walking the class folders and decoding PNGs on every run.
+# The *_mask.png ground-truth files are linked to their image in the manifest
+# instead of being treated as images.
+#
+# Layout (one directory per image size):
+#   busi_shards/224x224/
+#     manifest.json            <- size, classes, shard layout and one record per image:
+#                                 path, label, content_hash, masks, width, height, row
+#     images-<gen>-00000.u8    <- (shard_rows, H, W, 3) uint8 rows, memory-mapped
+#
+# Re-runs are incremental: files with an unchanged size and mtime are skipped,
+# new or changed files are hashed, and only content that is not compiled yet
+# is decoded (renamed or copied images reuse their row). Shards are rewritten
+# as a new generation when more than a quarter of their rows are unused.
+#
+# Usage:
+#   python dataset_shards.py build <Dataset_BUSI_with_GT> --output busi_shards --size 224
+#   python dataset_shards.py stats busi_shards/224x224
+
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from prediction_cache import PredictionCache
+from preprocess import decode_image, open_image
+
+CLASS_NAMES = ['benign', 'malignant', 'normal']
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff'}
+# "benign (1)_mask.png", "benign (1)_mask_1.png" -> "benign (1)"
+MASK_PATTERN = re.compile(r"^(?P<stem>.+?)_mask(?:_\d+)?$")
+MANIFEST_FILE = "manifest.json"
+
+
+def scan_dataset(dataset_dir, class_names=CLASS_NAMES):
+    """(path, label, mask paths) per image, one sub-folder per class, sorted by file name"""
+    items = []
+    for label, class_name in enumerate(class_names):
+        class_dir = Path(dataset_dir) / class_name
+        if not class_dir.is_dir():
+            continue
+        images, masks = {}, {}
+        for path in sorted(class_dir.iterdir()):
+            if path.suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            match = MASK_PATTERN.match(path.stem)
+            if match:
+                masks.setdefault(match["stem"], []).append(path)
+            else:
+                images[path.stem] = path
+        for stem, path in images.items():
+            items.append((path, label, masks.get(stem, [])))
+    return items
+
+
+def _decode(job):
+    """Process-pool worker: (original width, height, resized uint8 image)"""
+    path, width, height = job
+    with open(path, "rb") as f:
+        data = f.read()
+    with open_image(data) as img:
+        original = img.size
+    return original[0], original[1], decode_image(data, width, height)
+
+
+class ShardedDataset:
+    """Read-only view of a compiled dataset: manifest records plus memory-mapped image rows"""
+
+    def __init__(self, folder, manifest=None):
+        self.folder = Path(folder)
+        if manifest is None:
+            with open(self.folder / MANIFEST_FILE) as f:
+                manifest = json.load(f)
+        self.manifest = manifest
+        self.height = self.manifest["height"]
+        self.width = self.manifest["width"]
+        self.class_names = self.manifest["classes"]
+        self.records = self.manifest["images"]
+        self.labels = np.array([r["label"] for r in self.records], dtype=np.int64)
+        self._shards = {}
+
+    @staticmethod
+    def is_compiled(folder):
+        return (Path(folder) / MANIFEST_FILE).exists()
+
+    def __len__(self):
+        return len(self.records)
+
+    def _shard(self, index):
+        shard = self._shards.get(index)
+        if shard is None:
+            path = self.folder / shard_name(self.manifest["generation"], index)
+            row_bytes = self.height * self.width * 3
+            shard = np.memmap(path, dtype=np.uint8, mode="r",
+                              shape=(os.path.getsize(path) // row_bytes, self.height, self.width, 3))
+            self._shards[index] = shard
+        return shard
+
+    def images(self, indices):
+        """(len(indices), H, W, 3) uint8 images of the given manifest positions"""
+        shard_rows = self.manifest["shard_rows"]
+        out = np.empty((len(indices), self.height, self.width, 3), dtype=np.uint8)
+        for i, index in enumerate(indices):
+            row = self.records[index]["row"]
+            out[i] = self._shard(row // shard_rows)[row % shard_rows]
+        return out
+
+    def split(self, subset, validation_split=0.2):
+        """
+        Manifest positions of a subset, split like flow_from_directory:
+        per class, sorted by file name, the first ``validation_split`` is validation
+        """
+        positions = []
+        for label in range(len(self.class_names)):
+            members = [i for i, r in enumerate(self.records) if r["label"] == label]
+            split_at = int(validation_split * len(members))
+            positions += members[:split_at] if subset == 'validation' else members[split_at:]
+        return positions
+
+
+def shard_name(generation, index):
+    return f"images-{generation:03d}-{index:05d}.u8"
+
+
+class _ShardWriter:
+    """Appends uint8 rows to the shards of one generation, starting at ``row``"""
+
+    def __init__(self, folder, generation, shard_rows, row):
+        self.folder = folder
+        self.generation = generation
+        self.shard_rows = shard_rows
+        self.row = row
+
+    def append(self, image):
+        index, offset = divmod(self.row, self.shard_rows)
+        with open(self.folder / shard_name(self.generation, index), "ab") as f:
+            if f.tell() != offset * image.nbytes:
+                raise RuntimeError(f"Shard {index} is out of sync with the manifest")
+            f.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+        self.row += 1
+        return self.row - 1
+
+
+def _stored_rows(folder, generation, row_bytes):
+    """Complete rows in the current generation's shards (partial rows from a crash are cut off)"""
+    rows = 0
+    index = 0
+    while (folder / shard_name(generation, index)).exists():
+        path = folder / shard_name(generation, index)
+        size = os.path.getsize(path)
+        if size % row_bytes:
+            os.truncate(path, size - size % row_bytes)
+        rows += size // row_bytes
+        index += 1
+    return rows
+
+
+def _write_manifest(folder, manifest):
+    tmp_path = folder / (MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, folder / MANIFEST_FILE)
+
+
+def compile_dataset(dataset_dir, output_dir, size=(224, 224), class_names=CLASS_NAMES, shard_rows=1024,
+                    workers=None, compact_ratio=0.25):
+    """
+    Build or update the compiled dataset for one image size; returns build stats.
+
+    :param dataset_dir: BUSI-style folder (one sub-folder per class)
+    :param output_dir: root of the compiled datasets (a <H>x<W> folder is created inside)
+    :param size: (height, width) images are resized to
+    :param shard_rows: images per shard file
+    :param workers: decode processes (default: CPU count)
+    :param compact_ratio: fraction of unused rows that triggers rewriting the shards
+    """
+    height, width = size
+    folder = Path(output_dir) / f"{height}x{width}"
+    folder.mkdir(parents=True, exist_ok=True)
+    row_bytes = height * width * 3
+
+    previous = {"generation": 0, "images": []}
+    if ShardedDataset.is_compiled(folder):
+        with open(folder / MANIFEST_FILE) as f:
+            previous = json.load(f)
+        if previous.get("classes") != list(class_names) or previous.get("shard_rows") != shard_rows:
+            # Layout changed: start a fresh generation
+            previous = {"generation": previous["generation"] + 1, "images": []}
+    generation = previous["generation"]
+    # Shards of other generations are leftovers of an interrupted compaction
+    for path in folder.glob("images-*.u8"):
+        if not path.name.startswith(f"images-{generation:03d}-"):
+            path.unlink()
+
+    by_path = {r["path"]: r for r in previous["images"]}
+    by_hash = {r["content_hash"]: r for r in previous["images"]}
+    stored_rows = _stored_rows(folder, generation, row_bytes)
+    stats = {"images": 0, "unchanged": 0, "reused": 0, "decoded": 0, "removed": 0}
+
+    records, pending = [], []
+    for path, label, masks in scan_dataset(dataset_dir, class_names):
+        rel_path = path.relative_to(dataset_dir).as_posix()
+        stat = path.stat()
+        record = {
+            "path": rel_path,
+            "label": label,
+            "masks": [m.relative_to(dataset_dir).as_posix() for m in masks],
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        old = by_path.get(rel_path)
+        if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns and old["row"] < stored_rows:
+            record.update(content_hash=old["content_hash"], width=old["width"], height=old["height"], row=old["row"])
+            stats["unchanged"] += 1
+        else:
+            with open(path, "rb") as f:
+                record["content_hash"] = PredictionCache.content_key(f.read())
+            known = by_hash.get(record["content_hash"])
+            if known and known["row"] < stored_rows:
+                record.update(width=known["width"], height=known["height"], row=known["row"])
+                stats["reused"] += 1
+            else:
+                pending.append(record)
+        records.append(record)
+
+    if pending:
+        writer = _ShardWriter(folder, generation, shard_rows, stored_rows)
+        jobs = [(Path(dataset_dir) / r["path"], width, height) for r in pending]
+        decoded_by_hash = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for record, (orig_width, orig_height, image) in zip(pending, pool.map(_decode, jobs, chunksize=8)):
+                record.update(width=orig_width, height=orig_height)
+                # Identical new files are stored once
+                if record["content_hash"] not in decoded_by_hash:
+                    decoded_by_hash[record["content_hash"]] = writer.append(image)
+                record["row"] = decoded_by_hash[record["content_hash"]]
+        stats["decoded"] = len(decoded_by_hash)
+        stored_rows = writer.row
+
+    stats["removed"] = len(set(by_path) - {r["path"] for r in records})
+    stats["images"] = len(records)
+    manifest = {
+        "height": height,
+        "width": width,
+        "classes": list(class_names),
+        "source": os.path.abspath(dataset_dir),
+        "shard_rows": shard_rows,
+        "generation": generation,
+        "rows": stored_rows,
+        "images": records,
+    }
+
+    live_rows = {r["row"] for r in records}
+    unused = stored_rows - len(live_rows)
+    stats["compacted"] = bool(stored_rows and unused > compact_ratio * stored_rows)
+    if stats["compacted"]:
+        manifest = _compact(folder, manifest, row_bytes)
+    else:
+        _write_manifest(folder, manifest)
+    stats.update(rows=manifest["rows"], shards=-(-manifest["rows"] // shard_rows), folder=str(folder))
+    return stats
+
+
+def _compact(folder, manifest, row_bytes):
+    """Copy the used rows into a new shard generation, then switch the manifest to it"""
+    old = ShardedDataset(folder, manifest)
+    generation = manifest["generation"] + 1
+    writer = _ShardWriter(folder, generation, manifest["shard_rows"], 0)
+    new_rows = {}
+    records = []
+    for index, record in enumerate(manifest["images"]):
+        if record["row"] not in new_rows:
+            new_rows[record["row"]] = writer.append(old.images([index])[0])
+        records.append(dict(record, row=new_rows[record["row"]]))
+    compacted = dict(manifest, generation=generation, rows=writer.row, images=records)
+    _write_manifest(folder, compacted)
+    for path in folder.glob(f"images-{manifest['generation']:03d}-*.u8"):
+        path.unlink()
+    return compacted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the BUSI dataset into pre-decoded shards")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Build or incrementally update the shards")
+    build.add_argument("dataset_dir", help="BUSI-style folder (benign/ malignant/ normal/)")
+    build.add_argument("--output", default="busi_shards")
+    build.add_argument("--size", type=int, nargs="+", default=[224], help="Square size, or height width")
+    build.add_argument("--shard-rows", type=int, default=1024)
+    build.add_argument("--workers", type=int, default=None, help="Decode processes (default: CPU count)")
+    stats = subparsers.add_parser("stats", help="Summarize a compiled dataset")
+    stats.add_argument("folder", help="Compiled dataset folder (<output>/<H>x<W>)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        size = (args.size[0], args.size[-1])
+        result = compile_dataset(args.dataset_dir, args.output, size=size, shard_rows=args.shard_rows,
+                                 workers=args.workers)
+        print(f"✓ Compiled {result['images']} images into {result['folder']} "
+              f"({result['decoded']} decoded, {result['reused']} reused, {result['unchanged']} unchanged, "
+              f"{result['removed']} removed{', shards compacted' if result['compacted'] else ''})")
+    else:
+        dataset = ShardedDataset(args.folder)
+        counts = np.bincount(dataset.labels, minlength=len(dataset.class_names))
+        print(json.dumps({
+            "images": len(dataset),
+            "size": [dataset.height, dataset.width],
+            "classes": dict(zip(dataset.class_names, counts.tolist())),
+            "with_masks": sum(1 for r in dataset.records if r["masks"]),
+            "rows": dataset.manifest["rows"],
+            "generation": dataset.manifest["generation"],
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
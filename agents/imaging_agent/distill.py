@@ -0,0 +1,225 @@
+# distill.py - Distil the DenseNet121 notebook model into compact MobileNetV2 students
+#
+# The teacher labels every augmented training batch with softened
+# probabilities; each student, running at a reduced resolution, learns from
+# them (KL divergence at temperature T) plus the true labels (cross-entropy).
+# Students are saved as plain Keras models that take the serving pipeline's
+# [0, 1] input, so ImagingAgent.load_model and export_model.py accept them
+# as-is. The report compares accuracy, single-image latency and size of the
+# teacher and every student on a held-out test split.
+#
+# Usage:
+#   python distill.py --teacher densenet121_busi.h5 --data busi_shards/256x256 \
+#       --student-size 128 160 --width-multiplier 0.35 0.5 --epochs 30 --formats tflite
+
+import argparse
+import itertools
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from backends import load_backend
+from dataset_shards import ShardedDataset
+from export_model import (
+    list_labeled_images, evaluate_artifact, predict_in_batches, export_onnx, export_tflite
+)
+from preprocess import decode_image, normalize_batch
+from sweep import stratified_folds
+
+NUM_CLASSES = 3
+# Input sizes / width multipliers with ImageNet weights for MobileNetV2
+IMAGENET_SIZES = (96, 128, 160, 192, 224)
+IMAGENET_ALPHAS = (0.35, 0.5, 0.75, 1.0, 1.3, 1.4)
+
+
+# ==================== Data ====================
+
+def load_dataset(source, size):
+    """(uint8 images at the teacher's input size, labels) from compiled shards or a BUSI-style folder"""
+    if ShardedDataset.is_compiled(source):
+        dataset = ShardedDataset(source)
+        if (dataset.height, dataset.width) != tuple(size):
+            raise ValueError(f"{source} holds {dataset.height}x{dataset.width} images, "
+                             f"the teacher needs {size[0]}x{size[1]}")
+        return dataset.images(range(len(dataset))), dataset.labels
+    samples = list_labeled_images(source)
+    images = np.stack([decode_image(path, size[1], size[0]) for path, _ in samples])
+    return images, np.array([label for _, label in samples], dtype=np.int64)
+
+
+def split_dataset(labels, seed=123):
+    """Stratified 80/10/10 train/validation/test positions"""
+    folds = stratified_folds(labels, 10, seed)
+    return np.flatnonzero(folds >= 2), np.flatnonzero(folds == 1), np.flatnonzero(folds == 0)
+
+
+def resize_batch(images, size):
+    """uint8 or [0, 1] batch -> [0, 1] float32 batch at a student's input size"""
+    import tensorflow as tf
+    images = tf.cast(images, tf.float32) / 255.0 if images.dtype == tf.uint8 else images
+    return tf.image.resize(images, (size, size), antialias=True)
+
+
+# ==================== Models ====================
+
+def build_student(size, width_multiplier=0.5, dropout=0.2):
+    """
+    MobileNetV2 classifier for [0, 1] inputs at ``size`` x ``size``.
+    Returns (probabilities model, logits model) sharing all layers.
+    """
+    import tensorflow as tf
+    pretrained = size in IMAGENET_SIZES and width_multiplier in IMAGENET_ALPHAS
+    backbone = tf.keras.applications.MobileNetV2(
+        input_shape=(size, size, 3), alpha=width_multiplier, include_top=False,
+        weights='imagenet' if pretrained else None
+    )
+    inputs = tf.keras.Input(shape=(size, size, 3))
+    # The serving pipeline feeds [0, 1]; MobileNetV2 expects [-1, 1]
+    x = tf.keras.layers.Rescaling(2.0, offset=-1.0)(inputs)
+    x = backbone(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.Dropout(dropout)(x)
+    logits = tf.keras.layers.Dense(NUM_CLASSES)(x)
+    probabilities = tf.keras.layers.Activation('softmax')(logits)
+    name = f"mobilenetv2_{width_multiplier:g}_{size}_student"
+    return tf.keras.Model(inputs, probabilities, name=name), tf.keras.Model(inputs, logits)
+
+
+def distill(teacher, student, student_logits, images, labels, val_images, val_labels, size,
+            epochs=30, batch_size=32, lr=3e-4, temperature=4.0, kd_weight=0.7, patience=6, seed=0):
+    """
+    Train ``student`` against the teacher's softened outputs on augmented batches.
+    Keeps the weights with the best validation accuracy. Returns the training history.
+    """
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    augment = tf.keras.Sequential([
+        tf.keras.layers.RandomFlip('horizontal'),
+        tf.keras.layers.RandomRotation(20 / 360, fill_mode='nearest'),
+        tf.keras.layers.RandomZoom(0.15, fill_mode='nearest'),
+        tf.keras.layers.RandomTranslation(0.1, 0.1, fill_mode='nearest'),
+    ])
+    ds = tf.data.Dataset.from_tensor_slices((images, labels)).shuffle(len(images), seed=seed)
+    ds = ds.batch(batch_size).map(
+        lambda x, y: (augment(tf.cast(x, tf.float32), training=True) / 255.0, y),
+        num_parallel_calls=tf.data.AUTOTUNE
+    ).prefetch(tf.data.AUTOTUNE)
+    optimizer = tf.keras.optimizers.Adam(learning_rate=lr)
+
+    @tf.function
+    def train_step(x, y):
+        # The teacher sees the full-resolution view of the same augmented image
+        teacher_probs = teacher(x, training=False)
+        soft_targets = tf.nn.softmax(tf.math.log(teacher_probs + 1e-8) / temperature)
+        with tf.GradientTape() as tape:
+            logits = student_logits(resize_batch(x, size), training=True)
+            hard_loss = tf.reduce_mean(tf.keras.losses.sparse_categorical_crossentropy(y, logits, from_logits=True))
+            log_soft = tf.nn.log_softmax(logits / temperature)
+            kd_loss = tf.reduce_mean(tf.reduce_sum(
+                soft_targets * (tf.math.log(soft_targets + 1e-8) - log_soft), axis=1
+            )) * temperature ** 2
+            loss = kd_weight * kd_loss + (1 - kd_weight) * hard_loss
+        grads = tape.gradient(loss, student_logits.trainable_variables)
+        optimizer.apply_gradients(zip(grads, student_logits.trainable_variables))
+        return loss
+
+    val_inputs = resize_batch(tf.constant(val_images), size).numpy()
+    history, best_accuracy, best_weights, waited = [], -1.0, None, 0
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        losses = [float(train_step(x, y)) for x, y in ds]
+        val_probs = np.concatenate([student(val_inputs[i:i + 64], training=False).numpy()
+                                    for i in range(0, len(val_inputs), 64)])
+        val_accuracy = float((val_probs.argmax(axis=1) == val_labels).mean())
+        history.append({"epoch": epoch + 1, "loss": round(float(np.mean(losses)), 4),
+                        "val_accuracy": round(val_accuracy, 4), "seconds": round(time.perf_counter() - start, 1)})
+        print(f"  epoch {epoch + 1:>3}: loss {np.mean(losses):.4f}  val_acc {val_accuracy:.4f}")
+        if val_accuracy > best_accuracy:
+            best_accuracy, best_weights, waited = val_accuracy, student.get_weights(), 0
+        else:
+            waited += 1
+            if waited >= patience:
+                break
+    student.set_weights(best_weights)
+    return history
+
+
+# ==================== Report ====================
+
+def main():
+    parser = argparse.ArgumentParser(description="Distil the DenseNet121 teacher into compact MobileNetV2 students")
+    parser.add_argument("--teacher", required=True, help="Teacher Keras model (.h5 / .keras)")
+    parser.add_argument("--data", required=True,
+                        help="BUSI-style folder, or shards compiled at the teacher's input size")
+    parser.add_argument("--student-size", type=int, nargs="+", default=[160], help="Student input resolutions")
+    parser.add_argument("--width-multiplier", type=float, nargs="+", default=[0.5], help="MobileNetV2 alpha values")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=3e-4)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--kd-weight", type=float, default=0.7, help="Weight of the distillation loss vs. true labels")
+    parser.add_argument("--formats", nargs="*", choices=["onnx", "tflite"], default=[],
+                        help="Also export every student and include the artifacts in the report")
+    parser.add_argument("--output-dir", default="distilled_models")
+    parser.add_argument("--seed", type=int, default=123)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    teacher = tf.keras.models.load_model(args.teacher, compile=False)
+    teacher_size = tuple(teacher.input_shape[1:3])
+    print(f"✓ Teacher {args.teacher} (input {teacher_size[0]}x{teacher_size[1]}, {teacher.count_params():,} parameters)")
+
+    images, labels = load_dataset(args.data, teacher_size)
+    train, val, test = split_dataset(labels, args.seed)
+    print(f"✓ {len(images)} images: {len(train)} train / {len(val)} validation / {len(test)} test")
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    test_teacher_inputs = normalize_batch(images[test])
+    teacher_backend = load_backend(args.teacher, backend="keras")
+    teacher_probs = predict_in_batches(teacher_backend, test_teacher_inputs)
+    reports = [dict(evaluate_artifact(teacher_backend, test_teacher_inputs, labels[test], teacher_probs),
+                    role="teacher", input_size=teacher_size[0], parameters=teacher.count_params())]
+
+    for size, width_multiplier in itertools.product(args.student_size, args.width_multiplier):
+        student, student_logits = build_student(size, width_multiplier)
+        print(f"\n⏱ Distilling into {student.name} ({student.count_params():,} parameters)")
+        history = distill(
+            teacher, student, student_logits, images[train], labels[train], images[val], labels[val], size,
+            epochs=args.epochs, batch_size=args.batch_size, lr=args.lr, temperature=args.temperature,
+            kd_weight=args.kd_weight, seed=args.seed
+        )
+        student_path = str(output_dir / f"{student.name}.keras")
+        student.save(student_path)
+        print(f"✓ Saved {student_path}")
+
+        test_inputs = resize_batch(tf.constant(images[test]), size).numpy()
+        artifacts = [student_path]
+        if "onnx" in args.formats:
+            artifacts.append(export_onnx(student, str(output_dir / f"{student.name}.onnx"), (size, size)))
+        if "tflite" in args.formats:
+            artifacts.append(export_tflite(student, str(output_dir / f"{student.name}.tflite")))
+        for path in artifacts:
+            # Loaded the same way ImagingAgent.load_model does
+            report = evaluate_artifact(load_backend(path), test_inputs, labels[test], teacher_probs)
+            reports.append(dict(report, role="student", input_size=size, width_multiplier=width_multiplier,
+                                parameters=student.count_params(), epochs=len(history), history=history))
+
+    report_path = output_dir / "distillation_report.json"
+    with open(report_path, "w") as f:
+        json.dump({"teacher": args.teacher, "test_images": int(len(test)), "temperature": args.temperature,
+                   "kd_weight": args.kd_weight, "models": reports}, f, indent=2)
+
+    print("\n" + "=" * 100)
+    print(f"{'model':<44}{'input':>7}{'params':>12}{'size MB':>9}{'ms/img':>9}{'acc':>8}{'agree':>8}")
+    print("=" * 100)
+    for r in reports:
+        print(f"{Path(r['path']).name:<44}{r['input_size']:>7}{r['parameters']:>12,}{r['size_mb']:>9.2f}"
+              f"{r['latency_ms']:>9.2f}{r['accuracy']:>8.3f}{r['top1_agreement']:>8.3f}")
+    print(f"\n✓ Report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# embedding_indexer.py - Background embedding extraction for analyzed images
+
+import queue
+import threading
+
+from prediction_cache import PredictionCache
+
+
+class EmbeddingIndexer:
+    """
+    Embeds analyzed images off the request path and appends them to the
+    embedding store of the model version that produced them.
+
+    Images are queued by the API handlers and processed in batches of up to
+    ``batch_size`` so the backbone runs one forward pass per batch. Images
+    already in the store are skipped before decoding. When the queue is full
+    new images are dropped (and counted) rather than slowing down requests.
+    """
+
+    def __init__(self, embed_fn, store_for, version_fn, batch_size=32, max_queue=1024):
+        """
+        :param embed_fn: callable(list of bytes) -> (version, (M, D) vectors, indices of the embedded inputs)
+        :param store_for: callable(version) -> EmbeddingStore
+        :param version_fn: callable() -> version currently served (used to skip known images)
+        :param batch_size: images embedded per forward pass
+        :param max_queue: images waiting to be embedded before new ones are dropped
+        """
+        self.embed_fn = embed_fn
+        self.store_for = store_for
+        self.version_fn = version_fn
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.supported = True
+        self.indexed = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="embedding-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def submit(self, data, record):
+        """Queue raw image bytes with their metadata record; returns False if dropped"""
+        if not self.supported or self._thread is None:
+            return False
+        try:
+            self._queue.put_nowait((data, record))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _collect(self):
+        """Block for one item, then take whatever else is queued (up to batch_size)"""
+        item = self._queue.get()
+        if item is None:
+            return None
+        items = [item]
+        while len(items) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                break
+            if not self.supported:
+                continue
+            try:
+                self._process(items)
+            except NotImplementedError as e:
+                self.supported = False
+                print(f"⚠ Embedding extraction disabled: {e}")
+            except Exception as e:
+                self.failed += len(items)
+                print(f"⚠ Embedding extraction error: {e}")
+
+    def _process(self, items):
+        store = self.store_for(self.version_fn())
+        pending = []
+        for data, record in items:
+            record = dict(record, content_hash=PredictionCache.content_key(data))
+            if record["content_hash"] in store:
+                self.skipped += 1
+            else:
+                pending.append((data, record))
+        if not pending:
+            return
+
+        version, vectors, rows = self.embed_fn([data for data, _ in pending])
+        self.failed += len(pending) - len(rows)
+        if rows:
+            store = self.store_for(version)
+            self.indexed += store.append(vectors, [pending[i][1] for i in rows])
+            store.maybe_build_ann_index()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "enabled": self.supported and self._thread is not None,
+            "batch_size": self.batch_size,
+            "queue_depth": self.queue_depth,
+            "indexed": self.indexed,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,389 @@
+# embedding_store.py - Append-only image embedding store with similar-case search
+#
+# Layout (one directory per model version; embeddings of different backbones
+# are not comparable):
+#   embeddings/<version>/
+#     store.json         <- {"version": ..., "dim": ...}
+#     vectors.f32        <- L2-normalized float32 rows, append-only, memory-mapped for search
+#     metadata.jsonl     <- one JSON record per row (content_hash, filename, prediction, ...)
+#     ivfpq.faiss        <- optional IVF-PQ index over the first N rows (needs faiss)
+#
+# Usage:
+#   python embedding_store.py build-index embeddings/v3 --nlist 4096 --m 32
+#   python embedding_store.py stats embeddings/v3
+
+import argparse
+import importlib.util
+import json
+import math
+import os
+import re
+import threading
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows; run a single server process there
+    fcntl = None
+
+
+def store_dir_name(version):
+    """Filesystem-safe directory name for a model version"""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(version)).strip("._")[-96:] or "default"
+
+
+def _top_k(scores, ids, k):
+    """The k highest scores (and their ids), best first"""
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[keep], ids[keep]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], ids[order]
+
+
+class EmbeddingStore:
+    """
+    Append-only float32 matrix of image embeddings plus a JSONL metadata table.
+
+    Vectors are normalized on insert, so cosine similarity is a single
+    matrix-vector product over the memory-mapped file, done in chunks to bound
+    memory. Once the store holds ``ann_min_vectors`` rows and faiss is
+    installed, an IVF-PQ index narrows the search to a candidate set that is
+    then re-scored exactly; rows appended after the index was built are always
+    searched exhaustively.
+
+    Several server processes may share a store: appends are serialized with
+    an advisory file lock, and each process picks up rows written by the
+    others before appending or searching.
+    """
+
+    HEADER_FILE = "store.json"
+    VECTORS_FILE = "vectors.f32"
+    METADATA_FILE = "metadata.jsonl"
+    ANN_FILE = "ivfpq.faiss"
+    LOCK_FILE = ".lock"
+
+    def __init__(self, folder, version=None, search_chunk_rows=262144, ann_min_vectors=2_000_000, nprobe=16):
+        """
+        :param folder: store directory (created if missing)
+        :param version: model version whose backbone produced the embeddings
+        :param search_chunk_rows: rows scored per matrix product in exact search
+        :param ann_min_vectors: store size at which the IVF-PQ index is used / built
+        :param nprobe: IVF lists visited per approximate query
+        """
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.version = version
+        self.search_chunk_rows = search_chunk_rows
+        self.ann_min_vectors = ann_min_vectors
+        self.nprobe = nprobe
+        self.vectors_path = self.folder / self.VECTORS_FILE
+        self.metadata_path = self.folder / self.METADATA_FILE
+        self.dim = None
+        self._lock = threading.Lock()
+        # Byte offset of every metadata line, so records are read on demand
+        self._offsets = array("q")
+        self._rows_by_hash = {}
+        self._count = 0
+        # End of the last complete metadata line this process has read
+        self._metadata_bytes = 0
+        self._matrix = None
+        self._ann = None
+        self._building = False
+        self._load()
+
+    # ---------- persistence ----------
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process using this store"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.folder / self.LOCK_FILE, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_header(self):
+        header_path = self.folder / self.HEADER_FILE
+        if header_path.exists():
+            with open(header_path) as f:
+                header = json.load(f)
+            self.dim = header.get("dim")
+            self.version = self.version or header.get("version")
+
+    def _read_metadata(self):
+        """Index complete metadata lines written since the last read; returns the valid byte count"""
+        valid_bytes = self._metadata_bytes
+        if not self.metadata_path.exists():
+            return valid_bytes
+        with open(self.metadata_path, "rb") as f:
+            f.seek(valid_bytes)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    # EOF, a write still in progress, or a torn final write after a crash
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self._offsets.append(offset)
+                self._rows_by_hash.setdefault(record.get("content_hash"), len(self._offsets) - 1)
+                valid_bytes = f.tell()
+        self._metadata_bytes = valid_bytes
+        return valid_bytes
+
+    def _vector_rows(self):
+        if self.dim and self.vectors_path.exists():
+            return os.path.getsize(self.vectors_path) // (self.dim * 4)
+        return 0
+
+    def _load(self):
+        with self._file_lock():
+            self._read_header()
+            valid_bytes = self._read_metadata()
+
+            # Vectors are written before metadata; drop whatever only one side has.
+            # Safe under the lock: no other process is mid-append.
+            self._count = min(len(self._offsets), self._vector_rows())
+            if self.vectors_path.exists() and self.dim:
+                if os.path.getsize(self.vectors_path) != self._count * self.dim * 4:
+                    os.truncate(self.vectors_path, self._count * self.dim * 4)
+            if len(self._offsets) > self._count:
+                valid_bytes = self._offsets[self._count]
+                del self._offsets[self._count:]
+                self._rows_by_hash = {h: r for h, r in self._rows_by_hash.items() if r < self._count}
+            if self.metadata_path.exists() and os.path.getsize(self.metadata_path) != valid_bytes:
+                os.truncate(self.metadata_path, valid_bytes)
+            self._metadata_bytes = valid_bytes
+
+        ann_path = self.folder / self.ANN_FILE
+        if ann_path.exists() and importlib.util.find_spec("faiss") is not None:
+            import faiss
+            index = faiss.read_index(str(ann_path))
+            if index.ntotal <= self._count:
+                self._ann = index
+
+    def _write_header(self):
+        tmp_path = self.folder / (self.HEADER_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.version, "dim": self.dim}, f)
+        os.replace(tmp_path, self.folder / self.HEADER_FILE)
+
+    def _refresh(self):
+        """Pick up rows appended by other processes (caller holds self._lock)"""
+        if self.dim is None:
+            self._read_header()
+        if not self.metadata_path.exists() or os.path.getsize(self.metadata_path) == self._metadata_bytes:
+            return
+        self._read_metadata()
+        # A row counts once both its vector and its metadata line are complete
+        count = min(len(self._offsets), self._vector_rows())
+        if count != self._count:
+            self._count = count
+            self._matrix = None
+
+    def append(self, vectors, records):
+        """
+        Add embeddings with their metadata records (each needs a content_hash).
+        Images already in the store are skipped. Returns the number of rows added.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(records), -1)
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._write_header()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dim}")
+
+            keep, seen = [], set()
+            for i, record in enumerate(records):
+                content_hash = record["content_hash"]
+                if content_hash in self._rows_by_hash or content_hash in seen:
+                    continue
+                seen.add(content_hash)
+                keep.append(i)
+            if not keep:
+                return 0
+
+            vectors = vectors[keep]
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.astype(np.float32, copy=False).tobytes())
+            with open(self.metadata_path, "ab") as f:
+                for row, i in enumerate(keep, start=self._count):
+                    self._offsets.append(f.tell())
+                    self._rows_by_hash[records[i]["content_hash"]] = row
+                    f.write((json.dumps(dict(records[i], row=row)) + "\n").encode())
+                self._metadata_bytes = f.tell()
+            self._count += len(keep)
+            self._matrix = None
+            return len(keep)
+
+    # ---------- queries ----------
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, content_hash):
+        return content_hash in self._rows_by_hash
+
+    def _snapshot(self):
+        """(matrix view, row count, ann index) consistent with each other"""
+        with self._lock:
+            self._refresh()
+            if self._count and (self._matrix is None or len(self._matrix) != self._count):
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                         shape=(self._count, self.dim))
+            return self._matrix, self._count, self._ann
+
+    def records(self, rows):
+        """Metadata records for the given row numbers"""
+        found = []
+        with open(self.metadata_path, "rb") as f:
+            for row in rows:
+                f.seek(self._offsets[row])
+                found.append(json.loads(f.readline()))
+        return found
+
+    def _exact(self, matrix, query, start, stop, k):
+        best_scores, best_ids = np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        for chunk_start in range(start, stop, self.search_chunk_rows):
+            chunk_stop = min(chunk_start + self.search_chunk_rows, stop)
+            scores = matrix[chunk_start:chunk_stop] @ query
+            ids = np.arange(chunk_start, chunk_stop, dtype=np.int64)
+            best_scores, best_ids = _top_k(np.concatenate([best_scores, scores]),
+                                           np.concatenate([best_ids, ids]), k)
+        return best_scores, best_ids
+
+    def search(self, query, k=5, exclude_hash=None, oversample=10):
+        """
+        k most similar stored images by cosine similarity.
+        Returns (results, method) where each result is the row's metadata plus "score".
+        """
+        matrix, count, ann = self._snapshot()
+        if not count:
+            return [], "exact"
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match store dimension {self.dim}")
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        # One extra candidate in case the query image itself is stored
+        wanted = k + (1 if exclude_hash is not None and exclude_hash in self._rows_by_hash else 0)
+
+        if ann is not None and count >= self.ann_min_vectors:
+            method = "ivfpq"
+            ann.nprobe = self.nprobe
+            _, candidates = ann.search(query[np.newaxis], wanted * oversample)
+            candidates = np.sort(candidates[0][candidates[0] >= 0])
+            # Re-rank the approximate candidates exactly, then add the unindexed tail
+            scores, ids = _top_k(matrix[candidates] @ query, candidates, wanted)
+            tail_scores, tail_ids = self._exact(matrix, query, ann.ntotal, count, wanted)
+            scores, ids = _top_k(np.concatenate([scores, tail_scores]), np.concatenate([ids, tail_ids]), wanted)
+        else:
+            method = "exact"
+            scores, ids = self._exact(matrix, query, 0, count, wanted)
+
+        results = []
+        for score, record in zip(scores, self.records(ids)):
+            if exclude_hash is not None and record.get("content_hash") == exclude_hash:
+                continue
+            results.append(dict(record, score=round(float(score), 6)))
+        return results[:k], method
+
+    # ---------- approximate index ----------
+
+    def build_ann_index(self, nlist=None, m=None, train_size=None, seed=0):
+        """Train and write an IVF-PQ (inner product) index over the current rows"""
+        try:
+            import faiss
+        except ImportError:
+            raise ImportError("faiss is required for the IVF-PQ index: pip install faiss-cpu")
+        matrix, count, _ = self._snapshot()
+        if not count:
+            raise ValueError("Cannot build an index over an empty store")
+        nlist = nlist or max(1, min(65536, int(4 * math.sqrt(count))))
+        m = m or next(d for d in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1) if self.dim % d == 0)
+        train_size = min(count, train_size or max(nlist * 39, 65536))
+        rng = np.random.default_rng(seed)
+        sample = np.ascontiguousarray(matrix[np.sort(rng.choice(count, train_size, replace=False))])
+
+        quantizer = faiss.IndexFlatIP(self.dim)
+        index = faiss.IndexIVFPQ(quantizer, self.dim, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(sample)
+        for start in range(0, count, self.search_chunk_rows):
+            index.add(np.ascontiguousarray(matrix[start:min(start + self.search_chunk_rows, count)]))
+
+        tmp_path = self.folder / (self.ANN_FILE + ".tmp")
+        faiss.write_index(index, str(tmp_path))
+        os.replace(tmp_path, self.folder / self.ANN_FILE)
+        with self._lock:
+            self._ann = index
+        print(f"✓ Built IVF-PQ index over {count} embeddings (nlist={nlist}, m={m})")
+        return index
+
+    def maybe_build_ann_index(self, stale_fraction=0.2):
+        """Build or rebuild the IVF-PQ index on a background thread once the store is large enough"""
+        if self._building or self._count < self.ann_min_vectors or importlib.util.find_spec("faiss") is None:
+            return False
+        if self._ann is not None and self._count - self._ann.ntotal < stale_fraction * self._count:
+            return False
+        self._building = True
+
+        def build():
+            try:
+                self.build_ann_index()
+            except Exception as e:
+                print(f"⚠ IVF-PQ index build failed: {e}")
+            finally:
+                self._building = False
+
+        threading.Thread(target=build, name="embedding-ann-build", daemon=True).start()
+        return True
+
+    def stats(self):
+        ann = self._ann
+        return {
+            "version": self.version,
+            "vectors": self._count,
+            "dim": self.dim,
+            "ann_index": {"vectors": int(ann.ntotal), "nlist": int(ann.nlist), "nprobe": self.nprobe} if ann else None,
+            "ann_building": self._building,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage an imaging embedding store")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build-index", help="Train an IVF-PQ index over the stored embeddings")
+    build.add_argument("store")
+    build.add_argument("--nlist", type=int, help="IVF lists (default 4*sqrt(N))")
+    build.add_argument("--m", type=int, help="PQ sub-quantizers (must divide the embedding dimension)")
+    build.add_argument("--train-size", type=int)
+
+    stats = sub.add_parser("stats", help="Show store size and index state")
+    stats.add_argument("store")
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.store)
+    if args.command == "build-index":
+        store.build_ann_index(nlist=args.nlist, m=args.m, train_size=args.train_size)
+    else:
+        print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
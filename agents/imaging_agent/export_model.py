@@ -0,0 +1,253 @@
+# export_model.py - Convert trained imaging models into CPU serving artifacts
+#
+# Converts a Keras model produced by train_agent.py (MobileNetV2) or the
+# DenseNet121 notebook into ONNX and/or TFLite, optionally with post-training
+# int8 quantization calibrated on real images, and writes an accuracy-delta
+# report comparing every artifact against the original Keras model.
+#
+# Usage:
+#   python export_model.py --model best_model.h5 --formats onnx tflite \
+#       --quantize int8 --calibration-dir <Dataset_BUSI_with_GT> --eval-dir <Dataset_BUSI_with_GT>
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from backends import load_backend
+from dataset_shards import ShardedDataset
+from preprocess import decode_image, normalize_batch
+
+CLASS_NAMES = ['benign', 'malignant', 'normal']
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff'}
+
+
+# ==================== Data helpers ====================
+
+def list_labeled_images(dataset_dir, class_names=CLASS_NAMES, limit=None, seed=123):
+    """
+    Return (path, class_index) pairs from a BUSI-style folder
+    (one sub-folder per class), skipping the *_mask.png ground-truth files.
+    """
+    samples = []
+    for label, class_name in enumerate(class_names):
+        class_dir = Path(dataset_dir) / class_name
+        if not class_dir.is_dir():
+            continue
+        for path in sorted(class_dir.iterdir()):
+            if path.suffix.lower() in IMAGE_SUFFIXES and '_mask' not in path.stem:
+                samples.append((str(path), label))
+    rng = np.random.default_rng(seed)
+    rng.shuffle(samples)
+    return samples[:limit] if limit else samples
+
+
+def load_images(paths, input_size):
+    """Decode paths into one normalized float32 batch"""
+    height, width = input_size
+    return normalize_batch(np.stack([decode_image(p, width, height) for p in paths]))
+
+
+def load_labeled_set(source, input_size, limit=None, seed=123):
+    """
+    (normalized images, labels) from a BUSI-style folder, or from a dataset
+    compiled with dataset_shards.py at the model's input size (no decoding)
+    """
+    if ShardedDataset.is_compiled(source):
+        dataset = ShardedDataset(source)
+        if (dataset.height, dataset.width) != tuple(input_size):
+            raise ValueError(f"{source} holds {dataset.height}x{dataset.width} images, "
+                             f"the model needs {input_size[0]}x{input_size[1]}")
+        positions = np.random.default_rng(seed).permutation(len(dataset))[:limit]
+        return normalize_batch(dataset.images(positions)), dataset.labels[positions]
+    samples = list_labeled_images(source, limit=limit, seed=seed)
+    return load_images([p for p, _ in samples], input_size), np.array([label for _, label in samples])
+
+
+def predict_in_batches(backend, images, batch_size=16):
+    return np.concatenate([backend.predict(images[i:i + batch_size])
+                           for i in range(0, len(images), batch_size)])
+
+
+# ==================== Exporters ====================
+
+def export_onnx(keras_model, output_path, input_size, opset=13):
+    """Convert a Keras model to ONNX with a dynamic batch dimension"""
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise ImportError("tf2onnx is required for ONNX export: pip install tf2onnx")
+    spec = (tf.TensorSpec((None, input_size[0], input_size[1], 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=opset, output_path=output_path)
+    return output_path
+
+
+def quantize_onnx_int8(fp32_path, output_path, calibration_images):
+    """Static int8 quantization (QDQ format) of an ONNX model using a calibration batch"""
+    try:
+        import onnxruntime as ort
+        from onnxruntime.quantization import (
+            quantize_static, CalibrationDataReader, QuantFormat, QuantType
+        )
+    except ImportError:
+        raise ImportError("onnxruntime is required for ONNX quantization: pip install onnxruntime")
+
+    input_name = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class _CalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._samples = iter(calibration_images[i:i + 1] for i in range(len(calibration_images)))
+
+        def get_next(self):
+            sample = next(self._samples, None)
+            return None if sample is None else {input_name: sample}
+
+    quantize_static(
+        fp32_path, output_path, _CalibrationReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True
+    )
+    return output_path
+
+
+def export_tflite(keras_model, output_path, quantize=None, calibration_images=None):
+    """
+    Convert a Keras model to TFLite.
+    quantize: None (float32), 'dynamic' (int8 weights), 'float16' or 'int8'
+    (full integer kernels calibrated on calibration_images; float32 I/O kept
+    so the artifact is a drop-in replacement).
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantize in ('dynamic', 'float16', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        if calibration_images is None or not len(calibration_images):
+            raise ValueError("int8 quantization needs --calibration-dir")
+
+        def representative_dataset():
+            for i in range(len(calibration_images)):
+                yield [calibration_images[i:i + 1]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+    return output_path
+
+
+# ==================== Accuracy-delta report ====================
+
+def measure_latency(backend, images, runs=20):
+    """Median single-image latency in milliseconds"""
+    sample = images[:1]
+    backend.predict(sample)  # warmup
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.predict(sample)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings))
+
+
+def evaluate_artifact(backend, images, labels, reference_probs):
+    """Compare an artifact's predictions with the reference Keras model"""
+    probs = predict_in_batches(backend, images)
+    predicted = probs.argmax(axis=1)
+    report = {
+        "backend": backend.name,
+        "path": backend.model_path,
+        "size_mb": round(os.path.getsize(backend.model_path) / 1e6, 2),
+        "latency_ms": round(measure_latency(backend, images), 2),
+        "top1_agreement": float((predicted == reference_probs.argmax(axis=1)).mean()),
+        "max_abs_prob_delta": float(np.abs(probs - reference_probs).max()),
+        "mean_abs_prob_delta": float(np.abs(probs - reference_probs).mean()),
+    }
+    if labels is not None:
+        report["accuracy"] = float((predicted == labels).mean())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the imaging model to ONNX / TFLite")
+    parser.add_argument("--model", default="best_model.h5", help="Keras model (.h5 / .keras)")
+    parser.add_argument("--output-dir", default="exported_models")
+    parser.add_argument("--formats", nargs="+", choices=["onnx", "tflite"], default=["onnx", "tflite"])
+    parser.add_argument("--quantize", choices=["none", "dynamic", "float16", "int8"], default="none")
+    parser.add_argument("--calibration-dir", help="BUSI-style folder (or compiled shards) used for int8 calibration")
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    parser.add_argument("--eval-dir", help="BUSI-style folder (or compiled shards) used for the accuracy-delta report")
+    parser.add_argument("--eval-samples", type=int, default=300)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    keras_model = tf.keras.models.load_model(args.model, compile=False)
+    input_size = tuple(keras_model.input_shape[1:3])
+    print(f"✓ Loaded {args.model} (input {input_size[0]}x{input_size[1]})")
+
+    calibration_images = None
+    if args.calibration_dir:
+        calibration_images, _ = load_labeled_set(args.calibration_dir, input_size, limit=args.calibration_samples)
+        print(f"✓ Calibration set: {len(calibration_images)} images")
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(args.model).stem
+    quantize = None if args.quantize == "none" else args.quantize
+    suffix = f"_{quantize}" if quantize else ""
+
+    artifacts = []
+    if "onnx" in args.formats:
+        onnx_path = str(output_dir / f"{stem}.onnx")
+        export_onnx(keras_model, onnx_path, input_size)
+        artifacts.append(onnx_path)
+        print(f"✓ ONNX export: {onnx_path}")
+        if quantize == "int8":
+            if calibration_images is None:
+                raise ValueError("int8 quantization needs --calibration-dir")
+            int8_path = str(output_dir / f"{stem}_int8.onnx")
+            quantize_onnx_int8(onnx_path, int8_path, calibration_images)
+            artifacts.append(int8_path)
+            print(f"✓ ONNX int8 export: {int8_path}")
+    if "tflite" in args.formats:
+        tflite_path = str(output_dir / f"{stem}{suffix}.tflite")
+        export_tflite(keras_model, tflite_path, quantize=quantize, calibration_images=calibration_images)
+        artifacts.append(tflite_path)
+        print(f"✓ TFLite export: {tflite_path}")
+
+    eval_dir = args.eval_dir or args.calibration_dir
+    if not eval_dir:
+        print("⚠ No --eval-dir given; skipping accuracy-delta report")
+        return
+
+    images, labels = load_labeled_set(eval_dir, input_size, limit=args.eval_samples, seed=7)
+
+    reference = load_backend(args.model, backend="keras")
+    reference_probs = predict_in_batches(reference, images)
+    reports = [evaluate_artifact(reference, images, labels, reference_probs)]
+    for path in artifacts:
+        reports.append(evaluate_artifact(load_backend(path), images, labels, reference_probs))
+
+    report_path = output_dir / f"{stem}_export_report.json"
+    with open(report_path, "w") as f:
+        json.dump({"model": args.model, "eval_images": len(images), "artifacts": reports}, f, indent=2)
+
+    print("\n" + "=" * 96)
+    print(f"{'artifact':<40}{'size MB':>9}{'ms/img':>9}{'acc':>8}{'agree':>8}{'max Δp':>9}")
+    print("=" * 96)
+    for r in reports:
+        print(f"{Path(r['path']).name:<40}{r['size_mb']:>9.2f}{r['latency_ms']:>9.2f}"
+              f"{r.get('accuracy', float('nan')):>8.3f}{r['top1_agreement']:>8.3f}{r['max_abs_prob_delta']:>9.4f}")
+    print(f"\n✓ Report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# feature_cache.py - On-disk cache of frozen-backbone features for head-only training
+#
+# With a frozen backbone only the dense head learns, so the backbone needs to
+# see each image once: its pooled features (plus a fixed number of augmented
+# variants) are written here and every training epoch reads them back.
+#
+# Layout (one directory per backbone version and variant count; features of
+# different backbones or preprocessing are not interchangeable):
+#   feature_cache/<backbone version>-x<variants>/
+#     cache.json       <- {"version": ..., "dim": ..., "variants": ...}
+#     features.f32     <- float32 rows, ``variants`` consecutive rows per image, memory-mapped
+#     index.jsonl      <- {"hash": ..., "row": ...} per image (row of its variant 0)
+#
+# Usage:
+#   python feature_cache.py stats feature_cache/mobilenetv2-224-3f2a...-x5
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Content hash of an image file (renamed or moved images stay cached)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weights_hash(weights):
+    """Short hash of a list of weight arrays (identifies a backbone checkpoint)"""
+    digest = hashlib.blake2b(digest_size=8)
+    for array in weights:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    Append-only float32 matrix of pooled backbone features, ``variants`` rows
+    per image (variant 0 is the un-augmented image), keyed by image content hash.
+    Images already cached are never recomputed, so adding images to a dataset
+    only runs the backbone over the new ones.
+    """
+
+    HEADER_FILE = "cache.json"
+    FEATURES_FILE = "features.f32"
+    INDEX_FILE = "index.jsonl"
+
+    def __init__(self, root, version, variants=1):
+        """
+        :param root: directory holding the caches of all backbone versions
+        :param version: backbone identity (architecture, input size, weights, preprocessing)
+        :param variants: rows cached per image (1 un-augmented + variants-1 augmented)
+        """
+        self.version = version
+        self.variants = variants
+        safe_version = re.sub(r"[^A-Za-z0-9_.-]+", "_", version).strip("._")[-96:]
+        self.folder = Path(root) / f"{safe_version}-x{variants}"
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.features_path = self.folder / self.FEATURES_FILE
+        self.index_path = self.folder / self.INDEX_FILE
+        self.dim = None
+        self._rows = {}
+        self._load()
+
+    @classmethod
+    def open(cls, folder):
+        """Open an existing cache directory (feature_cache/<version>-x<variants>)"""
+        with open(Path(folder) / cls.HEADER_FILE) as f:
+            header = json.load(f)
+        return cls(Path(folder).parent, header["version"], header["variants"])
+
+    # ---------- persistence ----------
+
+    def _load(self):
+        header_path = self.folder / self.HEADER_FILE
+        if header_path.exists():
+            with open(header_path) as f:
+                self.dim = json.load(f).get("dim")
+
+        stored_rows = 0
+        if self.dim and self.features_path.exists():
+            stored_rows = os.path.getsize(self.features_path) // (self.dim * 4)
+
+        # Features are written before the index; keep the index lines whose rows are complete
+        valid_bytes = 0
+        if self.index_path.exists():
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Torn final write after a crash
+                        break
+                    record = json.loads(line)
+                    if record["row"] + self.variants > stored_rows:
+                        break
+                    self._rows[record["hash"]] = record["row"]
+                    valid_bytes += len(line)
+
+        expected = len(self._rows) * self.variants * (self.dim or 0) * 4
+        if self.features_path.exists() and os.path.getsize(self.features_path) != expected:
+            os.truncate(self.features_path, expected)
+        if self.index_path.exists() and os.path.getsize(self.index_path) != valid_bytes:
+            os.truncate(self.index_path, valid_bytes)
+
+    def _write_header(self):
+        with open(self.folder / self.HEADER_FILE, "w") as f:
+            json.dump({"version": self.version, "dim": self.dim, "variants": self.variants}, f)
+
+    def append(self, hashes, features):
+        """
+        Add the features of new images; returns the number of images added.
+
+        :param hashes: content hashes of the images
+        :param features: (len(hashes), variants, dim) array
+        """
+        features = np.asarray(features, dtype=np.float32)
+        if features.shape[:2] != (len(hashes), self.variants):
+            raise ValueError(f"Expected features of shape ({len(hashes)}, {self.variants}, dim), got {features.shape}")
+        if self.dim is None:
+            self.dim = int(features.shape[2])
+            self._write_header()
+        elif features.shape[2] != self.dim:
+            raise ValueError(f"Feature dimension {features.shape[2]} does not match cache dimension {self.dim}")
+
+        # Duplicate images (same content under several names) are stored once
+        keep, seen = [], set()
+        for i, content_hash in enumerate(hashes):
+            if content_hash not in self._rows and content_hash not in seen:
+                seen.add(content_hash)
+                keep.append(i)
+        if not keep:
+            return 0
+
+        next_row = len(self._rows) * self.variants
+        with open(self.features_path, "ab") as f:
+            f.write(features[keep].tobytes())
+        with open(self.index_path, "a") as f:
+            for n, i in enumerate(keep):
+                row = next_row + n * self.variants
+                self._rows[hashes[i]] = row
+                f.write(json.dumps({"hash": hashes[i], "row": row}) + "\n")
+        return len(keep)
+
+    # ---------- queries ----------
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, content_hash):
+        return content_hash in self._rows
+
+    def missing(self, hashes):
+        """Positions of the hashes that still need the backbone"""
+        return [i for i, h in enumerate(hashes) if h not in self._rows]
+
+    def matrix(self):
+        """All cached features as a read-only (rows, dim) memmap"""
+        rows = len(self._rows) * self.variants
+        if not rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self.features_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    def rows(self, hashes, variants=None):
+        """
+        Row numbers of the given images: shape (len(hashes),) for one variant,
+        or (len(hashes), len(variants)) for a list of variants
+        """
+        base = np.array([self._rows[h] for h in hashes], dtype=np.int64)
+        if variants is None or np.isscalar(variants):
+            return base + (variants or 0)
+        return base[:, np.newaxis] + np.asarray(variants, dtype=np.int64)[np.newaxis, :]
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "images": len(self._rows),
+            "variants": self.variants,
+            "dim": self.dim,
+            "bytes": os.path.getsize(self.features_path) if self.features_path.exists() else 0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a frozen-backbone feature cache")
+    parser.add_argument("command", choices=["stats"])
+    parser.add_argument("folder", help="Cache directory (feature_cache/<version>-x<variants>)")
+    args = parser.parse_args()
+
+    print(json.dumps(FeatureCache.open(args.folder).stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# inference_executor.py - Keeps image decoding and model calls off the event loop
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class InferenceExecutor:
+    """
+    Dedicated worker pools for the imaging agent.
+
+    Model calls run on a small thread pool (TensorFlow releases the GIL while
+    executing kernels). Image decoding runs on either a thread pool or, when
+    ``decode_processes`` is set, a process pool so PIL work does not compete
+    with request handling for the GIL.
+    """
+
+    def __init__(self, inference_workers=1, decode_workers=4, decode_processes=0):
+        """
+        :param inference_workers: threads allowed to call the model concurrently
+        :param decode_workers: threads used for decoding when no process pool is used
+        :param decode_processes: size of the decode process pool (0 = use threads)
+        """
+        self.inference_workers = inference_workers
+        self.inference_pool = ThreadPoolExecutor(
+            max_workers=inference_workers, thread_name_prefix="imaging-infer"
+        )
+        if decode_processes > 0:
+            # spawn, not fork: the parent has already initialised TensorFlow threads
+            self.decode_workers = decode_processes
+            self.decode_pool = ProcessPoolExecutor(
+                max_workers=decode_processes, mp_context=multiprocessing.get_context("spawn")
+            )
+            self.decode_mode = "process"
+        else:
+            self.decode_workers = decode_workers
+            self.decode_pool = ThreadPoolExecutor(
+                max_workers=decode_workers, thread_name_prefix="imaging-decode"
+            )
+            self.decode_mode = "thread"
+        # Only touched from the event loop thread, so no lock is needed
+        self._pending = {"decode": 0, "inference": 0}
+
+    async def run_decode(self, fn, *args):
+        """Run a decode/preprocess function on the decode pool"""
+        return await self._run("decode", self.decode_pool, fn, *args)
+
+    async def run_inference(self, fn, *args):
+        """Run a model call on the inference pool"""
+        return await self._run("inference", self.inference_pool, fn, *args)
+
+    async def _run(self, kind, pool, fn, *args):
+        loop = asyncio.get_running_loop()
+        self._pending[kind] += 1
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        finally:
+            self._pending[kind] -= 1
+
+    @property
+    def queue_depth(self):
+        """Jobs submitted to either pool that are waiting for a free worker"""
+        return (max(0, self._pending["decode"] - self.decode_workers)
+                + max(0, self._pending["inference"] - self.inference_workers))
+
+    def stats(self):
+        """Pool sizes and saturation gauges"""
+        return {
+            "decode_mode": self.decode_mode,
+            "decode_workers": self.decode_workers,
+            "inference_workers": self.inference_workers,
+            "decode_pending": self._pending["decode"],
+            "inference_pending": self._pending["inference"],
+            "queue_depth": self.queue_depth,
+        }
+
+    def shutdown(self, wait=True):
+        """Release worker threads/processes"""
+        self.inference_pool.shutdown(wait=wait)
+        self.decode_pool.shutdown(wait=wait)
@@ -0,0 +1,241 @@
+# model_registry.py - Versioned model artifacts and hot-swappable model handles
+#
+# Registry layout:
+#   models/
+#     ACTIVE                 <- name of the version served at startup
+#     v3/
+#       best_model.h5        <- artifact (.h5/.keras/.onnx/.tflite)
+#       metadata.json        <- input_size, class_names, preprocessing, ...
+#
+# Usage:
+#   python model_registry.py register best_imaging_model.keras --version v3 --input-size 224 --activate
+#   python model_registry.py list
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from batching import MicroBatcher
+from preprocess import allocate_batch, normalize_batch
+
+DEFAULT_CLASS_NAMES = ['benign', 'malignant', 'normal']
+DEFAULT_INPUT_SIZE = (256, 256)
+
+
+class ModelHandle:
+    """
+    One loaded model version: the backend, its metadata and its own
+    micro-batcher. Requests hold a reference for their whole lifetime, so a
+    swapped-out handle keeps serving them until it has drained.
+    """
+
+    def __init__(self, backend, version, metadata=None):
+        metadata = metadata or {}
+        self.backend = backend
+        self.version = version
+        self.metadata = metadata
+        self.input_size = tuple(metadata.get("input_size") or backend.input_size or DEFAULT_INPUT_SIZE)
+        self.class_names = list(metadata.get("class_names") or DEFAULT_CLASS_NAMES)
+        self.rescale = float(metadata.get("preprocessing", {}).get("rescale", 1.0 / 255.0))
+        self.batcher = None
+        self._num_classes = None
+        self._in_flight = 0
+        self._idle = threading.Condition()
+
+    @property
+    def img_height(self):
+        return self.input_size[0]
+
+    @property
+    def img_width(self):
+        return self.input_size[1]
+
+    @property
+    def num_classes(self):
+        """Width of the probability output (measured once with a blank image)"""
+        if self._num_classes is None:
+            blank = allocate_batch(1, self.img_width, self.img_height)
+            self._num_classes = int(self.predict_batch(blank).shape[1])
+        return self._num_classes
+
+    def predict_batch(self, img_batch):
+        """Normalize a uint8 batch once and run the forward pass"""
+        return self.backend.predict(normalize_batch(img_batch, self.rescale))
+
+    def embed_batch(self, img_batch):
+        """Pooled backbone features for a uint8 batch"""
+        return self.backend.embed(normalize_batch(img_batch, self.rescale))
+
+    def start_batching(self, max_batch_size, max_wait_ms):
+        # One batching thread per replica, all fed from the same queue
+        self.batcher = MicroBatcher(self.predict_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                    workers=getattr(self.backend, "concurrency", 1))
+        self.batcher.start()
+
+    def stop_batching(self):
+        if self.batcher is not None:
+            self.batcher.stop()
+            self.batcher = None
+
+    def acquire(self):
+        with self._idle:
+            self._in_flight += 1
+        return self
+
+    def release(self):
+        with self._idle:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.notify_all()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def drain(self, timeout=60.0):
+        """Wait for in-flight requests to finish, then stop the batcher"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+        self.stop_batching()
+        close = getattr(self.backend, "close", None)
+        if close is not None:
+            close()
+
+    def describe(self):
+        info = self.backend.describe()
+        info.update({
+            "version": self.version,
+            "input_size": f"{self.img_height}x{self.img_width}",
+            "class_names": self.class_names,
+            "in_flight": self._in_flight,
+        })
+        return info
+
+
+class ModelRegistry:
+    """Directory of versioned model artifacts with metadata"""
+
+    METADATA_FILE = "metadata.json"
+    ACTIVE_FILE = "ACTIVE"
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def version_names(self):
+        """Names of the version directories that hold metadata"""
+        if not self.root.is_dir():
+            return []
+        return [d.name for d in self.root.iterdir() if d.is_dir() and (d / self.METADATA_FILE).exists()]
+
+    def versions(self):
+        """Metadata of every registered version, oldest first"""
+        found = [self.metadata(name) for name in self.version_names()]
+        return sorted(found, key=lambda m: m.get("created_at", 0))
+
+    def _version_dir(self, version):
+        """
+        Directory of a registered version. ``version`` may come from a request,
+        so it must be a single plain path component naming a registered version.
+        """
+        if (not isinstance(version, str) or version in ("", ".", "..") or "/" in version or "\\" in version
+                or Path(version).name != version or version not in self.version_names()):
+            raise KeyError(f"Unknown model version '{version}'")
+        return self.root / version
+
+    def metadata(self, version):
+        with open(self._version_dir(version) / self.METADATA_FILE) as f:
+            return json.load(f)
+
+    def artifact_path(self, version):
+        """Artifact of a version; refuses metadata pointing outside the registry"""
+        path = (self._version_dir(version) / self.metadata(version)["artifact"]).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Artifact of model version '{version}' is outside the registry")
+        return str(path)
+
+    def active_version(self):
+        path = self.root / self.ACTIVE_FILE
+        if not path.exists():
+            return None
+        version = path.read_text().strip()
+        return version or None
+
+    def set_active(self, version):
+        self.metadata(version)  # validate
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / (self.ACTIVE_FILE + ".tmp")
+        tmp_path.write_text(version)
+        os.replace(tmp_path, self.root / self.ACTIVE_FILE)
+
+    def register(self, artifact_path, version=None, input_size=None, class_names=None,
+                 rescale=1.0 / 255.0, backend="auto", **extra):
+        """Copy an artifact into the registry and write its metadata"""
+        version = version or time.strftime("v%Y%m%d-%H%M%S")
+        if version in (".", "..") or Path(version).name != version or "\\" in version:
+            raise ValueError(f"Model version '{version}' must be a plain directory name")
+        version_dir = self.root / version
+        if version_dir.exists():
+            raise ValueError(f"Model version '{version}' already exists")
+        version_dir.mkdir(parents=True)
+        artifact_name = Path(artifact_path).name
+        shutil.copy2(artifact_path, version_dir / artifact_name)
+        metadata = {
+            "version": version,
+            "artifact": artifact_name,
+            "backend": backend,
+            "input_size": list(input_size) if input_size else None,
+            "class_names": list(class_names or DEFAULT_CLASS_NAMES),
+            "preprocessing": {"rescale": rescale},
+            "created_at": time.time(),
+            **extra,
+        }
+        with open(version_dir / self.METADATA_FILE, "w") as f:
+            json.dump(metadata, f, indent=2)
+        return metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the imaging model registry")
+    parser.add_argument("--root", default=os.getenv("IMAGING_MODEL_REGISTRY", "models"))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    reg = sub.add_parser("register", help="Add a model artifact as a new version")
+    reg.add_argument("artifact")
+    reg.add_argument("--version")
+    reg.add_argument("--input-size", type=int, nargs="+", help="e.g. 224 or 224 224")
+    reg.add_argument("--classes", nargs="+", default=DEFAULT_CLASS_NAMES)
+    reg.add_argument("--model-type", default="MobileNetV2 Transfer Learning")
+    reg.add_argument("--activate", action="store_true")
+
+    act = sub.add_parser("activate", help="Make a version the one served at startup")
+    act.add_argument("version")
+
+    sub.add_parser("list", help="List registered versions")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root)
+    if args.command == "register":
+        size = args.input_size
+        input_size = (size[0], size[-1]) if size else None
+        metadata = registry.register(args.artifact, version=args.version, input_size=input_size,
+                                     class_names=args.classes, model_type=args.model_type)
+        print(f"✓ Registered {args.artifact} as {metadata['version']}")
+        if args.activate:
+            registry.set_active(metadata["version"])
+            print(f"✓ Active version: {metadata['version']}")
+    elif args.command == "activate":
+        registry.set_active(args.version)
+        print(f"✓ Active version: {args.version}")
+    else:
+        active = registry.active_version()
+        for m in registry.versions():
+            marker = "*" if m["version"] == active else " "
+            print(f"{marker} {m['version']:<24} {m['artifact']:<32} input={m.get('input_size')} type={m.get('model_type', '-')}")
+
+
+if __name__ == "__main__":
+    main()
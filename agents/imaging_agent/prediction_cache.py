@@ -0,0 +1,101 @@
+# prediction_cache.py - Content-addressed LRU cache for imaging results
+
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    LRU cache of analysis results keyed by a BLAKE2 hash of the raw image bytes.
+
+    Every entry records the model version it was computed with; a lookup with
+    a different version is a miss, so swapping the model never serves stale
+    results even before ``clear()`` is called.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600.0):
+        """
+        :param max_entries: maximum number of cached results (0 disables the cache)
+        :param ttl_seconds: age after which an entry is treated as a miss (0 = no expiry)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def content_key(data):
+        """Hash raw image bytes into a cache key"""
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def _is_fresh(self, entry, model_versions):
+        stored_at, version, _ = entry
+        expired = self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds
+        return version in model_versions and not expired
+
+    def get(self, key, model_version):
+        """Return a copy of the cached result, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_fresh(entry, (model_version,)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(entry[2])
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, model_version, value):
+        """Store a result, evicting the least recently used entries when full"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), model_version, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def contains(self, key, model_versions):
+        """
+        Whether ``get`` would hit for one of ``model_versions``
+        (no hit/miss counting, LRU order unchanged)
+        """
+        if isinstance(model_versions, str):
+            model_versions = (model_versions,)
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and self._is_fresh(entry, tuple(model_versions))
+
+    def clear(self):
+        """Drop every entry (called when the model changes)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for /model-info"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
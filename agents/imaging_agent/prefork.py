@@ -0,0 +1,159 @@
+# prefork.py - Pre-fork server for the imaging agent
+#
+# The parent process publishes the model weights to shared memory once, binds
+# the listening socket and forks N uvicorn workers that accept on it. For ONNX
+# and TFLite artifacts, workers map the same weight pages (see
+# shared_weights.py), so memory grows by the per-worker runtime state and
+# activations only. Keras models (including the default best_model.h5) cannot
+# be shared: every worker loads its own full copy, so N workers need N times
+# the model's memory. Export with export_model.py to share the weights.
+#
+# Workers share the upload index through its journal (see upload_index.py);
+# worker 0 compacts the journal and enforces the upload quotas.
+# The parent never imports an ML runtime; it only supervises: dead workers are
+# restarted and SIGTERM / SIGINT are forwarded for a graceful shutdown.
+#
+# Usage:
+#   python prefork.py --workers 4 --port 5010
+#   IMAGING_BACKEND_THREADS=2 python prefork.py --workers 8
+
+import argparse
+import os
+import signal
+import socket
+import time
+
+# Workers load weights from the shared copy unless explicitly disabled
+os.environ.setdefault("IMAGING_SHARED_WEIGHTS", "1")
+
+import uvicorn
+
+import app as imaging_app
+from shared_weights import publish, prefault
+from upload_index import UploadIndex
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def publish_weights(workers):
+    """Publish the served artifact before forking so workers only map it"""
+    if not imaging_app.SHARED_WEIGHTS:
+        print(f"⚠ Shared weights disabled: each of the {workers} workers loads its own model copy")
+        return None
+    model_path, backend = imaging_app.resolve_model_artifact()
+    if model_path is None:
+        print("⚠ Model file not found; workers will start without a model")
+        return None
+    try:
+        shared_dir = publish(model_path, backend)
+    except Exception as e:
+        print(f"⚠ Could not publish shared weights ({e}); each of the {workers} workers loads its own copy")
+        return None
+    if shared_dir is None:
+        size = os.path.getsize(model_path) / 1024 ** 2
+        print(f"⚠ {model_path} is a Keras model and cannot share weights: each of the {workers} workers loads "
+              f"its own full copy (~{size:.0f} MB of weights each). Export it to ONNX/TFLite "
+              f"(export_model.py) to share one copy.")
+        return None
+    size = prefault(shared_dir)
+    print(f"✓ Shared weights ready in {shared_dir} ({size / 1024 ** 2:.1f} MB)")
+    return shared_dir
+
+
+def run_worker(worker_id, sock, log_level):
+    """Child process: serve the FastAPI app on the inherited socket"""
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    os.environ["IMAGING_WORKER_ID"] = str(worker_id)
+    config = uvicorn.Config(imaging_app.app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks the workers and keeps ``workers`` of them alive"""
+
+    def __init__(self, sock, workers, log_level="info", restart_delay=1.0):
+        """
+        :param sock: bound listening socket inherited by every worker
+        :param workers: number of worker processes
+        :param log_level: uvicorn log level in the workers
+        :param restart_delay: seconds to wait before replacing a worker that exited on its own
+        """
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.restart_delay = restart_delay
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self, worker_id):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(worker_id, self.sock, self.log_level)
+            except BaseException as e:
+                print(f"⚠ Worker {worker_id} crashed: {e}")
+                code = 1
+            finally:
+                # Never return into the parent's code path
+                os._exit(code)
+        self.children[pid] = worker_id
+        print(f"✓ Worker {worker_id} started (pid {pid})")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            worker_id = self.children.pop(pid, None)
+            if worker_id is None or self.stopping:
+                continue
+            print(f"⚠ Worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+            time.sleep(self.restart_delay)
+            if not self.stopping:
+                self.spawn(worker_id)
+        print("✓ All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the imaging agent from pre-forked worker processes")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("IMAGING_WORKERS", "2")),
+                        help="Worker processes (each runs its own event loop and model runtime)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5010)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    print(f"🚀 Starting Imaging Agent API on port {args.port} with {args.workers} pre-forked worker(s)...")
+    publish_weights(args.workers)
+    # Rebuild / compact the upload journal before the workers replay it
+    UploadIndex(imaging_app.UPLOAD_FOLDER, imaging_app.ALLOWED_EXTENSIONS)
+    sock = bind_socket(args.host, args.port)
+    Supervisor(sock, args.workers, log_level=args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
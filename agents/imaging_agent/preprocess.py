@@ -0,0 +1,161 @@
+# preprocess.py - Image decoding helpers for the imaging agent
+#
+# Kept free of TensorFlow imports so these functions can run inside
+# decode worker processes without loading the model runtime.
+
+import io
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+
+import numpy as np
+from PIL import Image
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+
+def is_archive(filename):
+    """True if the upload name looks like a zip/tar archive"""
+    return (filename or '').lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class ArchiveLimitError(ValueError):
+    """An archive exceeds the per-member, member-count or total-size limit"""
+
+
+def _read_bounded(stream, limit, error, chunk_size=1 << 20):
+    """Read a member stream, raising ``error`` as soon as it exceeds ``limit`` bytes (whatever its header claims)"""
+    chunks, size = [], 0
+    while True:
+        chunk = stream.read(min(chunk_size, limit + 1 - size))
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > limit:
+            raise ArchiveLimitError(error)
+        chunks.append(chunk)
+
+
+def iter_archive_images(fileobj, filename, allowed_extensions, max_member_bytes=64 * 1024 ** 2,
+                        max_members=10000, max_total_bytes=1024 ** 3):
+    """
+    Yield (member_name, raw_bytes) for every image inside a zip or tar archive.
+    Tar archives are read as a stream, so members are produced one at a time.
+
+    Raises ArchiveLimitError (after yielding the members before it) when a
+    member is larger than ``max_member_bytes``, the archive holds more than
+    ``max_members`` entries, or the images add up to more than ``max_total_bytes``
+    uncompressed, so a decompression bomb cannot exhaust the worker's memory.
+    """
+    fileobj.seek(0)
+    members = total = 0
+
+    def count():
+        nonlocal members
+        members += 1
+        if members > max_members:
+            raise ArchiveLimitError(f"Archive has more than {max_members} entries")
+
+    def member_error(name):
+        return f"{name} is larger than {max_member_bytes // 1024 ** 2} MB uncompressed"
+
+    total_error = f"Archive is larger than {max_total_bytes // 1024 ** 2} MB uncompressed"
+
+    def check(name, declared_size):
+        if declared_size > max_member_bytes:
+            raise ArchiveLimitError(member_error(name))
+        if total + declared_size > max_total_bytes:
+            raise ArchiveLimitError(total_error)
+
+    def read(name, stream):
+        nonlocal total
+        remaining = max_total_bytes - total
+        if remaining < max_member_bytes:
+            data = _read_bounded(stream, remaining, total_error)
+        else:
+            data = _read_bounded(stream, max_member_bytes, member_error(name))
+        total += len(data)
+        return data
+
+    if filename.lower().endswith('.zip'):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                count()
+                if info.is_dir() or PurePosixPath(info.filename).suffix.lower() not in allowed_extensions:
+                    continue
+                check(info.filename, info.file_size)
+                with archive.open(info) as stream:
+                    yield info.filename, read(info.filename, stream)
+    else:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for member in archive:
+                count()
+                # Regular files only: no links, devices, FIFOs or directories
+                if not member.isreg() or PurePosixPath(member.name).suffix.lower() not in allowed_extensions:
+                    continue
+                check(member.name, member.size)
+                yield member.name, read(member.name, archive.extractfile(member))
+
+
+def open_image(source):
+    """
+    Open an image from a file path, raw bytes or a readable file-like object.
+    Bytes and buffers are decoded in memory without touching the disk.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    if hasattr(source, "read"):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return Image.open(source)
+    return Image.open(source)
+
+
+def read_image_bytes(source):
+    """Return the raw encoded bytes of an image given as a path, bytes or file-like object"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, "read"):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return source.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def decode_image(source, width, height):
+    """
+    Decode an image into a (height, width, 3) uint8 array.
+
+    JPEGs are decoded with draft mode, letting libjpeg scale down by 1/2, 1/4
+    or 1/8 during decoding so large scans never materialize at full size.
+    """
+    with open_image(source) as img:
+        img.draft('RGB', (width, height))
+        img = img.convert('RGB')
+        if img.size != (width, height):
+            img = img.resize((width, height))
+        return np.asarray(img, dtype=np.uint8)
+
+
+def decode_into(batch, index, source, width, height):
+    """Decode an image straight into row `index` of a preallocated uint8 batch"""
+    batch[index] = decode_image(source, width, height)
+    return index
+
+
+def allocate_batch(size, width, height):
+    """Allocate an uninitialized (size, height, width, 3) uint8 batch buffer"""
+    return np.empty((size, height, width, 3), dtype=np.uint8)
+
+
+def normalize_batch(batch, scale=1.0 / 255.0):
+    """Convert a uint8 batch to float32 (scaled to [0, 1] by default) with a single vectorized pass"""
+    if batch.dtype != np.uint8:
+        return batch
+    return np.multiply(batch, np.float32(scale), dtype=np.float32)
+
+
+def load_image_array(source, width, height):
+    """Decode an image (path, bytes or file-like) into a normalized (1, height, width, 3) float32 array"""
+    return normalize_batch(decode_image(source, width, height)[np.newaxis])
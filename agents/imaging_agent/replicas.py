@@ -0,0 +1,185 @@
+# replicas.py - CPU-topology-aware model replicas for the imaging agent
+
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import load_backend, detect_backend
+
+
+def cpu_cores():
+    """
+    Logical CPUs this process may run on, grouped by physical core (SMT
+    siblings together) and ordered by (socket, core)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        allowed = sorted(os.sched_getaffinity(0))
+    else:
+        allowed = list(range(os.cpu_count() or 1))
+    cores = {}
+    for cpu in allowed:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{topology}/physical_package_id") as f:
+                package = int(f.read())
+            with open(f"{topology}/core_id") as f:
+                core = int(f.read())
+        except (OSError, ValueError):
+            package, core = 0, cpu
+        cores.setdefault((package, core), []).append(cpu)
+    return [cores[key] for key in sorted(cores)]
+
+
+def partition_cpus(replicas):
+    """
+    Split the usable physical cores into ``replicas`` contiguous groups of
+    logical CPUs, so a replica never shares a core (or, where possible, a
+    socket) with another. With more replicas than cores, cores are shared.
+    """
+    cores = cpu_cores()
+    if replicas >= len(cores):
+        return [sorted(cores[i % len(cores)]) for i in range(replicas)]
+    groups = []
+    for i in range(replicas):
+        start = i * len(cores) // replicas
+        stop = (i + 1) * len(cores) // replicas
+        groups.append(sorted(cpu for core in cores[start:stop] for cpu in core))
+    return groups
+
+
+class ReplicaSet:
+    """
+    N copies of a model behind the InferenceBackend interface.
+
+    Every call checks out an idle replica, so up to N forward passes run at
+    once, each on its own runtime thread pool. With ``cpu_sets`` every replica
+    runs on a dedicated thread pinned to its cores, so the runtime's calling
+    thread stays on them too (its worker threads inherit the mask when the
+    replica is loaded) and the shared caller threads are never re-pinned.
+    """
+
+    def __init__(self, backends, cpu_sets=None, threads_per_replica=None):
+        self.replicas = backends
+        self.cpu_sets = cpu_sets
+        self.threads_per_replica = threads_per_replica
+        self._idle = queue.SimpleQueue()
+        for i in range(len(backends)):
+            self._idle.put(i)
+        self._threads = None
+        if cpu_sets:
+            self._threads = [
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"imaging-replica-{i}",
+                                   initializer=os.sched_setaffinity, initargs=(0, cpus))
+                for i, cpus in enumerate(cpu_sets)
+            ]
+
+    @property
+    def name(self):
+        return self.replicas[0].name
+
+    @property
+    def model_path(self):
+        return self.replicas[0].model_path
+
+    @property
+    def input_size(self):
+        return self.replicas[0].input_size
+
+    @property
+    def concurrency(self):
+        return len(self.replicas)
+
+    @property
+    def supports_embeddings(self):
+        return self.replicas[0].supports_embeddings
+
+    def _call(self, method, img_batch):
+        index = self._idle.get()
+        try:
+            fn = getattr(self.replicas[index], method)
+            if self._threads is not None:
+                return self._threads[index].submit(fn, img_batch).result()
+            return fn(img_batch)
+        finally:
+            self._idle.put(index)
+
+    def predict(self, img_batch):
+        return self._call("predict", img_batch)
+
+    def embed(self, img_batch):
+        return self._call("embed", img_batch)
+
+    def close(self):
+        """Stop the pinned replica threads (once no request uses this set any more)"""
+        if self._threads is not None:
+            for thread in self._threads:
+                thread.shutdown(wait=False)
+
+    def describe(self):
+        info = self.replicas[0].describe()
+        info.update({
+            "replicas": len(self.replicas),
+            # Keras replicas are concurrent calls into one shared model
+            "model_copies": len({id(r) for r in self.replicas}),
+            "threads_per_replica": self.threads_per_replica,
+            "cpu_sets": self.cpu_sets,
+        })
+        return info
+
+
+def replicas_tunable(kind):
+    """
+    Whether a backend's replica / thread layout can change between loads in one
+    process. ONNX Runtime and TFLite size their pools per session; TensorFlow
+    fixes its process-wide pools at first use, so every Keras load after the
+    first would silently run with the first layout.
+    """
+    return kind != "keras"
+
+
+def load_replicas(model_path, backend=None, replicas=1, threads_per_replica=None, pin_cpus=False,
+                  shared_weights=False):
+    """
+    Load a model as ``replicas`` copies spread over the CPU topology.
+
+    ONNX Runtime and TFLite replicas each get their own session/interpreter
+    with ``threads_per_replica`` intra-op threads (default: the physical cores
+    of its CPU group), created from a thread pinned to that group when
+    ``pin_cpus`` is set. TensorFlow has a single process-wide intra-op pool,
+    so Keras replicas share one model and a pool sized for all replicas; they
+    still gain concurrent forward passes (inter-op threads = replicas). That
+    pool is sized at the first load only, so Keras layouts cannot be tuned
+    in-process (see replicas_tunable), and pinning does not apply to them.
+    With ``shared_weights`` all replicas (and worker processes) map one copy
+    of the weights.
+    """
+    kind = backend if backend and backend != "auto" else detect_backend(model_path)
+    replicas = max(1, replicas)
+    if replicas == 1 and not pin_cpus:
+        return load_backend(model_path, backend=kind, num_threads=threads_per_replica,
+                            shared_weights=shared_weights)
+
+    cpu_sets = partition_cpus(replicas)
+    if threads_per_replica is None:
+        threads_per_replica = max(1, len(cpu_cores()) // replicas)
+
+    if kind == "keras":
+        if pin_cpus:
+            # TensorFlow's pools serve every replica, whichever thread makes the call
+            print("⚠ Keras replicas share TensorFlow's thread pools; CPU pinning is not applied")
+        shared = load_backend(model_path, backend=kind, num_threads=threads_per_replica * replicas,
+                              inter_op_threads=replicas, shared_weights=shared_weights)
+        return ReplicaSet([shared] * replicas, None, threads_per_replica)
+
+    def load(cpus):
+        if pin_cpus:
+            os.sched_setaffinity(0, cpus)
+        return load_backend(model_path, backend=kind, num_threads=threads_per_replica,
+                            shared_weights=shared_weights)
+
+    backends = []
+    for cpus in cpu_sets:
+        # A fresh thread per replica so the runtime's worker threads inherit only its CPU mask
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="imaging-replica-load") as pool:
+            backends.append(pool.submit(load, cpus).result())
+    return ReplicaSet(backends, cpu_sets if pin_cpus else None, threads_per_replica)
@@ -0,0 +1,198 @@
+# retention.py - Background disk-quota enforcement for the uploads folder
+
+import os
+import threading
+import time
+
+
+class RetentionManager:
+    """
+    Keeps the uploads folder within max-bytes / max-age / max-count limits.
+
+    Runs on a background thread, waking every ``interval_seconds`` or as soon
+    as ``notify()`` is called after a new upload. Quota eviction is LRU by
+    last access and first skips uploads that are still protected (the newest
+    upload and images whose prediction is still cached); protected uploads are
+    only removed when the byte limit cannot be met otherwise, since a full
+    disk takes the whole service down.
+
+    With pre-forked workers the upload index is shared, so a single process
+    enforces the limits; the others (``enforce_limits=False``) only serve
+    clear requests.
+    """
+
+    def __init__(self, folder, upload_index, max_bytes=0, max_age_seconds=0, max_count=0,
+                 interval_seconds=60.0, is_protected=None, enforce_limits=True):
+        """
+        :param folder: uploads directory
+        :param upload_index: UploadIndex describing the uploads
+        :param max_bytes: total size limit (0 = unlimited)
+        :param max_age_seconds: uploads older than this are removed (0 = keep forever)
+        :param max_count: maximum number of uploads kept (0 = unlimited)
+        :param interval_seconds: how often the policies are checked
+        :param is_protected: optional callable(entry) -> bool for uploads that should be kept if possible
+        :param enforce_limits: False in worker processes that leave the limits to another process
+        """
+        self.folder = folder
+        self.upload_index = upload_index
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.max_count = max_count
+        self.interval_seconds = interval_seconds
+        self.is_protected = is_protected or (lambda entry: False)
+        self.enforce_limits = enforce_limits
+        self._wake = threading.Event()
+        self._clear_requested = False
+        self._running = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self.files_evicted = 0
+        self.bytes_evicted = 0
+        self.last_run = None
+        self.clearing = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="upload-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def notify(self):
+        """Ask for a policy check soon (e.g. after a new upload was written)"""
+        self._wake.set()
+
+    def request_clear(self):
+        """Schedule deletion of every upload without blocking the caller"""
+        with self._lock:
+            self._clear_requested = True
+            self.clearing = True
+        self._wake.set()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(timeout=self.interval_seconds)
+            self._wake.clear()
+            if not self._running:
+                break
+            try:
+                with self._lock:
+                    clear, self._clear_requested = self._clear_requested, False
+                if clear:
+                    self.clear_all()
+                elif self.enforce_limits:
+                    self.enforce()
+            except Exception as e:
+                print(f"⚠ Upload retention error: {e}")
+
+    # ---------- policies ----------
+
+    def _evict(self, entry):
+        path = os.path.join(self.folder, entry["filename"])
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.upload_index.remove(entry["filename"])
+        with self._lock:
+            self.files_evicted += 1
+            self.bytes_evicted += entry.get("size") or 0
+
+    def enforce(self):
+        """Apply age, count and byte limits once; returns the number of files removed"""
+        entries = [e for e in self.upload_index.snapshot() if e.get("persisted")]
+        latest = self.upload_index.latest()
+        latest_name = latest["filename"] if latest else None
+        removed = 0
+
+        if self.max_age_seconds:
+            cutoff = time.time() - self.max_age_seconds
+            keep = []
+            for entry in entries:
+                if entry["uploaded_at"] < cutoff and entry["filename"] != latest_name:
+                    self._evict(entry)
+                    removed += 1
+                else:
+                    keep.append(entry)
+            entries = keep
+
+        total_bytes = sum(e.get("size") or 0 for e in entries)
+
+        def over_quota(count, size, hard_only=False):
+            over_bytes = self.max_bytes and size > self.max_bytes
+            over_count = self.max_count and count > self.max_count
+            return over_bytes if hard_only else (over_bytes or over_count)
+
+        # Least recently used first; the newest upload is never evicted
+        candidates = sorted((e for e in entries if e["filename"] != latest_name),
+                            key=lambda e: e["last_accessed"])
+        protected = []
+        count = len(entries)
+        for entry in candidates:
+            if not over_quota(count, total_bytes):
+                break
+            if self.is_protected(entry):
+                protected.append(entry)
+                continue
+            self._evict(entry)
+            removed += 1
+            count -= 1
+            total_bytes -= entry.get("size") or 0
+
+        # Byte limit is a hard limit: fall back to protected uploads if needed
+        for entry in protected:
+            if not over_quota(count, total_bytes, hard_only=True):
+                break
+            self._evict(entry)
+            removed += 1
+            count -= 1
+            total_bytes -= entry.get("size") or 0
+
+        self.last_run = time.time()
+        return removed
+
+    def clear_all(self):
+        """Delete every upload (used by the non-blocking clear endpoint)"""
+        removed = 0
+        try:
+            for name in os.listdir(self.folder):
+                if name.startswith("."):
+                    continue
+                path = os.path.join(self.folder, name)
+                if os.path.isfile(path):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        # Removed concurrently by another worker process
+                        continue
+                    removed += 1
+            self.upload_index.clear()
+            with self._lock:
+                self.files_evicted += removed
+        finally:
+            self.clearing = False
+        print(f"✓ Cleared {removed} uploaded file(s)")
+        return removed
+
+    def stats(self):
+        entries = self.upload_index.snapshot()
+        return {
+            "files": len(entries),
+            "bytes": sum(e.get("size") or 0 for e in entries),
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+            "max_count": self.max_count,
+            "files_evicted": self.files_evicted,
+            "bytes_evicted": self.bytes_evicted,
+            "clearing": self.clearing,
+            "enforcing_limits": self.enforce_limits,
+            "last_run": self.last_run,
+        }
@@ -0,0 +1,142 @@
+# shared_weights.py - Publish model weights to shared memory for pre-forked workers
+#
+# Worker processes map the same read-only pages instead of each holding a
+# private copy of the weights:
+#   ONNX   -> initializers are written once to an aligned raw file; workers hand
+#             zero-copy NumPy views of it to ONNX Runtime as external initializers
+#   TFLite -> the flatbuffer is copied to tmpfs; the interpreter mmaps it
+# Keras models cannot share weights (TensorFlow copies them into its own
+# tensors); export them with export_model.py to benefit.
+#
+# Layout:
+#   /dev/shm/imaging-weights/<artifact hash>-<format>/
+#     manifest.json
+#     model.onnx + weights.bin   (ONNX)
+#     model.tflite               (TFLite)
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from backends import detect_backend
+
+SHARED_ROOT = os.getenv("IMAGING_SHARED_WEIGHTS_DIR", "/dev/shm/imaging-weights")
+SHAREABLE_BACKENDS = ('onnx', 'tflite')
+MANIFEST_FILE = "manifest.json"
+# Offsets are page-aligned so every initializer starts on its own page boundary
+ALIGNMENT = 4096
+
+
+def artifact_key(model_path, chunk_size=1 << 20):
+    """Content hash of a model artifact (names the shared copy, so versions never collide)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _split_onnx(model_path, out_dir):
+    """Write the initializers to weights.bin and a model.onnx that references them as external data"""
+    try:
+        import onnx
+        from onnx import numpy_helper
+        from onnx.external_data_helper import set_external_data
+    except ImportError:
+        raise ImportError("onnx is required to share ONNX weights: pip install onnx")
+    model = onnx.load(model_path)
+    entries = []
+    offset = 0
+    with open(out_dir / "weights.bin", "wb") as f:
+        for tensor in model.graph.initializer:
+            array = numpy_helper.to_array(tensor)
+            if array.dtype.kind in "OUS":
+                # String tensors stay inline
+                continue
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            data = np.ascontiguousarray(array).tobytes()
+            f.write(data)
+            entries.append({"name": tensor.name, "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset})
+            # Keep the declaration, drop the payload
+            for field in ("raw_data", "float_data", "int32_data", "int64_data", "double_data", "uint64_data"):
+                tensor.ClearField(field)
+            set_external_data(tensor, location="weights.bin", offset=offset, length=len(data))
+            tensor.data_location = onnx.TensorProto.EXTERNAL
+            offset += len(data)
+    onnx.save(model, str(out_dir / "model.onnx"))
+    return {"format": "onnx", "model": "model.onnx", "weights": "weights.bin", "initializers": entries}
+
+
+def publish(model_path, backend=None, root=SHARED_ROOT):
+    """
+    Make a shared-memory copy of a model artifact (idempotent; safe to race
+    between processes). Returns the directory, or None for backends that
+    cannot share weights.
+    """
+    kind = backend if backend and backend != 'auto' else detect_backend(model_path)
+    if kind not in SHAREABLE_BACKENDS:
+        return None
+    target = Path(root) / f"{artifact_key(model_path)}-{kind}"
+    if (target / MANIFEST_FILE).exists():
+        return target
+
+    tmp_dir = Path(root) / f".{target.name}.{os.getpid()}.tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        if kind == 'tflite':
+            shutil.copyfile(model_path, tmp_dir / "model.tflite")
+            manifest = {"format": "tflite", "model": "model.tflite"}
+        else:
+            manifest = _split_onnx(model_path, tmp_dir)
+        manifest["source"] = os.path.abspath(model_path)
+        with open(tmp_dir / MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f)
+        try:
+            os.rename(tmp_dir, target)
+        except OSError:
+            # Another process published the same artifact first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    print(f"✓ Published shared weights for {model_path} to {target}")
+    return target
+
+
+def load_manifest(shared_dir):
+    with open(Path(shared_dir) / MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+def prefault(shared_dir, chunk_size=1 << 22):
+    """Read every shared file once so the pages are resident before workers fork"""
+    total = 0
+    for path in Path(shared_dir).iterdir():
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                total += len(chunk)
+    return total
+
+
+def onnx_external_initializers(shared_dir):
+    """
+    (names, OrtValues) viewing weights.bin without copying. The mapping is
+    private copy-on-write, so pages stay shared between processes unless written.
+    """
+    import onnxruntime as ort
+    manifest = load_manifest(shared_dir)
+    weights = np.memmap(Path(shared_dir) / manifest["weights"], dtype=np.uint8, mode="c")
+    names, values = [], []
+    for entry in manifest["initializers"]:
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        array = np.frombuffer(weights, dtype=dtype, count=count, offset=entry["offset"]).reshape(entry["shape"])
+        names.append(entry["name"])
+        values.append(ort.OrtValue.ortvalue_from_numpy(array))
+    return names, values
@@ -0,0 +1,328 @@
+# sweep.py - Parallel k-fold cross-validation and hyperparameter sweep for the dense head
+#
+# Runs on the frozen-backbone feature cache written by `train_agent.py --head-only`,
+# so a trial trains only the head and never touches the images. Every
+# (configuration, fold) pair is one job on a process pool. Each worker is
+# pinned to its own group of physical cores for its lifetime and memory-maps
+# the same read-only feature file, so the OS page cache holds one copy for all
+# of them.
+#
+# Usage:
+#   python sweep.py --features feature_cache/mobilenetv2-224-...-x5 --shards busi_shards/224x224 \
+#       --folds 5 --lr 1e-3 3e-4 1e-4 --dropout 0.3 0.5 --width 128 256 --workers 4
+#   python sweep.py --features ... --dataset <Dataset_BUSI_with_GT> --search random --trials 24 \
+#       --export best_model.keras
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+from dataset_shards import ShardedDataset, scan_dataset
+from feature_cache import FeatureCache, weights_hash
+from prediction_cache import PredictionCache
+from replicas import cpu_cores, partition_cpus
+
+NUM_CLASSES = 3
+
+
+# ==================== Data ====================
+
+def labeled_hashes(shards=None, dataset_dir=None):
+    """(content hashes, labels) of every image, from a compiled manifest or the class folders"""
+    if shards:
+        dataset = ShardedDataset(shards)
+        return [r["content_hash"] for r in dataset.records], dataset.labels
+    hashes, labels = [], []
+    for path, label, _ in scan_dataset(dataset_dir):
+        with open(path, "rb") as f:
+            hashes.append(PredictionCache.content_key(f.read()))
+        labels.append(label)
+    return hashes, np.array(labels, dtype=np.int64)
+
+
+def stratified_folds(labels, k, seed=0):
+    """Fold number per image, keeping the class balance of every fold"""
+    rng = np.random.default_rng(seed)
+    folds = np.empty(len(labels), dtype=np.int64)
+    for label in np.unique(labels):
+        members = rng.permutation(np.flatnonzero(labels == label))
+        folds[members] = np.arange(len(members)) % k
+    return folds
+
+
+def sweep_configs(lrs, dropouts, widths, search="grid", trials=None, seed=0):
+    """
+    Grid: every combination. Random: ``trials`` samples, learning rate
+    log-uniform and dropout uniform between the given extremes, width from the list.
+    """
+    if search == "grid":
+        return [{"lr": lr, "dropout": d, "width": w} for lr, d, w in itertools.product(lrs, dropouts, widths)]
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(trials or 16):
+        configs.append({
+            "lr": float(np.exp(rng.uniform(np.log(min(lrs)), np.log(max(lrs))))),
+            "dropout": round(float(rng.uniform(min(dropouts), max(dropouts))), 3),
+            "width": int(rng.choice(widths)),
+        })
+    return configs
+
+
+# ==================== Workers ====================
+
+_worker = {}
+
+
+def _process_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows; there is no pinning there anyway
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def claim_cpu_group(holders, lock, groups, pid, alive=_process_alive):
+    """
+    Index of a core group no live worker holds, recorded as held by ``pid``.
+    A worker that replaces a dead one takes over its group instead of waiting for a free one.
+    """
+    with lock:
+        for index in range(groups):
+            holder = holders.get(index)
+            if holder is None or holder == pid or not alive(holder):
+                holders[index] = pid
+                return index
+    # More workers than groups: share, spread by pid
+    return pid % groups
+
+
+def _init_worker(cpu_groups, holders, lock, features_dir):
+    """Pin this worker to a free core group for its lifetime and map the shared feature cache"""
+    cpus = cpu_groups[claim_cpu_group(holders, lock, len(cpu_groups), os.getpid())]
+    if hasattr(os, "sched_setaffinity"):
+        # Before TensorFlow starts, so its thread pools inherit the mask
+        os.sched_setaffinity(0, cpus)
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(len(cpus))
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        pass
+    cache = FeatureCache.open(features_dir)
+    _worker.update(cpus=cpus, features=cache.matrix())
+
+
+def build_head(dim, width, dropout, lr):
+    """Dense head over pooled backbone features (train_agent.py uses width 256)"""
+    import tensorflow as tf
+    inputs = tf.keras.Input(shape=(dim,))
+    x = tf.keras.layers.Dense(width, activation='relu')(inputs)
+    x = tf.keras.layers.Dropout(dropout)(x)
+    x = tf.keras.layers.Dense(max(1, width // 2), activation='relu')(x)
+    x = tf.keras.layers.Dropout(dropout)(x)
+    outputs = tf.keras.layers.Dense(NUM_CLASSES, activation='softmax')(x)
+    model = tf.keras.Model(inputs, outputs, name="head")
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=lr),
+                  loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def run_fold(job):
+    """
+    Train one configuration on one fold with early stopping on validation loss.
+    Each epoch draws one cached view per training image; validation uses the originals.
+    """
+    import tensorflow as tf
+    features = _worker["features"]
+    rng = np.random.default_rng(job["seed"])
+    tf.keras.utils.set_random_seed(job["seed"])
+    config = job["config"]
+    model = build_head(features.shape[1], config["width"], config["dropout"], config["lr"])
+
+    train_rows, val_rows = job["train_rows"], job["val_rows"]
+    train_targets = tf.keras.utils.to_categorical(job["train_labels"], NUM_CLASSES)
+    val_x = np.asarray(features[val_rows])
+    val_targets = tf.keras.utils.to_categorical(job["val_labels"], NUM_CLASSES)
+
+    start = time.perf_counter()
+    best = {"val_loss": float("inf")}
+    best_weights, waited = None, 0
+    for epoch in range(job["epochs"]):
+        views = train_rows[np.arange(len(train_rows)), rng.integers(0, train_rows.shape[1], len(train_rows))]
+        model.fit(features[views], train_targets, batch_size=job["batch_size"], epochs=1, shuffle=True, verbose=0)
+        val_loss, val_accuracy = model.evaluate(val_x, val_targets, batch_size=256, verbose=0)
+        if val_loss < best["val_loss"]:
+            best = {"val_loss": float(val_loss), "val_accuracy": float(val_accuracy), "epoch": epoch + 1}
+            best_weights, waited = model.get_weights(), 0
+        else:
+            waited += 1
+            if waited >= job["patience"]:
+                break
+
+    model.set_weights(best_weights)
+    model.save(job["checkpoint"])
+    return dict(best, trial=job["trial"], fold=job["fold"], seconds=round(time.perf_counter() - start, 2),
+                cpus=_worker["cpus"], checkpoint=job["checkpoint"])
+
+
+# ==================== Sweep ====================
+
+def run_sweep(features_dir, hashes, labels, configs, folds=5, workers=None, epochs=20, batch_size=32,
+              patience=5, output_dir="sweep_results", seed=0):
+    """
+    Cross-validate every configuration in parallel and return (results table, best row).
+
+    :param features_dir: feature cache directory holding every image in ``hashes``
+    :param configs: list of {"lr", "dropout", "width"}
+    :param workers: worker processes (default: one per physical core)
+    """
+    cache = FeatureCache.open(features_dir)
+    missing = cache.missing(hashes)
+    if missing:
+        raise ValueError(f"{len(missing)} image(s) are not in {features_dir}; "
+                         f"run train_agent.py --head-only over the dataset first")
+    rows = cache.rows(hashes, variants=range(cache.variants))
+    fold_of = stratified_folds(labels, folds, seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = []
+    for trial, config in enumerate(configs):
+        for fold in range(folds):
+            train, val = fold_of != fold, fold_of == fold
+            jobs.append({
+                "trial": trial, "fold": fold, "config": config, "seed": seed + trial * folds + fold,
+                "train_rows": rows[train], "train_labels": labels[train],
+                "val_rows": rows[val, 0], "val_labels": labels[val],
+                "epochs": epochs, "batch_size": batch_size, "patience": patience,
+                "checkpoint": str(output_dir / f"trial{trial:03d}_fold{fold}.keras"),
+            })
+
+    workers = workers or len(cpu_cores())
+    ctx = get_context("spawn")  # TensorFlow is not fork-safe
+    print(f"⏱ {len(configs)} configuration(s) x {folds} folds = {len(jobs)} jobs on {workers} pinned worker(s)")
+
+    fold_results = {trial: [] for trial in range(len(configs))}
+    # Each worker holds one core group for its lifetime, so concurrent jobs never share cores
+    with ctx.Manager() as manager, ProcessPoolExecutor(
+        max_workers=workers, mp_context=ctx, initializer=_init_worker,
+        initargs=(partition_cpus(workers), manager.dict(), manager.Lock(), str(features_dir))
+    ) as pool:
+        futures = [pool.submit(run_fold, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            fold_results[result["trial"]].append(result)
+            print(f"  [{done}/{len(jobs)}] trial {result['trial']} fold {result['fold']}: "
+                  f"val_acc {result['val_accuracy']:.4f} val_loss {result['val_loss']:.4f} ({result['seconds']:.1f}s)")
+
+    table = []
+    for trial, config in enumerate(configs):
+        results = sorted(fold_results[trial], key=lambda r: r["fold"])
+        accuracies = [r["val_accuracy"] for r in results]
+        best_fold = min(results, key=lambda r: r["val_loss"])
+        table.append(dict(
+            config,
+            trial=trial,
+            mean_val_accuracy=round(float(np.mean(accuracies)), 4),
+            std_val_accuracy=round(float(np.std(accuracies)), 4),
+            mean_val_loss=round(float(np.mean([r["val_loss"] for r in results])), 4),
+            fold_accuracies=[round(a, 4) for a in accuracies],
+            mean_epochs=round(float(np.mean([r["epoch"] for r in results])), 1),
+            best_checkpoint=best_fold["checkpoint"],
+        ))
+    table.sort(key=lambda r: (-r["mean_val_accuracy"], r["mean_val_loss"]))
+    return table, table[0]
+
+
+def write_results(table, output_dir):
+    output_dir = Path(output_dir)
+    with open(output_dir / "results.json", "w") as f:
+        json.dump(table, f, indent=2)
+    columns = ["trial", "lr", "dropout", "width", "mean_val_accuracy", "std_val_accuracy",
+               "mean_val_loss", "mean_epochs", "fold_accuracies", "best_checkpoint"]
+    with open(output_dir / "results.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in table:
+            writer.writerow({c: row[c] for c in columns})
+
+
+def export_full_model(head_path, features_dir, output_path):
+    """Put the best head on the MobileNetV2 backbone the features came from, as a servable .keras model"""
+    import tensorflow as tf
+    cache = FeatureCache.open(features_dir)
+    # Versions written by train_agent.py: mobilenetv2-<size>-<resize>-...-<weights hash>
+    img_size = int(cache.version.split("-")[1])
+    base_model = tf.keras.applications.MobileNetV2(weights='imagenet', include_top=False,
+                                                   input_shape=(img_size, img_size, 3))
+    if not cache.version.endswith(weights_hash(base_model.get_weights())):
+        raise ValueError(f"Backbone weights do not match the ones that produced {features_dir}")
+    head = tf.keras.models.load_model(head_path)
+    pooled = tf.keras.layers.GlobalAveragePooling2D()(base_model.output)
+    model = tf.keras.Model(base_model.input, head(pooled))
+    model.save(output_path)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="k-fold cross-validated hyperparameter sweep of the dense head")
+    parser.add_argument("--features", required=True, help="Feature cache directory (feature_cache/<version>-x<variants>)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--shards", help="Compiled dataset (labels and hashes from its manifest)")
+    source.add_argument("--dataset", help="BUSI-style folder (images are hashed to find their features)")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument("--trials", type=int, default=16, help="Random search: configurations sampled")
+    parser.add_argument("--lr", type=float, nargs="+", default=[1e-3, 3e-4, 1e-4])
+    parser.add_argument("--dropout", type=float, nargs="+", default=[0.3, 0.5])
+    parser.add_argument("--width", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--patience", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: physical cores)")
+    parser.add_argument("--output-dir", default="sweep_results")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--export", help="Also save the best head on its backbone as a servable .keras model")
+    args = parser.parse_args()
+
+    hashes, labels = labeled_hashes(args.shards, args.dataset)
+    configs = sweep_configs(args.lr, args.dropout, args.width, args.search, args.trials, args.seed)
+    start = time.perf_counter()
+    table, best = run_sweep(args.features, hashes, labels, configs, folds=args.folds, workers=args.workers,
+                            epochs=args.epochs, batch_size=args.batch_size, patience=args.patience,
+                            output_dir=args.output_dir, seed=args.seed)
+    write_results(table, args.output_dir)
+    best_path = Path(args.output_dir) / "best_head.keras"
+    shutil.copyfile(best["best_checkpoint"], best_path)
+
+    print("\n" + "=" * 84)
+    print(f"{'trial':>5}{'lr':>10}{'dropout':>9}{'width':>7}{'mean acc':>10}{'± std':>8}{'val loss':>10}{'epochs':>8}")
+    print("=" * 84)
+    for row in table:
+        print(f"{row['trial']:>5}{row['lr']:>10.2e}{row['dropout']:>9.3f}{row['width']:>7}"
+              f"{row['mean_val_accuracy']:>10.4f}{row['std_val_accuracy']:>8.4f}{row['mean_val_loss']:>10.4f}"
+              f"{row['mean_epochs']:>8.1f}")
+    print(f"\n✓ Sweep finished in {time.perf_counter() - start:.1f}s; results in {args.output_dir}/results.csv")
+    print(f"✓ Best: trial {best['trial']} (lr {best['lr']:.2e}, dropout {best['dropout']}, width {best['width']}) "
+          f"-> {best_path}")
+    if args.export:
+        export_full_model(best["best_checkpoint"], args.features, args.export)
+        print(f"✓ Exported full model to {args.export}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+# throughput.py - Training throughput instrumentation for Keras fit()
+#
+# ThroughputMonitor is a Keras callback recording, per epoch: images/sec,
+# step time, how much of each step was spent waiting for the input pipeline
+# vs. computing, and the process's peak RSS. Records are appended as JSON lines
+# next to the checkpoint; at the end of training a summary says whether the
+# run was input-bound or compute-bound.
+#
+# Keras pulls batches inside the compiled train step, so batch hooks alone
+# cannot separate input wait from compute. ``monitor.wrap(data)`` timestamps
+# the moment each batch is ready without changing how it is produced: a
+# tf.data.Dataset gets a final, on-demand stage; a keras Sequence is stamped
+# as each batch is built, and fit() still runs its own enqueuer for it:
+#   step begin ──(input wait)──> batch ready ──(compute)──> step end
+#
+# Usage (see train_agent.py):
+#   monitor = ThroughputMonitor("best_imaging_model.keras", batch_size=32)
+#   model.fit(monitor.wrap(train_data), callbacks=[monitor, ...])
+#
+#   python throughput.py best_imaging_model.throughput.jsonl   # re-print the last run's summary
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak RSS comes from psutil when it is installed
+    resource = None
+
+# Input wait above this fraction of step time marks a run input-bound
+INPUT_BOUND_FRACTION = 0.2
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it cannot be measured"""
+    if resource is not None:
+        # ru_maxrss is in bytes on macOS and KiB on Linux / BSD
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    # peak_wset is the Windows peak working set; elsewhere fall back to the current RSS
+    return round(getattr(memory, "peak_wset", memory.rss) / 1024 ** 2, 1)
+
+
+class StampedSequence(tf.keras.utils.Sequence):
+    """A keras Sequence that records when each of its batches finishes building"""
+
+    def __init__(self, sequence, stamp):
+        """
+        :param sequence: the training Sequence; batches, order and epoch hooks are its own
+        :param stamp: called with the batch's image count once it is built
+        """
+        # Keras 3 keeps the Sequence's own workers / queue depth on the instance
+        super().__init__(**{
+            name: getattr(sequence, name)
+            for name in ("workers", "use_multiprocessing", "max_queue_size") if hasattr(sequence, name)
+        })
+        self.sequence = sequence
+        self.stamp = stamp
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index):
+        batch = self.sequence[index]
+        self.stamp(len(tf.nest.flatten(batch)[0]))
+        return batch
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+
+def classify(input_wait_fraction):
+    if input_wait_fraction is None:
+        return "unknown"
+    return "input-bound" if input_wait_fraction > INPUT_BOUND_FRACTION else "compute-bound"
+
+
+class ThroughputMonitor(tf.keras.callbacks.Callback):
+    """Per-epoch images/sec, step time, input wait vs. compute and peak RSS"""
+
+    def __init__(self, checkpoint_path, batch_size, log_path=None, run_info=None):
+        """
+        :param checkpoint_path: the run's checkpoint; the log goes next to it
+        :param batch_size: images per step (used when the input is not wrapped)
+        :param log_path: JSONL file (default: <checkpoint stem>.throughput.jsonl)
+        :param run_info: extra fields for the run's header record (pipeline, flags, ...)
+        """
+        super().__init__()
+        checkpoint_path = Path(checkpoint_path)
+        self.log_path = Path(log_path) if log_path else checkpoint_path.with_name(
+            f"{checkpoint_path.stem}.throughput.jsonl"
+        )
+        self.batch_size = batch_size
+        self.run_info = dict(run_info or {})
+        self.wrapped = False
+        self.epochs = []
+        # (time, images) per batch, appended from tf.data / enqueuer threads
+        self._ready = []
+
+    # ---------- input instrumentation ----------
+
+    def _stamp(self, images):
+        self._ready.append((time.perf_counter(), int(images)))
+        return np.int32(0)
+
+    def wrap(self, data):
+        """
+        Training input (tf.data.Dataset or keras Sequence) with batch-ready timestamps.
+        Sequences stay Sequences, so fit() feeds them with the same workers and queue depth
+        """
+        if not isinstance(data, tf.data.Dataset):
+            if getattr(data, "use_multiprocessing", False):
+                # Batches are built in worker processes, whose stamps never reach this one
+                return data
+            self.wrapped = True
+            return StampedSequence(data, self._stamp)
+
+        def stamp(*batch):
+            images = tf.shape(tf.nest.flatten(batch)[0])[0]
+            # Stateful, so it is never pruned; runs only when the train step asks for the batch
+            done = tf.py_function(self._stamp, [images], tf.int32)
+            with tf.control_dependencies([done]):
+                return tf.nest.map_structure(tf.identity, batch if len(batch) > 1 else batch[0])
+
+        self.wrapped = True
+        return data.map(stamp)
+
+    # ---------- callback hooks ----------
+
+    def _write(self, record):
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def on_train_begin(self, logs=None):
+        self.epochs = []
+        # Enqueuers may build the next epoch's first batches before on_epoch_begin,
+        # so stamps are only dropped here (fit() peeks at a Sequence before training)
+        self._ready.clear()
+        self._write(dict({
+            "event": "run",
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "argv": sys.argv[1:],
+            "batch_size": self.batch_size,
+            "devices": [d.name for d in tf.config.list_logical_devices()],
+            "cpus": os.cpu_count(),
+            "instrumented_input": self.wrapped,
+        }, **self.run_info))
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._steps = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        # Reading a metric waits for the step to finish on the device
+        if logs and "loss" in logs:
+            float(logs["loss"])
+        end = time.perf_counter()
+        ready, images = (None, self.batch_size)
+        if self._ready:
+            # The n-th step consumes once n batches are built, whichever worker finished first
+            ready, images = self._ready.pop(0)
+        # A batch stamped before the step began was already waiting: no input wait
+        wait = None if ready is None else min(max(ready - self._step_start, 0.0), end - self._step_start)
+        self._steps.append((end - self._step_start, wait, images))
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._epoch_start
+        # The first step of the run includes tracing / graph building
+        steps = self._steps[1:] if epoch == 0 and len(self._steps) > 1 else self._steps
+        if not steps:
+            return
+        step_times = np.array([s[0] for s in steps])
+        waits = [s[1] for s in steps if s[1] is not None]
+        train_seconds = sum(s[0] for s in self._steps)
+        images = sum(s[2] for s in self._steps)
+        input_wait_ms = float(np.mean(waits)) * 1000.0 if waits else None
+        step_ms = float(step_times.mean()) * 1000.0
+        wait_fraction = input_wait_ms / step_ms if waits and step_ms else None
+        record = {
+            "event": "epoch",
+            "epoch": epoch + 1,
+            "steps": len(self._steps),
+            "images": images,
+            "images_per_sec": round(images / train_seconds, 1) if train_seconds else None,
+            "step_ms": round(step_ms, 2),
+            "step_ms_p50": round(float(np.percentile(step_times, 50)) * 1000.0, 2),
+            "step_ms_p95": round(float(np.percentile(step_times, 95)) * 1000.0, 2),
+            "input_wait_ms": None if input_wait_ms is None else round(input_wait_ms, 2),
+            "compute_ms": round(step_ms - (input_wait_ms or 0.0), 2),
+            "input_wait_fraction": None if wait_fraction is None else round(wait_fraction, 3),
+            "train_seconds": round(train_seconds, 2),
+            # Validation and callback time
+            "other_seconds": round(elapsed - train_seconds, 2),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        record.update({k: round(float(v), 4) for k, v in (logs or {}).items()})
+        self.epochs.append(record)
+        self._write(record)
+
+    def on_train_end(self, logs=None):
+        summary = summarize(self.epochs)
+        if summary is None:
+            return
+        self._write(summary)
+        print_summary(summary)
+        print(f"✓ Throughput log: {self.log_path}")
+
+
+# ==================== Summary ====================
+
+def summarize(epochs):
+    """Run-level summary over the steady-state epochs (the first one fills caches, unless it is the only one)"""
+    if not epochs:
+        return None
+    steady = epochs[1:] if len(epochs) > 1 else epochs
+    images = sum(e["images"] for e in steady)
+    seconds = sum(e["train_seconds"] for e in steady)
+    steps = sum(e["steps"] for e in steady)
+    step_ms = sum(e["step_ms"] * e["steps"] for e in steady) / steps
+    waits = [e for e in steady if e["input_wait_ms"] is not None]
+    input_wait_ms = sum(e["input_wait_ms"] * e["steps"] for e in waits) / sum(e["steps"] for e in waits) if waits else None
+    wait_fraction = input_wait_ms / step_ms if waits and step_ms else None
+    return {
+        "event": "summary",
+        "epochs": len(epochs),
+        "steady_epochs": len(steady),
+        "images_per_sec": round(images / seconds, 1) if seconds else None,
+        "step_ms": round(step_ms, 2),
+        "input_wait_ms": None if input_wait_ms is None else round(input_wait_ms, 2),
+        "compute_ms": round(step_ms - (input_wait_ms or 0.0), 2),
+        "input_wait_fraction": None if wait_fraction is None else round(wait_fraction, 3),
+        "first_epoch_images_per_sec": epochs[0]["images_per_sec"],
+        "peak_rss_mb": max((e["peak_rss_mb"] for e in epochs if e["peak_rss_mb"] is not None), default=None),
+        "bound": classify(wait_fraction),
+    }
+
+
+def print_summary(summary):
+    print("\n" + "=" * 60)
+    print("THROUGHPUT SUMMARY")
+    print("=" * 60)
+    print(f"Images/sec:        {summary['images_per_sec']} (first epoch: {summary['first_epoch_images_per_sec']})")
+    print(f"Step time:         {summary['step_ms']:.1f} ms")
+    if summary["input_wait_ms"] is None:
+        print("Input wait:        not measured (training input was not wrapped)")
+    else:
+        print(f"Input wait:        {summary['input_wait_ms']:.1f} ms ({summary['input_wait_fraction']:.0%} of each step)")
+    print(f"Compute:           {summary['compute_ms']:.1f} ms")
+    if summary["peak_rss_mb"] is None:
+        print("Peak RSS:          unavailable (install psutil to measure it on this platform)")
+    else:
+        print(f"Peak RSS:          {summary['peak_rss_mb']:.0f} MB")
+    if summary["bound"] == "input-bound":
+        print("⚠ Input-bound: the model waits for data; speed up decoding/augmentation before adding compute")
+    elif summary["bound"] == "compute-bound":
+        print("✓ Compute-bound: the input pipeline keeps up; faster hardware or a smaller model will help")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a training throughput log")
+    parser.add_argument("log", help="<checkpoint stem>.throughput.jsonl")
+    args = parser.parse_args()
+
+    # Epoch records after the last run header
+    epochs = []
+    with open(args.log) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["event"] == "run":
+                epochs = []
+            elif record["event"] == "epoch":
+                epochs.append(record)
+    summary = summarize(epochs)
+    if summary is None:
+        print("⚠ No epochs recorded")
+        return
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
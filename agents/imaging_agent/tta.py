@@ -0,0 +1,56 @@
+# tta.py - Batched test-time augmentation
+
+import numpy as np
+
+
+def _shift(image, dy, dx):
+    """Translate an (H, W, 3) image, filling the border with the nearest pixels (fill_mode='nearest')"""
+    height, width = image.shape[:2]
+    rows = np.clip(np.arange(height) - dy, 0, height - 1)
+    cols = np.clip(np.arange(width) - dx, 0, width - 1)
+    return image[rows[:, None], cols[None, :]]
+
+
+def augment_views(image, num_views=6, shift_fraction=0.1):
+    """
+    Stack deterministic augmented views of one uint8 (H, W, 3) image into a
+    (num_views, H, W, 3) batch. View 0 is always the original; the rest are the
+    horizontal flip and small shifts used by the training ImageDataGenerator.
+    """
+    height, width = image.shape[:2]
+    dy = max(1, int(round(height * shift_fraction)))
+    dx = max(1, int(round(width * shift_fraction)))
+    flipped = image[:, ::-1]
+    candidates = [
+        lambda: image,
+        lambda: flipped,
+        lambda: _shift(image, 0, dx),
+        lambda: _shift(image, 0, -dx),
+        lambda: _shift(image, dy, 0),
+        lambda: _shift(image, -dy, 0),
+        lambda: _shift(flipped, 0, dx),
+        lambda: _shift(flipped, 0, -dx),
+    ]
+    num_views = max(1, min(num_views, len(candidates)))
+    views = np.empty((num_views, height, width, image.shape[2]), dtype=image.dtype)
+    for i in range(num_views):
+        views[i] = candidates[i]()
+    return views
+
+
+def tta_average(predict_fn, images, probabilities=None, num_views=6):
+    """
+    Average predictions over the augmented views of every image in ``images``
+    (N, H, W, 3) using a single ``predict_fn`` call.
+
+    If ``probabilities`` (N, num_classes) for the original images are already
+    known, only the extra views are run and the original row is reused.
+    """
+    skip = 0 if probabilities is None else 1
+    views = np.concatenate([augment_views(image, num_views)[skip:] for image in images])
+    if not len(views):
+        return np.asarray(probabilities)
+    outputs = np.asarray(predict_fn(views)).reshape(len(images), len(views) // len(images), -1)
+    if probabilities is None:
+        return outputs.mean(axis=1)
+    return (np.asarray(probabilities) + outputs.sum(axis=1)) / (outputs.shape[1] + 1)
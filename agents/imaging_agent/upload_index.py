@@ -0,0 +1,255 @@
+# upload_index.py - Index of uploaded images and their diagnoses, shared by worker processes
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows; run a single server process there
+    fcntl = None
+
+
+class UploadIndex:
+    """
+    Tracks uploads in insertion order together with their cached diagnosis,
+    so "latest upload" lookups are O(1) instead of a directory scan.
+
+    Changes are appended to a JSONL journal inside the upload folder, which
+    every worker process shares: each call first applies the records other
+    processes appended since the previous call (one fstat, plus a read of the
+    new bytes if there are any), and appends are serialized with an advisory
+    file lock. If no journal exists yet (e.g. uploads written by an older
+    version), the folder is scanned once to rebuild it.
+
+    Only the process created with ``compact_every`` > 0 rewrites the journal;
+    the others notice the replaced file and replay it from the start.
+    """
+
+    JOURNAL_NAME = ".upload_index.jsonl"
+    LOCK_NAME = ".upload_index.lock"
+
+    def __init__(self, folder, allowed_extensions, compact_every=1000):
+        """
+        :param folder: upload directory (the journal lives inside it)
+        :param allowed_extensions: suffixes treated as images when rebuilding from a scan
+        :param compact_every: rewrite the journal once this many records were appended by any process
+            (0 = never; used by the pre-forked workers that are not in charge of it)
+        """
+        self.folder = Path(folder)
+        self.allowed_extensions = allowed_extensions
+        self.journal_path = self.folder / self.JOURNAL_NAME
+        self.compact_every = compact_every
+        self._entries = OrderedDict()
+        # Last read time per upload (falls back to upload time)
+        self._last_access = {}
+        self._lock = threading.Lock()
+        # Records applied since the journal was last rewritten
+        self._appended = 0
+        # (device, inode) of the journal read so far, and the end of its last complete line
+        self._journal_id = None
+        self._journal_offset = 0
+        self._load()
+
+    # ---------- persistence ----------
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process writing the journal"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.folder / self.LOCK_NAME, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        """Replay the journal, or rebuild it from the folder contents"""
+        with self._lock, self._file_lock():
+            if self.journal_path.exists():
+                self._sync()
+                if not self.compact_every:
+                    return
+                # Entries whose file disappeared while we were down
+                for filename in [f for f, e in self._entries.items()
+                                 if e.get("persisted") and not (self.folder / f).exists()]:
+                    del self._entries[filename]
+                    self._last_access.pop(filename, None)
+            else:
+                files = [p for p in self.folder.glob("*") if p.is_file() and p.suffix.lower() in self.allowed_extensions]
+                for path in sorted(files, key=lambda p: p.stat().st_mtime):
+                    stat = path.stat()
+                    self._entries[path.name] = {
+                        "filename": path.name,
+                        "size": stat.st_size,
+                        "uploaded_at": stat.st_mtime,
+                        "persisted": True,
+                        "content_hash": None,
+                        "model_version": None,
+                        "result": None,
+                    }
+            self._compact()
+
+    def _apply(self, record):
+        op = record.pop("op", "add")
+        filename = record.get("filename")
+        if op == "remove":
+            self._entries.pop(filename, None)
+            self._last_access.pop(filename, None)
+        elif op == "clear":
+            self._entries.clear()
+            self._last_access.clear()
+        elif op == "touch":
+            if filename in self._entries:
+                self._last_access[filename] = record["at"]
+        elif op == "update":
+            # Keeps the entry's position, unlike a re-add
+            if filename in self._entries:
+                self._entries[filename].update(result=record["result"], model_version=record["model_version"])
+        else:
+            last_accessed = record.pop("last_accessed", None)
+            self._entries.pop(filename, None)
+            self._entries[filename] = record
+            if last_accessed is not None:
+                self._last_access[filename] = last_accessed
+        self._appended += 1
+
+    def _sync(self):
+        """Apply the records appended by any process since the last call (caller holds self._lock)"""
+        try:
+            f = open(self.journal_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            journal_id = (stat.st_dev, stat.st_ino)
+            if journal_id != self._journal_id or stat.st_size < self._journal_offset:
+                # Rewritten by compaction (or a fresh journal): replay it from the start
+                self._entries.clear()
+                self._last_access.clear()
+                self._journal_id, self._journal_offset, self._appended = journal_id, 0, 0
+            if stat.st_size == self._journal_offset:
+                return
+            f.seek(self._journal_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # A write still in progress, or a torn final write after a crash
+                    break
+                self._journal_offset += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._apply(record)
+
+    def _append(self, record):
+        """Journal a change and apply it (caller holds both locks and has just synced)"""
+        with open(self.journal_path, "ab") as f:
+            f.write((json.dumps(record) + "\n").encode())
+            # Nobody else appends while the file lock is held
+            self._journal_offset = f.tell()
+        self._apply(record)
+        if self.compact_every and self._appended >= self.compact_every:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the journal with one record per live entry (caller holds both locks)"""
+        tmp_path = self.journal_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            for name, entry in self._entries.items():
+                record = {"op": "add", **entry}
+                if name in self._last_access:
+                    record["last_accessed"] = self._last_access[name]
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.journal_path)
+        stat = os.stat(self.journal_path)
+        self._journal_id, self._journal_offset, self._appended = (stat.st_dev, stat.st_ino), stat.st_size, 0
+
+    @contextmanager
+    def _view(self):
+        """Hold self._lock over an up-to-date view of the journal"""
+        with self._lock:
+            self._sync()
+            if self.compact_every and self._appended >= self.compact_every:
+                # Other processes appended enough to be worth a rewrite
+                with self._file_lock():
+                    self._sync()
+                    self._compact()
+            yield
+
+    @contextmanager
+    def _change(self):
+        """Hold both locks over an up-to-date view, for a change appended with _append"""
+        with self._lock, self._file_lock():
+            self._sync()
+            yield
+
+    # ---------- queries / updates ----------
+
+    def record(self, filename, content_hash=None, size=None, result=None, model_version=None, persisted=True):
+        """Add or replace an upload; it becomes the latest entry"""
+        entry = {
+            "filename": filename,
+            "size": size,
+            "uploaded_at": time.time(),
+            "persisted": persisted,
+            "content_hash": content_hash,
+            "model_version": model_version,
+            "result": result,
+        }
+        with self._change():
+            self._append({"op": "add", **entry})
+        return entry
+
+    def update_result(self, filename, result, model_version):
+        """Attach a (re)computed diagnosis to an existing entry without changing its position"""
+        with self._change():
+            if filename in self._entries:
+                self._append({"op": "update", "filename": filename, "result": result, "model_version": model_version})
+
+    def latest(self):
+        """Most recently uploaded entry, or None"""
+        with self._view():
+            if not self._entries:
+                return None
+            return dict(next(reversed(self._entries.values())))
+
+    def touch(self, filename):
+        """Mark an upload as recently used (for LRU retention, which may run in another process)"""
+        with self._change():
+            if filename in self._entries:
+                self._append({"op": "touch", "filename": filename, "at": time.time()})
+
+    def snapshot(self):
+        """Copies of all entries, oldest upload first, with a last_accessed field"""
+        with self._view():
+            return [
+                dict(entry, last_accessed=self._last_access.get(name, entry["uploaded_at"]))
+                for name, entry in self._entries.items()
+            ]
+
+    def get(self, filename):
+        with self._view():
+            entry = self._entries.get(filename)
+            return dict(entry) if entry else None
+
+    def remove(self, filename):
+        with self._change():
+            if filename in self._entries:
+                self._append({"op": "remove", "filename": filename})
+
+    def clear(self):
+        with self._change():
+            self._append({"op": "clear"})
+
+    def __len__(self):
+        with self._view():
+            return len(self._entries)
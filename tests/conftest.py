@@ -0,0 +1,14 @@
+# conftest.py - Make the agents' flat modules importable from the tests
+#
+# The agents import their siblings by module name (they run from their own
+# folder), so the tests put those folders on sys.path the same way.
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for agent in ("imaging_agent", "diagnosis_agent"):
+    path = os.path.join(ROOT, "agents", agent)
+    if path not in sys.path:
+        sys.path.insert(0, path)
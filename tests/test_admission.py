@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import AdmissionController, DeadlineExceeded, Overloaded, parse_deadline
+
+
+def test_full_queue_is_refused_with_retry_after():
+    controller = AdmissionController(max_pending=4)
+    controller.try_acquire(3)
+    with pytest.raises(Overloaded) as refused:
+        controller.try_acquire(2)
+    assert refused.value.retry_after == controller.min_retry_after
+    assert controller.stats()["rejected"] == 2
+    assert controller.pending == 3
+
+
+def test_idle_server_admits_an_oversized_request():
+    controller = AdmissionController(max_pending=4)
+    controller.try_acquire(10)
+    assert controller.pending == 10
+
+
+def test_retry_after_follows_measured_throughput_within_bounds():
+    controller = AdmissionController(max_pending=100, min_retry_after=1, max_retry_after=30)
+    controller.pending = 20
+    controller._rate = 2.0
+    # (20 pending + 1) / 2 images per second, rounded up
+    assert controller.retry_after() == 11
+    controller._rate = 0.1
+    assert controller.retry_after() == 30
+    controller._rate = 1000.0
+    assert controller.retry_after() == 1
+
+
+def test_unmeetable_deadline_is_refused():
+    controller = AdmissionController(max_pending=100)
+    controller.pending = 10
+    controller._rate = 1.0
+    with pytest.raises(Overloaded):
+        controller.check(1, deadline=time.monotonic() + 2)
+    controller.check(1, deadline=time.monotonic() + 60)
+
+
+def test_expired_deadline_on_arrival():
+    controller = AdmissionController()
+    with pytest.raises(DeadlineExceeded):
+        controller.try_acquire(1, deadline=time.monotonic() - 1)
+    assert controller.stats()["expired"] == 1
+
+
+def test_release_updates_throughput():
+    controller = AdmissionController()
+    admitted_at = controller.try_acquire(4)
+    time.sleep(0.01)
+    controller.release(4, admitted_at)
+    assert controller.pending == 0
+    assert controller.throughput > 0
+    # Cancelled work does not feed the estimate
+    rate = controller.throughput
+    controller.release(0, controller.try_acquire(1), completed=False)
+    assert controller.throughput == rate
+
+
+def test_acquire_waits_for_release():
+    async def scenario():
+        controller = AdmissionController(max_pending=2)
+        admitted_at = controller.try_acquire(2)
+        waiter = asyncio.ensure_future(controller.acquire(1))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        controller.release(2, admitted_at)
+        count, _ = await asyncio.wait_for(waiter, 1)
+        return count, controller.pending
+
+    assert asyncio.run(scenario()) == (1, 1)
+
+
+def test_parse_deadline_takes_the_earliest():
+    before = time.monotonic()
+    deadline = parse_deadline(timeout_ms="500", deadline_epoch=str(time.time() + 10))
+    assert before + 0.4 < deadline < time.monotonic() + 0.6
+    assert parse_deadline() is None
+    assert parse_deadline(default_timeout_ms=1000) > before
@@ -0,0 +1,66 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from preprocess import ArchiveLimitError, iter_archive_images
+
+IMAGES = {".png", ".jpg"}
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer
+
+
+def make_tar(members, symlink=None):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        if symlink:
+            info = tarfile.TarInfo(symlink)
+            info.type = tarfile.SYMTYPE
+            info.linkname = "/etc/passwd"
+            archive.addfile(info)
+    return buffer
+
+
+def test_reads_images_and_skips_other_files():
+    archive = make_zip([("a.png", b"1"), ("notes.txt", b"x"), ("dir/b.jpg", b"22")])
+    assert list(iter_archive_images(archive, "x.zip", IMAGES)) == [("a.png", b"1"), ("dir/b.jpg", b"22")]
+
+
+def test_member_size_limit():
+    # Highly compressible: tiny upload, large uncompressed member
+    archive = make_zip([("ok.png", b"1"), ("bomb.png", b"\0" * 10_000)])
+    members = iter_archive_images(archive, "x.zip", IMAGES, max_member_bytes=1000)
+    assert next(members) == ("ok.png", b"1")
+    with pytest.raises(ArchiveLimitError, match="bomb.png"):
+        next(members)
+
+
+def test_member_count_limit():
+    archive = make_zip([(f"{i}.txt", b"") for i in range(5)])
+    with pytest.raises(ArchiveLimitError, match="entries"):
+        list(iter_archive_images(archive, "x.zip", IMAGES, max_members=3))
+
+
+def test_total_size_limit():
+    archive = make_tar([(f"{i}.png", b"\0" * 400) for i in range(3)])
+    members = iter_archive_images(archive, "x.tar.gz", IMAGES, max_member_bytes=1000, max_total_bytes=1000)
+    assert len(next(members)[1]) == 400
+    assert len(next(members)[1]) == 400
+    with pytest.raises(ArchiveLimitError, match="Archive is larger"):
+        next(members)
+
+
+def test_tar_skips_links():
+    archive = make_tar([("a.png", b"1")], symlink="evil.png")
+    assert list(iter_archive_images(archive, "x.tgz", IMAGES)) == [("a.png", b"1")]
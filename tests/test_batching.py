@@ -0,0 +1,49 @@
+import threading
+
+import numpy as np
+
+from batching import MicroBatcher
+
+
+def _image(value):
+    return np.full((2, 2, 3), value, dtype=np.float32)
+
+
+def test_cancelled_request_does_not_stop_the_batcher():
+    gate = threading.Event()
+    calls = []
+
+    def predict(inputs):
+        calls.append(len(inputs))
+        if len(calls) == 1:
+            gate.wait(5)
+        return inputs.reshape(len(inputs), -1)[:, :1].copy()
+
+    batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=1.0)
+    batcher.start()
+    try:
+        first = batcher.submit(_image(1))
+        # Queued behind the running batch; the client of the first one goes away
+        cancelled = batcher.submit(_image(2))
+        waiting = batcher.submit(_image(3))
+        assert cancelled.cancel()
+        gate.set()
+
+        assert first.result(timeout=5)[0] == 1
+        assert waiting.result(timeout=5)[0] == 3
+        assert cancelled.cancelled()
+        # The batching thread survived and serves later requests
+        assert batcher.predict(_image(4), timeout=5)[0] == 4
+        assert batcher.stats()["images_processed"] == 3
+    finally:
+        batcher.stop()
+
+
+def test_batch_fans_out_rows_in_order():
+    batcher = MicroBatcher(lambda inputs: inputs[:, 0, 0, :1].copy(), max_batch_size=8, max_wait_ms=50.0)
+    batcher.start()
+    try:
+        futures = [batcher.submit(_image(i)) for i in range(5)]
+        assert [float(f.result(timeout=5)[0]) for f in futures] == [0, 1, 2, 3, 4]
+    finally:
+        batcher.stop()
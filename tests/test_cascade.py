@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from cascade import ModelCascade, check_compatible
+
+
+class FakeHandle:
+    def __init__(self, num_classes, version="v"):
+        self.num_classes = num_classes
+        self.version = version
+
+
+def test_check_compatible():
+    check_compatible(FakeHandle(3), FakeHandle(3))
+    with pytest.raises(ValueError, match="same number of classes"):
+        check_compatible(FakeHandle(3), FakeHandle(2))
+
+
+def test_escalation_mask_and_stats():
+    cascade = ModelCascade(FakeHandle(3, "big"), threshold=0.8)
+    mask = cascade.escalation_mask(np.array([[0.9, 0.05, 0.05], [0.5, 0.3, 0.2]]))
+    assert mask.tolist() == [False, True]
+    stats = cascade.stats()
+    assert (stats["primary_answered"], stats["escalated"], stats["escalation_rate"]) == (1, 1, 0.5)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+
+def _records(n, start=0):
+    return [{"content_hash": f"h{i}", "filename": f"{i}.png"} for i in range(start, start + n)]
+
+
+def test_exact_search_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    # Small chunks so the running top-k crosses chunk boundaries
+    store = EmbeddingStore(tmp_path / "v1", version="v1", search_chunk_rows=7)
+    assert store.append(vectors, _records(50)) == 50
+
+    query = rng.normal(size=8).astype(np.float32)
+    results, method = store.search(query, k=5)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5]
+    assert method == "exact"
+    assert [r["row"] for r in results] == list(expected)
+    assert [r["score"] for r in results] == sorted((r["score"] for r in results), reverse=True)
+
+
+def test_search_excludes_the_query_image(tmp_path):
+    store = EmbeddingStore(tmp_path / "v1")
+    vectors = np.eye(4, dtype=np.float32)
+    store.append(vectors, _records(4))
+    results, _ = store.search(vectors[2], k=2, exclude_hash="h2")
+    assert len(results) == 2
+    assert "h2" not in {r["content_hash"] for r in results}
+
+
+def test_duplicates_are_skipped_and_reopen_sees_rows(tmp_path):
+    store = EmbeddingStore(tmp_path / "v1")
+    store.append(np.eye(3, dtype=np.float32), _records(3))
+    assert store.append(np.eye(3, dtype=np.float32), _records(3)) == 0
+
+    reopened = EmbeddingStore(tmp_path / "v1")
+    assert len(reopened) == 3 and "h1" in reopened
+    assert reopened.search(np.array([0, 1, 0], dtype=np.float32), k=1)[0][0]["content_hash"] == "h1"
+
+
+def test_empty_store(tmp_path):
+    store = EmbeddingStore(tmp_path / "v1")
+    assert store.search(np.ones(4, dtype=np.float32)) == ([], "exact")
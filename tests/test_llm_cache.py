@@ -0,0 +1,67 @@
+import time
+
+from llm_cache import LLMCache, cache_key
+
+IMAGING = {"predicted_class": "Malignant", "confidence": 0.9134567891, "features": ["Irregular margin"]}
+
+
+def _key(imaging=IMAGING, notes="Palpable lump, 3 weeks", kg=None, model="m", prompt_version="p1"):
+    return cache_key(imaging, notes, kg or {"differential_diagnoses": []}, model, prompt_version)
+
+
+def test_cache_key_ignores_case_and_spacing_of_inputs():
+    variant = {" PREDICTED_CLASS ": "malignant ", "confidence": 0.91345678912, "features": ["irregular MARGIN"]}
+    assert _key(variant, "  Palpable   lump,\n3 weeks ") == _key()
+
+
+def test_cache_key_separates_what_changes_the_answer():
+    base = _key()
+    assert _key(notes="palpable lump, 3 weeks") != base  # note wording and case are kept
+    assert _key(kg={"differential_diagnoses": ["fibroadenoma"]}) != base
+    assert _key(model="other") != base
+    assert _key(prompt_version="p2") != base
+
+
+def test_hit_miss_and_ttl(tmp_path):
+    cache = LLMCache(str(tmp_path / "c.sqlite3"), ttl=0.05)
+    assert cache.get("k") is None
+    cache.put("k", {"diagnosis": "Likely benign"}, "m", "p1")
+    assert cache.get("k") == {"diagnosis": "Likely benign"}
+    time.sleep(0.06)
+    assert cache.get("k") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = LLMCache(str(tmp_path / "c.sqlite3"), max_entries=2, touch_interval=0)
+    cache.put("a", {"n": 1}, "m", "p1")
+    time.sleep(0.01)
+    cache.put("b", {"n": 2}, "m", "p1")
+    time.sleep(0.01)
+    cache.get("a")
+    cache.put("c", {"n": 3}, "m", "p1")
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1} and cache.get("c") == {"n": 3}
+
+
+def test_hits_refresh_access_time_at_most_once_per_interval(tmp_path):
+    cache = LLMCache(str(tmp_path / "c.sqlite3"), touch_interval=3600)
+    cache.put("k", {"n": 1}, "m", "p1")
+    for _ in range(3):
+        cache.get("k")
+    assert cache.stats()["stored_hits"] == 0
+    assert cache.hits == 3
+
+    eager = LLMCache(str(tmp_path / "c.sqlite3"), touch_interval=0)
+    eager.get("k")
+    assert eager.stats()["stored_hits"] == 1
+
+
+def test_purge_drops_other_prompt_versions_and_expired(tmp_path):
+    cache = LLMCache(str(tmp_path / "c.sqlite3"), ttl=3600)
+    cache.put("old", {"n": 1}, "m", "p0")
+    cache.put("new", {"n": 2}, "m", "p1")
+    assert cache.purge("p1") == 1
+    assert cache.get("old") is None and cache.get("new") == {"n": 2}
+    assert cache.clear() == 1
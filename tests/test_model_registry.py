@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from model_registry import ModelRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    artifact = tmp_path / "model.onnx"
+    artifact.write_bytes(b"onnx")
+    registry = ModelRegistry(tmp_path / "models")
+    registry.register(str(artifact), version="v1", input_size=(224, 224))
+    return registry
+
+
+def test_registered_version(registry):
+    assert registry.version_names() == ["v1"]
+    assert registry.metadata("v1")["input_size"] == [224, 224]
+    assert registry.artifact_path("v1").endswith("model.onnx")
+
+
+@pytest.mark.parametrize("version", ["", ".", "..", "../v1", "v1/..", "v1/../v1", "..\\v1", "v2"])
+def test_rejects_unlisted_or_path_like_versions(registry, version):
+    with pytest.raises(KeyError):
+        registry.metadata(version)
+    with pytest.raises(KeyError):
+        registry.artifact_path(version)
+
+
+def test_rejects_artifact_outside_registry(registry, tmp_path):
+    (tmp_path / "secret.onnx").write_bytes(b"x")
+    metadata_path = registry.root / "v1" / ModelRegistry.METADATA_FILE
+    metadata = json.loads(metadata_path.read_text())
+    metadata["artifact"] = "../../secret.onnx"
+    metadata_path.write_text(json.dumps(metadata))
+    with pytest.raises(ValueError):
+        registry.artifact_path("v1")
+
+
+def test_register_rejects_path_versions(registry, tmp_path):
+    with pytest.raises(ValueError):
+        registry.register(str(tmp_path / "model.onnx"), version="../escape")
@@ -0,0 +1,59 @@
+import time
+
+from prediction_cache import PredictionCache
+
+
+def test_hit_returns_a_copy():
+    cache = PredictionCache(max_entries=4)
+    cache.put("k", "v1", {"label": "benign"})
+    result = cache.get("k", "v1")
+    result["label"] = "changed"
+    assert cache.get("k", "v1") == {"label": "benign"}
+    assert cache.stats()["hits"] == 2
+
+
+def test_other_model_version_is_a_miss():
+    cache = PredictionCache(max_entries=4)
+    cache.put("k", "v1", {"label": "benign"})
+    assert cache.get("k", "v2") is None
+    # The stale entry is dropped on the miss
+    assert cache.get("k", "v1") is None
+
+
+def test_ttl_expiry():
+    cache = PredictionCache(max_entries=4, ttl_seconds=0.05)
+    cache.put("k", "v1", {"label": "benign"})
+    assert cache.get("k", "v1") is not None
+    time.sleep(0.06)
+    assert cache.get("k", "v1") is None
+
+
+def test_lru_eviction():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", "v1", 1)
+    cache.put("b", "v1", 2)
+    cache.get("a", "v1")
+    cache.put("c", "v1", 3)
+    assert cache.get("b", "v1") is None
+    assert cache.get("a", "v1") == 1
+    assert cache.get("c", "v1") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disabled_cache():
+    cache = PredictionCache(max_entries=0)
+    cache.put("k", "v1", 1)
+    assert cache.get("k", "v1") is None
+
+
+def test_contains_matches_get_freshness():
+    cache = PredictionCache(max_entries=4, ttl_seconds=0.05)
+    cache.put("k", "v1", 1)
+    assert cache.contains("k", "v1")
+    assert cache.contains("k", ("v0", "v1"))
+    assert not cache.contains("k", "v2")
+    assert not cache.contains("missing", "v1")
+    # No effect on the counters
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
+    time.sleep(0.06)
+    assert not cache.contains("k", "v1")
@@ -0,0 +1,43 @@
+import os
+import threading
+
+import pytest
+
+from replicas import ReplicaSet
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="needs CPU affinity (Linux)")
+
+
+class RecordingBackend:
+    name = "fake"
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, img_batch):
+        self.calls.append((threading.current_thread().name, os.sched_getaffinity(0)))
+        return img_batch
+
+
+def test_pinned_replicas_run_on_their_own_threads():
+    cpu = min(os.sched_getaffinity(0))
+    caller_affinity = os.sched_getaffinity(0)
+    backends = [RecordingBackend(), RecordingBackend()]
+    replicas = ReplicaSet(backends, cpu_sets=[[cpu], [cpu]])
+    try:
+        for _ in range(4):
+            replicas.predict(1)
+        calls = backends[0].calls + backends[1].calls
+        assert len(calls) == 4
+        assert all(name.startswith("imaging-replica-") and affinity == {cpu} for name, affinity in calls)
+        # The shared caller thread is never re-pinned
+        assert os.sched_getaffinity(0) == caller_affinity
+    finally:
+        replicas.close()
+
+
+def test_unpinned_replicas_run_on_the_caller():
+    backend = RecordingBackend()
+    replicas = ReplicaSet([backend])
+    replicas.predict(1)
+    assert backend.calls[0][0] == threading.current_thread().name
@@ -0,0 +1,58 @@
+import threading
+
+import numpy as np
+
+from sweep import claim_cpu_group, stratified_folds
+
+
+def test_every_image_gets_one_fold_with_balanced_classes():
+    labels = np.array([0] * 50 + [1] * 30 + [2] * 20)
+    folds = stratified_folds(labels, 5, seed=1)
+    assert folds.shape == labels.shape
+    assert set(folds) == set(range(5))
+    for fold in range(5):
+        counts = np.bincount(labels[folds == fold], minlength=3)
+        assert counts.tolist() == [10, 6, 4]
+
+
+def test_uneven_classes_differ_by_at_most_one_per_fold():
+    labels = np.array([0] * 13 + [1] * 7)
+    folds = stratified_folds(labels, 4)
+    for label in (0, 1):
+        sizes = np.bincount(folds[labels == label], minlength=4)
+        assert sizes.max() - sizes.min() <= 1
+
+
+def test_seed_makes_folds_reproducible():
+    labels = np.repeat([0, 1, 2], 10)
+    assert (stratified_folds(labels, 3, seed=7) == stratified_folds(labels, 3, seed=7)).all()
+    assert (stratified_folds(labels, 3, seed=7) != stratified_folds(labels, 3, seed=8)).any()
+
+
+def test_concurrent_workers_never_share_a_core_group():
+    holders, lock, claimed = {}, threading.Lock(), {}
+
+    def worker(pid):
+        claimed[pid] = claim_cpu_group(holders, lock, 4, pid, alive=lambda holder: True)
+
+    threads = [threading.Thread(target=worker, args=(pid,)) for pid in (101, 102, 103, 104)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed.values()) == [0, 1, 2, 3]
+
+
+def test_replacement_worker_takes_over_the_dead_workers_group():
+    holders, lock = {}, threading.Lock()
+    live = {101, 102}
+    alive = live.__contains__
+    first = claim_cpu_group(holders, lock, 2, 101, alive)
+    second = claim_cpu_group(holders, lock, 2, 102, alive)
+    assert first != second
+
+    live.discard(101)
+    live.add(103)
+    # Does not wait for, or steal, the group still held by the running worker
+    assert claim_cpu_group(holders, lock, 2, 103, alive) == first
+    assert claim_cpu_group(holders, lock, 2, 102, alive) == second
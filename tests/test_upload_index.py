@@ -0,0 +1,72 @@
+from upload_index import UploadIndex
+
+EXTENSIONS = {".png", ".jpg"}
+
+
+def _upload(index, name):
+    (index.folder / name).write_bytes(b"img")
+    return index.record(name, size=3)
+
+
+def test_journal_replay_keeps_order_and_results(tmp_path):
+    index = UploadIndex(tmp_path, EXTENSIONS)
+    for name in ("a.png", "b.png", "c.png"):
+        _upload(index, name)
+    index.update_result("a.png", {"label": "benign"}, "v1")
+    index.remove("b.png")
+
+    replayed = UploadIndex(tmp_path, EXTENSIONS)
+    assert [e["filename"] for e in replayed.snapshot()] == ["a.png", "c.png"]
+    # A result update does not make an upload the latest one
+    assert replayed.latest()["filename"] == "c.png"
+    assert replayed.get("a.png")["result"] == {"label": "benign"}
+
+
+def test_torn_final_line_is_ignored(tmp_path):
+    index = UploadIndex(tmp_path, EXTENSIONS)
+    _upload(index, "a.png")
+    with open(index.journal_path, "a") as f:
+        f.write('{"op": "add", "filename": "b.p')
+    assert [e["filename"] for e in UploadIndex(tmp_path, EXTENSIONS).snapshot()] == ["a.png"]
+
+
+def test_rebuild_from_folder_scan(tmp_path):
+    (tmp_path / "old.jpg").write_bytes(b"img")
+    (tmp_path / "notes.txt").write_bytes(b"x")
+    index = UploadIndex(tmp_path, EXTENSIONS)
+    assert [e["filename"] for e in index.snapshot()] == ["old.jpg"]
+    assert index.journal_path.exists()
+
+
+def test_compaction_rewrites_one_record_per_entry(tmp_path):
+    index = UploadIndex(tmp_path, EXTENSIONS, compact_every=6)
+    for i in range(4):
+        _upload(index, f"{i}.png")
+    index.touch("0.png")
+    index.remove("1.png")
+    assert len(index.journal_path.read_text().splitlines()) == 3
+
+    replayed = UploadIndex(tmp_path, EXTENSIONS)
+    assert [e["filename"] for e in replayed.snapshot()] == ["0.png", "2.png", "3.png"]
+    # Access times survive compaction
+    entry = replayed.snapshot()[0]
+    assert entry["last_accessed"] > entry["uploaded_at"]
+
+
+def test_workers_see_each_others_changes(tmp_path):
+    owner = UploadIndex(tmp_path, EXTENSIONS, compact_every=3)
+    worker = UploadIndex(tmp_path, EXTENSIONS, compact_every=0)
+    _upload(worker, "a.png")
+    assert owner.latest()["filename"] == "a.png"
+    _upload(owner, "b.png")
+    assert worker.latest()["filename"] == "b.png"
+
+    # The owner's compaction replaces the journal; the worker replays the new file
+    _upload(worker, "c.png")
+    _upload(worker, "d.png")
+    assert len(owner) == 4
+    assert len(owner.journal_path.read_text().splitlines()) == 4
+    assert [e["filename"] for e in worker.snapshot()] == ["a.png", "b.png", "c.png", "d.png"]
+
+    worker.clear()
+    assert owner.latest() is None and len(owner) == 0
@@ -5,7 +5,45 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
+import argparse
+import math
 import os
+import sys
+from functools import partial
+
+import numpy as np
+
+# Data tooling shared with the imaging agent (flat imports, like its CLIs)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "agents", "imaging_agent"))
+from dataset_shards import ShardedDataset
+from feature_cache import FeatureCache, file_hash, weights_hash
+from throughput import ThroughputMonitor
+
+parser = argparse.ArgumentParser(description="Train the breast cancer imaging agent")
+parser.add_argument("--pipeline", choices=["tfdata", "generator"], default="generator",
+                    help="Input pipeline: the ImageDataGenerator (default) or parallel tf.data")
+parser.add_argument("--cache-file", default="",
+                    help="tf.data only: cache decoded images in this file instead of in memory")
+parser.add_argument("--shards", default="",
+                    help="Read pre-decoded images from a dataset compiled with dataset_shards.py "
+                         "(e.g. busi_shards/224x224) instead of the image folders")
+parser.add_argument("--head-only", action="store_true",
+                    help="Run the frozen backbone once, cache its pooled features and train only the dense head")
+parser.add_argument("--feature-cache", default="feature_cache",
+                    help="--head-only: directory of the on-disk feature cache")
+parser.add_argument("--variants", type=int, default=5,
+                    help="--head-only: cached views per image (the original plus variants-1 augmented copies)")
+args = parser.parse_args()
+
+IMG_SIZE = (224, 224)
+BATCH_SIZE = 32
+VALIDATION_SPLIT = 0.2
+# The files flow_from_directory picks up, so both pipelines train on the same images
+TFDATA_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+# Of those, the ones tf.io.decode_image cannot read (decoded with PIL, like flow_from_directory does)
+PIL_EXTENSIONS = ('.ppm', '.tif', '.tiff')
+# Part of the feature cache key: change it whenever `augment` below changes
+AUGMENT_VERSION = "rot20-shift20-zoom15-hflip"
 
 print("=" * 60)
 print("BREAST CANCER IMAGING AGENT TRAINER")
@@ -14,58 +52,180 @@ print("=" * 60)
 # Path to your dataset
 dataset_path = r"C:\Users\yami\Downloads\archive (1)\Dataset_BUSI_with_GT"
 
+shards = ShardedDataset(args.shards) if args.shards else None
+if shards is not None:
+    if (shards.height, shards.width) != IMG_SIZE:
+        print(f"❌ ERROR: {args.shards} holds {shards.height}x{shards.width} images, the model needs {IMG_SIZE[0]}x{IMG_SIZE[1]}")
+        exit(1)
+    if args.pipeline == "generator":
+        print("⚠ --shards replaces the image folders; using the tfdata pipeline")
+        args.pipeline = "tfdata"
+    print(f"✓ Compiled dataset: {args.shards} ({len(shards)} images, masks excluded)")
 # Check if dataset exists
-if not os.path.exists(dataset_path):
+elif not os.path.exists(dataset_path):
     print(f"❌ ERROR: Dataset not found at: {dataset_path}")
     print("\nPlease update the dataset_path variable with the correct path.")
     print("The dataset should have 3 folders: benign, malignant, normal")
     exit(1)
+else:
+    print(f"✓ Dataset found at: {dataset_path}")
 
-print(f"✓ Dataset found at: {dataset_path}")
-
-# Check dataset structure
-expected_folders = ['benign', 'malignant', 'normal']
-found_folders = [f for f in os.listdir(dataset_path) if os.path.isdir(os.path.join(dataset_path, f))]
-print(f"✓ Found folders: {found_folders}")
+    # Check dataset structure
+    expected_folders = ['benign', 'malignant', 'normal']
+    found_folders = [f for f in os.listdir(dataset_path) if os.path.isdir(os.path.join(dataset_path, f))]
+    print(f"✓ Found folders: {found_folders}")
 
 # 1️⃣ Data preprocessing with augmentation
 print("\n" + "=" * 60)
 print("STEP 1: Preparing Data")
 print("=" * 60)
 
-datagen = ImageDataGenerator(
-    rescale=1./255,
-    validation_split=0.2,
-    rotation_range=20,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    zoom_range=0.15,
-    horizontal_flip=True,
-    fill_mode='nearest'
-)
+def list_split(directory, subset):
+    """
+    (paths, labels, class_indices) for a subset, split exactly like
+    flow_from_directory: per class, sorted file names, the first
+    VALIDATION_SPLIT fraction is validation. With --shards the "paths" are
+    manifest positions in the compiled dataset.
+    """
+    if shards is not None:
+        positions = shards.split(subset, VALIDATION_SPLIT)
+        return positions, shards.labels[positions].tolist(), {name: i for i, name in enumerate(shards.class_names)}
+    class_names = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    paths, labels = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(TFDATA_EXTENSIONS))
+        split_at = int(VALIDATION_SPLIT * len(files))
+        files = files[:split_at] if subset == 'validation' else files[split_at:]
+        paths += [os.path.join(class_dir, f) for f in files]
+        labels += [label] * len(files)
+    return paths, labels, {name: i for i, name in enumerate(class_names)}
 
-try:
-    train_data = datagen.flow_from_directory(
-        dataset_path,
-        target_size=(224, 224),
-        batch_size=32,
-        class_mode='categorical',
-        subset='training',
-        shuffle=True
-    )
 
-    val_data = datagen.flow_from_directory(
-        dataset_path,
-        target_size=(224, 224),
-        batch_size=32,
-        class_mode='categorical',
-        subset='validation',
-        shuffle=False
+def decode_with_pil(path):
+    """RGB uint8 array of an image tf.io.decode_image cannot read"""
+    from PIL import Image
+    with Image.open(path.decode()) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+def load_image(path, label):
+    """Decode and resize one image to uint8 (cached, so this runs once per image)"""
+    needs_pil = tf.strings.regex_full_match(
+        tf.strings.lower(path), '.*(' + '|'.join(e.replace('.', r'\.') for e in PIL_EXTENSIONS) + ')'
+    )
+    image = tf.cond(
+        needs_pil,
+        lambda: tf.numpy_function(decode_with_pil, [path], tf.uint8),
+        lambda: tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
     )
+    image.set_shape([None, None, 3])
+    # Nearest-neighbour resize, like flow_from_directory
+    image = tf.image.resize(image, IMG_SIZE, method='nearest')
+    return tf.cast(image, tf.uint8), label
+
+
+def load_shard_batch(positions, labels):
+    """Gather a batch of pre-decoded uint8 images from the memory-mapped shards"""
+    images = tf.numpy_function(shards.images, [positions], tf.uint8)
+    images.set_shape([None, IMG_SIZE[0], IMG_SIZE[1], 3])
+    return images, labels
+
 
-    print(f"✓ Training samples: {train_data.samples}")
-    print(f"✓ Validation samples: {val_data.samples}")
-    print(f"✓ Classes: {train_data.class_indices}")
+def image_batches(paths, labels):
+    """Un-augmented uint8 batches in the given order (decoded files, or rows of the shards)"""
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if shards is not None:
+        ds = ds.batch(BATCH_SIZE).map(load_shard_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+        ds = ds.map(load_image, num_parallel_calls=tf.data.AUTOTUNE).batch(BATCH_SIZE)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+# Same transformations as the ImageDataGenerator, applied to whole batches on the graph
+augment = tf.keras.Sequential([
+    tf.keras.layers.RandomRotation(20 / 360, fill_mode='nearest'),
+    tf.keras.layers.RandomTranslation(0.2, 0.2, fill_mode='nearest'),
+    tf.keras.layers.RandomZoom(0.15, fill_mode='nearest'),
+    tf.keras.layers.RandomFlip('horizontal'),
+])
+
+
+def make_dataset(directory, subset, num_classes=3):
+    """
+    Parallel decode -> cache -> shuffle -> batch -> augment -> prefetch
+    (with --shards: shuffle -> batch -> gather from the shards -> augment -> prefetch)
+    """
+    paths, labels, class_indices = list_split(directory, subset)
+    training = subset == 'training'
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if shards is not None:
+        # Already decoded and resized; the page cache keeps the shards in memory
+        if training:
+            ds = ds.shuffle(len(paths), reshuffle_each_iteration=True)
+        ds = ds.batch(BATCH_SIZE).map(load_shard_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+        ds = ds.map(load_image, num_parallel_calls=tf.data.AUTOTUNE)
+        cache_file = f"{args.cache_file}.{subset}" if args.cache_file else ""
+        ds = ds.cache(cache_file)
+        if training:
+            ds = ds.shuffle(len(paths), reshuffle_each_iteration=True)
+        ds = ds.batch(BATCH_SIZE, num_parallel_calls=tf.data.AUTOTUNE)
+
+    def to_model_input(images, labels):
+        images = tf.cast(images, tf.float32)
+        if training:
+            images = augment(images, training=True)
+        return images / 255.0, tf.one_hot(labels, num_classes)
+
+    ds = ds.map(to_model_input, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE), len(paths), class_indices
+
+
+try:
+    if args.head_only:
+        # Images are read once, during feature extraction (STEP 2b)
+        train_paths, train_labels, class_indices = list_split(dataset_path, 'training')
+        val_paths, val_labels, _ = list_split(dataset_path, 'validation')
+        train_samples, val_samples = len(train_paths), len(val_paths)
+    elif args.pipeline == "tfdata":
+        train_data, train_samples, class_indices = make_dataset(dataset_path, 'training')
+        val_data, val_samples, _ = make_dataset(dataset_path, 'validation')
+    else:
+        datagen = ImageDataGenerator(
+            rescale=1./255,
+            validation_split=VALIDATION_SPLIT,
+            rotation_range=20,
+            width_shift_range=0.2,
+            height_shift_range=0.2,
+            zoom_range=0.15,
+            horizontal_flip=True,
+            fill_mode='nearest'
+        )
+
+        train_data = datagen.flow_from_directory(
+            dataset_path,
+            target_size=IMG_SIZE,
+            batch_size=BATCH_SIZE,
+            class_mode='categorical',
+            subset='training',
+            shuffle=True
+        )
+
+        val_data = datagen.flow_from_directory(
+            dataset_path,
+            target_size=IMG_SIZE,
+            batch_size=BATCH_SIZE,
+            class_mode='categorical',
+            subset='validation',
+            shuffle=False
+        )
+        train_samples, val_samples, class_indices = train_data.samples, val_data.samples, train_data.class_indices
+
+    print(f"✓ Input pipeline: {'cached backbone features' if args.head_only else args.pipeline}")
+    print(f"✓ Training samples: {train_samples}")
+    print(f"✓ Validation samples: {val_samples}")
+    print(f"✓ Classes: {class_indices}")
 
 except Exception as e:
     print(f"❌ ERROR loading data: {e}")
@@ -99,14 +259,24 @@ for layer in base_model.layers:
 
 print("✓ Loaded MobileNetV2 base model")
 
-# Add custom classification layers
-x = base_model.output
-x = GlobalAveragePooling2D()(x)
-x = Dense(256, activation='relu')(x)
-x = Dropout(0.5)(x)
-x = Dense(128, activation='relu')(x)
-x = Dropout(0.3)(x)
-output = Dense(3, activation='softmax')(x)  # 3 classes
+# Add custom classification layers (kept as a list so --head-only can train them on cached features)
+pooling = GlobalAveragePooling2D()
+head_layers = [
+    Dense(256, activation='relu'),
+    Dropout(0.5),
+    Dense(128, activation='relu'),
+    Dropout(0.3),
+    Dense(3, activation='softmax'),  # 3 classes
+]
+
+
+def apply_head(x):
+    for layer in head_layers:
+        x = layer(x)
+    return x
+
+
+output = apply_head(pooling(base_model.output))
 
 model = Model(inputs=base_model.input, outputs=output)
 
@@ -122,12 +292,109 @@ model.compile(
 print("✓ Model compiled")
 print(f"✓ Total parameters: {model.count_params():,}")
 
+
+def extract_features(feature_cache, paths, hashes):
+    """Run the frozen backbone over images not cached yet: the original, then variants-1 augmented views"""
+    extractor = Model(inputs=base_model.input, outputs=pooling(base_model.output))
+    start = 0
+    for images, _ in image_batches(paths, [0] * len(paths)):
+        images = tf.cast(images, tf.float32)
+        views = [images] + [augment(images, training=True) for _ in range(feature_cache.variants - 1)]
+        features = np.stack([extractor(view / 255.0, training=False).numpy() for view in views], axis=1)
+        feature_cache.append(hashes[start:start + len(features)], features)
+        start += len(features)
+        print(f"  {start}/{len(paths)} images", end="\r")
+    print()
+
+
+class VariantSampler(tf.keras.utils.Sequence):
+    """Batches of cached features, drawing one of the cached views of every image each epoch"""
+
+    def __init__(self, features, rows, labels, batch_size):
+        """
+        :param features: (rows, dim) feature matrix (memory-mapped)
+        :param rows: (images, variants) row numbers of each image's cached views
+        :param labels: one-hot labels per image
+        """
+        super().__init__()
+        self.features = features
+        self.rows = rows
+        self.labels = labels
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng()
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(len(self.rows) / self.batch_size)
+
+    def __getitem__(self, index):
+        batch = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        return self.features[self.epoch_rows[batch]], self.labels[batch]
+
+    def on_epoch_end(self):
+        self.order = self.rng.permutation(len(self.rows))
+        variants = self.rng.integers(0, self.rows.shape[1], size=len(self.rows))
+        self.epoch_rows = self.rows[np.arange(len(self.rows)), variants]
+
+
+class FullModelCheckpoint(ModelCheckpoint):
+    """ModelCheckpoint that saves the full image model while fit() trains only its head"""
+
+    def __init__(self, full_model, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.full_model = full_model
+
+    def set_model(self, model):
+        super().set_model(self.full_model)
+
+
+if args.head_only:
+    print("\n" + "=" * 60)
+    print("STEP 2b: Caching Backbone Features")
+    print("=" * 60)
+
+    # Shards are resized with PIL at compile time, image folders with tf nearest-neighbour
+    resize = "shards" if shards is not None else "nearest"
+    backbone_version = (f"mobilenetv2-{IMG_SIZE[0]}-{resize}-rescale255-{AUGMENT_VERSION}-"
+                        f"{weights_hash(base_model.get_weights())}")
+    feature_cache = FeatureCache(args.feature_cache, backbone_version, variants=max(1, args.variants))
+    if shards is not None:
+        train_hashes = [shards.records[i]["content_hash"] for i in train_paths]
+        val_hashes = [shards.records[i]["content_hash"] for i in val_paths]
+    else:
+        train_hashes = [file_hash(p) for p in train_paths]
+        val_hashes = [file_hash(p) for p in val_paths]
+    all_paths, all_hashes = train_paths + val_paths, train_hashes + val_hashes
+    missing = feature_cache.missing(all_hashes)
+    print(f"✓ Feature cache: {feature_cache.folder} ({len(feature_cache)} cached, {len(missing)} to extract)")
+    if missing:
+        extract_features(feature_cache, [all_paths[i] for i in missing], [all_hashes[i] for i in missing])
+
+    features = feature_cache.matrix()
+    train_features = VariantSampler(
+        features,
+        feature_cache.rows(train_hashes, variants=range(feature_cache.variants)),
+        tf.keras.utils.to_categorical(train_labels, 3),
+        BATCH_SIZE
+    )
+    val_features = (features[feature_cache.rows(val_hashes)], tf.keras.utils.to_categorical(val_labels, 3))
+
+    feature_input = tf.keras.Input(shape=(features.shape[1],))
+    head_model = Model(inputs=feature_input, outputs=apply_head(feature_input))
+    head_model.compile(
+        optimizer=Adam(learning_rate=0.0001),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    print(f"✓ Head-only training on {features.shape[1]}-d features ({head_model.count_params():,} parameters)")
+
 # 3️⃣ Setup callbacks
 print("\n" + "=" * 60)
 print("STEP 3: Setting up Training Callbacks")
 print("=" * 60)
 
-checkpoint = ModelCheckpoint(
+checkpoint_class = partial(FullModelCheckpoint, model) if args.head_only else ModelCheckpoint
+checkpoint = checkpoint_class(
     'best_imaging_model.keras',
     monitor='val_accuracy',
     save_best_only=True,
@@ -142,6 +409,14 @@ early_stop = EarlyStopping(
     verbose=1
 )
 
+# Images/sec, input wait vs. compute and peak RSS per epoch, logged next to the checkpoint
+throughput = ThroughputMonitor(
+    'best_imaging_model.keras',
+    batch_size=BATCH_SIZE,
+    run_info={"pipeline": "feature-cache" if args.head_only else args.pipeline,
+              "head_only": args.head_only, "shards": args.shards or None}
+)
+
 print("✓ Callbacks configured")
 
 # 4️⃣ Train model
@@ -152,13 +427,23 @@ print("This may take 10-30 minutes depending on your hardware...")
 print()
 
 try:
-    history = model.fit(
-        train_data,
-        validation_data=val_data,
-        epochs=20,
-        callbacks=[checkpoint, early_stop],
-        verbose=1
-    )
+    if args.head_only:
+        # The head layers are shared with `model`, so the full model is trained too
+        history = head_model.fit(
+            throughput.wrap(train_features),
+            validation_data=val_features,
+            epochs=20,
+            callbacks=[checkpoint, early_stop, throughput],
+            verbose=1
+        )
+    else:
+        history = model.fit(
+            throughput.wrap(train_data),
+            validation_data=val_data,
+            epochs=20,
+            callbacks=[checkpoint, early_stop, throughput],
+            verbose=1
+        )
 
     # 5️⃣ Save final model
     print("\n" + "=" * 60)